@@ -1 +1,2 @@
-from .db_utils import connect_to_db, connect_to_dataset, get_or_create_client
\ No newline at end of file
+from .db_utils import connect_to_db, connect_to_dataset, get_client_id, get_or_create_client, write_transaction, lock_stats
+from .embeddings import encode_embedding, decode_embedding
\ No newline at end of file
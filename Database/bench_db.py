@@ -0,0 +1,162 @@
+# ############################################################################ #
+#                              MAINTENANCE HISTORY                             #
+# ############################################################################ #
+# DATE         Description
+# ------------ -----------------------------------------------------------------
+# 18-OCT-2026  Initial Draft
+# ============================================================================ #
+
+# ================================== IMPORTS ================================= #
+import os
+import re
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+import statistics
+from datetime import datetime, timedelta
+
+from Database.db_utils import apply_pragmas
+
+# ================================= CONSTANTS ================================ #
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "schema.sql")
+INDEX_RE = re.compile(r"^CREATE INDEX .*?;\s*$", re.MULTILINE)
+
+MEMORY_TYPES = ("daily", "weekly", "monthly", "quarterly")
+EMBEDDING = bytes(384 * 4)
+
+# Name, SQL and a function returning fresh parameters
+QUERIES = (
+	("unreplied mails of a client",
+	 "SELECT * FROM emails WHERE client_id = ? AND responded = 0 ORDER BY id",
+	 lambda ctx: (random.randint(1, ctx['clients']),)),
+	("mails of a client in a day",
+	 "SELECT * FROM emails WHERE client_id = ? AND time_received > ? AND time_received < ? ORDER BY id",
+	 lambda ctx: (random.randint(1, ctx['clients']), *day_range(ctx))),
+	("dedup of 500 message ids",
+	 "SELECT message_id FROM emails WHERE message_id IN ({})".format(",".join("?" * 500)),
+	 lambda ctx: tuple(f"<{random.randint(0, 2 * ctx['emails'])}@bench>" for _ in range(500))),
+	("latest memories of a type",
+	 "SELECT * FROM memories WHERE client_id = ? AND memory_type = ? ORDER BY id DESC LIMIT 5",
+	 lambda ctx: (random.randint(1, ctx['clients']), random.choice(MEMORY_TYPES))),
+	("memory embeddings of a client",
+	 "SELECT memory_id, embedding FROM memory_embeddings WHERE client_id = ?",
+	 lambda ctx: (random.randint(1, ctx['clients']),)),
+)
+
+# ================================= FUNCTIONS ================================ #
+def day_range(ctx):
+	day = ctx['start'] + timedelta(days=random.randint(0, ctx['days'] - 1))
+	return day, day + timedelta(days=1)
+
+def build(path, emails, clients, memories):
+	"""Creates a DB from schema.sql without its indexes, filled with synthetic rows."""
+	with open(SCHEMA_PATH, "r") as fp:
+		schema = fp.read()
+	conn = sqlite3.connect(path)
+	conn.executescript(INDEX_RE.sub("", schema))
+
+	start = datetime(2024, 1, 1)
+	days = 365
+	conn.executemany(
+		"INSERT INTO clients (name, email) VALUES (?, ?)",
+		((f"Client {i}", f"client{i}@bench") for i in range(1, clients + 1)),
+	)
+	conn.executemany(
+		"INSERT INTO emails (client_id, message_id, to_addr, from_addr, subject, body, time_received, responded) "
+		"VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+		((
+			random.randint(1, clients),
+			f"<{i}@bench>",
+			"bot@bench",
+			"client@bench",
+			f"Subject {i}",
+			"lorem ipsum " * 40,
+			start + timedelta(seconds=random.randint(0, days * 86400)),
+			int(random.random() > 0.01),
+		) for i in range(emails)),
+	)
+	conn.executemany(
+		"INSERT INTO memories (client_id, memory_type, period_start, period_end, text) VALUES (?, ?, ?, ?, ?)",
+		((
+			random.randint(1, clients),
+			random.choice(MEMORY_TYPES),
+			start.date(),
+			start.date(),
+			"summary " * 100,
+		) for _ in range(memories)),
+	)
+	conn.execute(
+		"INSERT INTO memory_embeddings (memory_id, client_id, model, embedding, format, dtype, dim) "
+		"SELECT id, client_id, 'bench', ?, 1, 'f4', 384 FROM memories",
+		(EMBEDDING,),
+	)
+	conn.commit()
+	conn.close()
+	return dict(clients=clients, emails=emails, start=start, days=days)
+
+def time_queries(conn, ctx, repeat):
+	"""Returns {query name: median milliseconds}."""
+	timings = {}
+	for name, sql, params in QUERIES:
+		samples = []
+		for _ in range(repeat):
+			args = params(ctx)
+			t0 = time.perf_counter()
+			conn.execute(sql, args).fetchall()
+			samples.append((time.perf_counter() - t0) * 1000)
+		timings[name] = statistics.median(samples)
+	return timings
+
+def time_writes(conn, count):
+	"""Returns milliseconds per single-row committed insert."""
+	t0 = time.perf_counter()
+	for i in range(count):
+		conn.execute(
+			"INSERT INTO emails (client_id, message_id, to_addr, from_addr, body) VALUES (1, ?, 'a', 'b', 'c')",
+			(f"<write-{time.time_ns()}-{i}@bench>",),
+		)
+		conn.commit()
+	return (time.perf_counter() - t0) * 1000 / count
+
+def run(path, emails, clients, memories, repeat, writes):
+	print(f"Building {emails} mails, {memories} memories for {clients} clients in {path}")
+	ctx = build(path, emails, clients, memories)
+
+	conn = sqlite3.connect(path)
+	before = time_queries(conn, ctx, repeat)
+	before_write = time_writes(conn, writes)
+	conn.close()
+
+	conn = sqlite3.connect(path)
+	apply_pragmas(conn)
+	with open(SCHEMA_PATH, "r") as fp:
+		for statement in INDEX_RE.findall(fp.read()):
+			conn.execute(statement)
+	conn.execute("ANALYZE")
+	conn.commit()
+	after = time_queries(conn, ctx, repeat)
+	after_write = time_writes(conn, writes)
+	conn.close()
+
+	print(f"\n{'query':<32}{'before ms':>12}{'after ms':>12}{'speedup':>10}")
+	for name in before:
+		print(f"{name:<32}{before[name]:>12.3f}{after[name]:>12.3f}{before[name] / max(after[name], 1e-6):>9.1f}x")
+	print(f"{'committed insert':<32}{before_write:>12.3f}{after_write:>12.3f}{before_write / max(after_write, 1e-6):>9.1f}x")
+
+# =================================== MAIN =================================== #
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Time the hot queries before and after the indexes and pragmas")
+	parser.add_argument("--emails", type=int, default=100_000)
+	parser.add_argument("--clients", type=int, default=50)
+	parser.add_argument("--memories", type=int, default=20_000)
+	parser.add_argument("--repeat", type=int, default=50, help="Runs per query, the median is reported")
+	parser.add_argument("--writes", type=int, default=200, help="Single-row transactions to time")
+	parser.add_argument("--path", help="DB file to create, a temporary one by default")
+	args = parser.parse_args()
+
+	random.seed(0)
+	with tempfile.TemporaryDirectory() as tmp:
+		path = args.path or os.path.join(tmp, "bench.sqlite3")
+		run(path, args.emails, args.clients, args.memories, args.repeat, args.writes)
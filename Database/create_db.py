@@ -4,10 +4,16 @@
 # DATE         Description
 # ------------ -----------------------------------------------------------------
 # 08-MAR-2025  Initial Draft
+# 18-OCT-2026  Add in-place schema migration
+# 18-OCT-2026  Create tables added to schema.sql during migration
+# 18-OCT-2026  Create the query indexes and refresh statistics during migration
+# 18-OCT-2026  Add the reply backoff columns of table 'emails'
+# 18-OCT-2026  Add the client list hash of table 'sync_state'
 # ============================================================================ #
 
 # ================================== IMPORTS ================================= #
 import os
+import re
 import sys
 
 from Logging import logger_init
@@ -21,6 +27,21 @@ DBPATH = os.environ["Db"]
 CREATE_SCHEMA_PATH = os.path.join(DBPATH, "schema.sql")
 DROP_SCHEMA_PATH = os.path.join(DBPATH, "drop_db.sql")
 
+# Columns added after the initial schema, as (table, column, definition)
+MIGRATION_COLUMNS = (
+	("emails", "reply_attempts", "INTEGER NOT NULL DEFAULT 0"),
+	("emails", "retry_after", "DATETIME"),
+	("sync_state", "clients_hash", "VARCHAR(64)"),
+	("email_embeddings", "format", "INTEGER"),
+	("email_embeddings", "dtype", "VARCHAR(10)"),
+	("email_embeddings", "dim", "INTEGER"),
+	("email_embeddings", "scale", "REAL"),
+	("memory_embeddings", "format", "INTEGER"),
+	("memory_embeddings", "dtype", "VARCHAR(10)"),
+	("memory_embeddings", "dim", "INTEGER"),
+	("memory_embeddings", "scale", "REAL"),
+)
+
 # ================================== CLASSES ================================= #
 # ================================= FUNCTIONS ================================ #
 def drop_tables(conn, curr):
@@ -46,9 +67,40 @@ def create_tables(conn, curr):
 		LOGGER.error(f"Error while creating tables: {e}")
 		conn.rollback()
 		sys.exit(1)
+
+def count_indexes(curr):
+	return curr.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'index'").fetchone()[0]
+
+def migrate_tables(conn, curr):
+	"""Brings an existing database up to schema.sql without dropping data."""
+	try:
+		LOGGER.debug("Migrating existing tables")
+		# Create tables added since, leaving existing ones alone
+		indexes = count_indexes(curr)
+		with open(CREATE_SCHEMA_PATH, "r") as fp:
+			curr.executescript(re.sub(r"CREATE (TABLE|INDEX) (?!IF NOT EXISTS)", r"CREATE \1 IF NOT EXISTS ", fp.read()))
+		if count_indexes(curr) > indexes:
+			LOGGER.info(f"Created {count_indexes(curr) - indexes} missing indexes")
+		for table, column, definition in MIGRATION_COLUMNS:
+			columns = [row[1] for row in curr.execute(f"PRAGMA table_info({table})")]
+			if columns and column not in columns:
+				LOGGER.info(f"Adding column '{column}' to table '{table}'")
+				curr.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+		# Let the query planner see the new indexes
+		curr.execute("ANALYZE")
+		conn.commit()
+		LOGGER.info("Tables migrated successfully")
+	except Exception as e:
+		LOGGER.error(f"Error while migrating tables: {e}")
+		conn.rollback()
+		sys.exit(1)
+
 # =================================== MAIN =================================== #
 if __name__ == "__main__":
 	conn, curr = connect_to_db()
 
-	drop_tables(conn, curr)
-	create_tables(conn, curr)
+	if "--migrate" in sys.argv[1:]:
+		migrate_tables(conn, curr)
+	else:
+		drop_tables(conn, curr)
+		create_tables(conn, curr)
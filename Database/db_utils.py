@@ -4,30 +4,88 @@
 # DATE         Description
 # ------------ -----------------------------------------------------------------
 # 08-MAR-2025  Initial Draft
+# 18-OCT-2026  Share one dataset connection per process, cache client ids
+# 18-OCT-2026  Apply WAL and performance pragmas on every connection
+# 18-OCT-2026  Retry writes blocked by other jobs and record lock waits
+# 18-OCT-2026  Time every lock wait and log the counters periodically
 # ============================================================================ #
 
 # ================================== IMPORTS ================================= #
 import os
 import sys
+import time
+import atexit
+import random
 import sqlite3
+import threading
 
 import dataset
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import QueuePool
 
 from Logging import logger_init
+from utils import load_config
 
 # ============================= GLOBAL VARIABLES ============================= #
 LOGGER = logger_init("Database")
 
+# The process's dataset connection, see connect_to_dataset
+DB = None
+DB_PID = None
+DB_LOCK = threading.Lock()
+
+# email -> client id, clients never change ids
+CLIENT_IDS = {}
+CLIENTS_LOADED = False
+CLIENTS_LOCK = threading.Lock()
+
+# Writes that had to wait for another job's lock, see write_transaction
+LOCK_STATS = dict(transactions=0, waits=0, retries=0, failures=0, wait_seconds=0.0, max_wait_seconds=0.0)
+LOCK_STATS_LOCK = threading.Lock()
+LOCK_STATS_LOGGED = time.monotonic()
+
 # ================================= CONSTANTS ================================ #
 DBPATH = os.environ["Db"]
 DATAPATH = os.environ["Data"]
 
+POOLCFG = load_config().get("Database", {}).get("Pool", {})
+# dataset holds one connection per thread that used it
+POOL_SIZE = POOLCFG.get("Size", 8)
+POOL_OVERFLOW = POOLCFG.get("MaxOverflow", 16)
+
+WRITECFG = load_config().get("Database", {}).get("Write", {})
+# SQLite itself waits this long for a lock before raising 'database is locked'
+BUSY_TIMEOUT = WRITECFG.get("BusyTimeout", 5000)
+# Then the whole transaction is retried with exponential backoff
+WRITE_RETRIES = WRITECFG.get("Retries", 5)
+BACKOFF_START = WRITECFG.get("BackoffStart", 0.1)
+BACKOFF_MAX = WRITECFG.get("BackoffMax", 5.0)
+# Taking the write lock faster than this is not counted as a wait
+WAIT_THRESHOLD = WRITECFG.get("WaitThreshold", 0.01)
+# Seconds between logs of the lock counters, the daemon never exits
+STATS_INTERVAL = WRITECFG.get("StatsInterval", 3600)
+
+# Set on every new connection. WAL lets readers run next to the writer, and
+# with it synchronous=NORMAL only syncs at checkpoints while staying durable
+# against application crashes.
+PRAGMAS = {
+	"journal_mode": "WAL",
+	"synchronous": "NORMAL",
+	"mmap_size": 256 << 20,
+	"cache_size": -64 << 10,	# in KiB when negative
+	"temp_store": "MEMORY",
+	"busy_timeout": BUSY_TIMEOUT,
+	**load_config().get("Database", {}).get("Pragmas", {}),
+}
+
 # ================================== CLASSES ================================= #
 # ================================= FUNCTIONS ================================ #
 def connect_to_db():
 	LOGGER.debug("Connecting to the database...")
 	try:
-		conn = sqlite3.connect(os.path.join(DBPATH, "db.sqlite3"))
+		conn = sqlite3.connect(os.path.join(DBPATH, "db.sqlite3"), timeout=BUSY_TIMEOUT / 1000)
+		apply_pragmas(conn)
 		curr = conn.cursor()
 		LOGGER.info("Successfully Connected")
 	except Exception as e:
@@ -36,27 +94,172 @@ def connect_to_db():
 	return conn, curr
 
 def connect_to_dataset():
-	LOGGER.debug("Connecting to the database via dataset...")
-	try:
-		db = dataset.connect(f"sqlite:///{os.path.join(DBPATH, 'db.sqlite3')}")
-		LOGGER.info("Successfully Connected via dataset")
-	except Exception as e:
-		LOGGER.error(f"Error while connecting to the database via dataset: {e}")
-		sys.exit(1)
-	return db
+	"""
+	Returns the process-wide dataset connection, created on first use and
+	again after a fork. dataset keeps a connection and transaction per
+	thread, so threads can share it; connections of finished threads are
+	handed back to the pool here.
+	"""
+	global DB, DB_PID, CLIENTS_LOADED
+	with DB_LOCK:
+		if DB is not None and DB_PID == os.getpid():
+			release_dead_connections(DB)
+			return DB
 
-def get_or_create_client(client, client_name):
+		LOGGER.debug("Connecting to the database via dataset...")
+		try:
+			DB = dataset.connect(
+				f"sqlite:///{os.path.join(DBPATH, 'db.sqlite3')}",
+				engine_kwargs=dict(poolclass=QueuePool, pool_size=POOL_SIZE, max_overflow=POOL_OVERFLOW),
+			)
+			event.listen(DB.engine, "connect", apply_pragmas)
+			LOGGER.info("Successfully Connected via dataset")
+		except Exception as e:
+			LOGGER.error(f"Error while connecting to the database via dataset: {e}")
+			sys.exit(1)
+		DB_PID = os.getpid()
+
+	# A forked child starts over with its own map
+	with CLIENTS_LOCK:
+		CLIENT_IDS.clear()
+		CLIENTS_LOADED = False
+	return DB
+
+def apply_pragmas(conn, *_):
+	"""Applies PRAGMAS to a sqlite3 connection, also used as a SQLAlchemy connect hook."""
+	for name, value in PRAGMAS.items():
+		conn.execute(f"PRAGMA {name}={value}")
+
+def release_dead_connections(db):
+	alive = {thread.ident for thread in threading.enumerate()}
+	with db.lock:
+		for ident in [ident for ident in db.connections if ident not in alive]:
+			try:
+				db.connections.pop(ident).close()
+			except Exception as e:
+				LOGGER.warning(f"Could not close connection of finished thread {ident}: {e}")
+
+def is_locked(error):
+	message = str(error).lower()
+	return "database is locked" in message or "database is busy" in message
+
+def begin_immediate(db):
+	"""
+	Takes SQLite's write lock for the transaction just begun on db and
+	returns the seconds spent waiting for it. SQLite would otherwise take
+	the lock at the first write, somewhere inside fn, where the time the
+	busy timeout absorbs can't be told apart from the work.
+	"""
+	started = time.monotonic()
+	if not db.executable.connection.driver_connection.in_transaction:
+		db.executable.exec_driver_sql("BEGIN IMMEDIATE")
+	return time.monotonic() - started
+
+def write_transaction(db, fn, *args, **kwargs):
+	"""
+	Runs fn(*args, **kwargs) in a transaction of db and commits it. When
+	another process holds the write lock past BUSY_TIMEOUT, the transaction
+	is rolled back and run again after a backoff, up to WRITE_RETRIES times.
+	fn must therefore only write to the DB; anything else belongs after the
+	call. Inside an open transaction fn just runs, the outer one retries.
+
+	The write lock is taken up front, so the recorded wait is the time
+	blocked on it in every attempt plus the backoffs between them.
+	"""
+	if db.in_transaction:
+		return fn(*args, **kwargs)
+
+	waited = 0.0
+	for attempt in range(1, WRITE_RETRIES + 2):
+		db.begin()
+		started = time.monotonic()
+		try:
+			waited += begin_immediate(db)
+			result = fn(*args, **kwargs)
+			db.commit()
+		except (OperationalError, sqlite3.OperationalError) as e:
+			db.rollback()
+			if not is_locked(e):
+				raise
+			# Blocked for about the busy timeout, in BEGIN or a later statement
+			waited += time.monotonic() - started
+			if attempt > WRITE_RETRIES:
+				record_lock_wait(waited, attempt - 1, failed=True)
+				LOGGER.error(f"Gave up on a write after {attempt} attempts and {waited:.1f}s waiting for the DB lock")
+				raise
+			delay = min(BACKOFF_START * 2 ** (attempt - 1), BACKOFF_MAX) * random.uniform(0.5, 1.5)
+			LOGGER.warning(f"DB locked by another job, retrying write in {delay:.2f}s (attempt {attempt})")
+			time.sleep(delay)
+			waited += delay
+			continue
+		except Exception:
+			db.rollback()
+			raise
+		record_lock_wait(waited, attempt - 1)
+		return result
+
+def record_lock_wait(seconds, retries, failed=False):
+	global LOCK_STATS_LOGGED
+
+	waited = retries or seconds >= WAIT_THRESHOLD
+	with LOCK_STATS_LOCK:
+		LOCK_STATS['transactions'] += 1
+		LOCK_STATS['failures'] += failed
+		if waited:
+			LOCK_STATS['waits'] += 1
+			LOCK_STATS['retries'] += retries
+			LOCK_STATS['wait_seconds'] += seconds
+			LOCK_STATS['max_wait_seconds'] = max(LOCK_STATS['max_wait_seconds'], seconds)
+		report = time.monotonic() - LOCK_STATS_LOGGED >= STATS_INTERVAL
+		if report:
+			LOCK_STATS_LOGGED = time.monotonic()
+	if waited and not failed:
+		LOGGER.info(f"Write committed after waiting {seconds:.2f}s for the DB lock ({retries} retries)")
+	if report:
+		log_lock_stats()
+
+def lock_stats():
+	"""Returns a copy of the lock wait counters of this process."""
+	with LOCK_STATS_LOCK:
+		return dict(LOCK_STATS)
+
+@atexit.register
+def log_lock_stats():
+	stats = lock_stats()
+	if stats['waits'] or stats['failures']:
+		LOGGER.info(f"DB lock waits: {stats}")
+
+def get_client_id(client):
+	"""Returns the id of the client with this email, or None if unknown."""
+	global CLIENTS_LOADED
 	db = connect_to_dataset()
+	with CLIENTS_LOCK:
+		if not CLIENTS_LOADED:
+			CLIENT_IDS.update((row['email'], row['id']) for row in db['clients'].all())
+			CLIENTS_LOADED = True
+		if client in CLIENT_IDS:
+			return CLIENT_IDS[client]
+
+	# Added since the map was loaded, possibly by another process
+	row = db['clients'].find_one(email=client)
+	if row is None:
+		return None
+	with CLIENTS_LOCK:
+		CLIENT_IDS[client] = row['id']
+	return row['id']
+
+def get_or_create_client(client, client_name):
 	try:
-		client_id = db['clients'].find_one(email=client)
+		client_id = get_client_id(client)
+		if client_id is None:
+			db = connect_to_dataset()
+			client_id = write_transaction(db, db['clients'].insert, dict(
+				name=client_name,
+				email=client
+			))
+			with CLIENTS_LOCK:
+				CLIENT_IDS[client] = client_id
 	except Exception as e:
 		LOGGER.error(f"Could not get Client ID for {client}, {e}")
 		return -1
-	if client_id is None:
-		db['clients'].insert(dict(
-			name=client_name,
-			email=client
-		))
-		client_id = db['clients'].find_one(email=client)
-	client_id = client_id['id']
-	return client_id
\ No newline at end of file
+	return client_id
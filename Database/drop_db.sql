@@ -4,4 +4,6 @@ DROP TABLE IF EXISTS email_embeddings;
 DROP TABLE IF EXISTS memories;
 DROP TABLE IF EXISTS memory_embeddings;
 DROP TABLE IF EXISTS memory_membership;
-DROP TABLE IF EXISTS obsidian_changes_history;
\ No newline at end of file
+DROP TABLE IF EXISTS obsidian_changes_history;
+DROP TABLE IF EXISTS sync_state;
+DROP TABLE IF EXISTS outbox;
\ No newline at end of file
@@ -0,0 +1,80 @@
+# ############################################################################ #
+#                              MAINTENANCE HISTORY                             #
+# ############################################################################ #
+# DATE         Description
+# ------------ -----------------------------------------------------------------
+# 18-OCT-2026  Initial Draft
+# 18-OCT-2026  Name int8 "i1" as NumPy does, "i8" is int64
+# ============================================================================ #
+
+# ================================== IMPORTS ================================= #
+import pickle
+
+import numpy as np
+
+from Logging import logger_init
+from utils import load_config
+
+# ============================= GLOBAL VARIABLES ============================= #
+LOGGER = logger_init("Database")
+
+# ================================= CONSTANTS ================================ #
+# Rows with format NULL hold the legacy pickled NumPy arrays
+FORMAT_VERSION = 1
+
+# Little-endian element types for the raw embedding bytes
+DTYPES = {
+	"f4": np.dtype("<f4"),
+	"f2": np.dtype("<f2"),
+	"i1": np.dtype("i1"),
+}
+DEFAULT_DTYPE = load_config().get("Database", {}).get("EmbeddingDtype", "f4")
+
+# ================================= FUNCTIONS ================================ #
+def encode_embedding(vector, dtype=DEFAULT_DTYPE):
+	"""
+	Returns the embedding columns of an email/memory embeddings row.
+	int8 vectors are scaled symmetrically, the scale is kept with the row.
+	"""
+	vector = np.asarray(vector, dtype=np.float32).ravel()
+
+	scale = None
+	if dtype == "i1":
+		scale = float(np.abs(vector).max()) / 127 or 1.0
+		data = np.round(vector / scale).astype(DTYPES[dtype])
+	else:
+		data = vector.astype(DTYPES[dtype])
+
+	return dict(
+		embedding=data.tobytes(),
+		format=FORMAT_VERSION,
+		dtype=dtype,
+		dim=len(vector),
+		scale=scale,
+	)
+
+def decode_embedding(row):
+	"""Returns the row's embedding as a float32 vector."""
+	if row.get("format") is None:
+		vector = pickle.loads(row["embedding"])
+		# MailServer.main used to pickle the whole llama.cpp response
+		if isinstance(vector, dict):
+			vector = vector["data"][0]["embedding"]
+		return np.asarray(vector, dtype=np.float32).ravel()
+
+	if row["format"] != FORMAT_VERSION:
+		raise ValueError(f"Unknown embedding format {row['format']}")
+
+	dtype = row.get("dtype") or "f4"
+	vector = np.frombuffer(row["embedding"], dtype=DTYPES[dtype], count=row.get("dim") or -1)
+	if dtype == "f4":
+		# Already the right type, no copy made
+		return vector
+	vector = vector.astype(np.float32)
+	if dtype == "i1":
+		vector *= row.get("scale") or 1.0
+	return vector
+
+# =================================== MAIN =================================== #
+if __name__ == "__main__":
+	pass
@@ -0,0 +1,82 @@
+# ############################################################################ #
+#                              MAINTENANCE HISTORY                             #
+# ############################################################################ #
+# DATE         Description
+# ------------ -----------------------------------------------------------------
+# 18-OCT-2026  Initial Draft
+# ============================================================================ #
+
+# ================================== IMPORTS ================================= #
+import sys
+import argparse
+
+from Logging import logger_init
+from Database import connect_to_db, encode_embedding, decode_embedding
+from Database.create_db import migrate_tables
+from Database.embeddings import DTYPES, DEFAULT_DTYPE
+
+# ============================= GLOBAL VARIABLES ============================= #
+LOGGER = logger_init("Database")
+
+# ================================= CONSTANTS ================================ #
+TABLES = ("email_embeddings", "memory_embeddings")
+CHUNK_SIZE = 1000
+
+# ================================= FUNCTIONS ================================ #
+def migrate_table(conn, curr, table, dtype=DEFAULT_DTYPE, chunk_size=CHUNK_SIZE):
+	"""Re-encodes every row of table not already stored as dtype."""
+	LOGGER.debug(f"Re-encoding embeddings in '{table}' as {dtype}")
+	count = 0
+	last_rowid = 0
+	while True:
+		rows = curr.execute(
+			f"SELECT rowid, embedding, format, dtype, dim, scale FROM {table} "
+			"WHERE rowid > ? AND (format IS NULL OR dtype IS NOT ?) ORDER BY rowid LIMIT ?",
+			(last_rowid, dtype, chunk_size)
+		).fetchall()
+		if not rows:
+			break
+		last_rowid = rows[-1][0]
+
+		updates = []
+		for rowid, embedding, fmt, old_dtype, dim, scale in rows:
+			try:
+				vector = decode_embedding(dict(embedding=embedding, format=fmt, dtype=old_dtype, dim=dim, scale=scale))
+			except Exception as e:
+				LOGGER.error(f"Could not decode row {rowid} of '{table}', skipping: {e}")
+				continue
+			cols = encode_embedding(vector, dtype)
+			updates.append((cols["embedding"], cols["format"], cols["dtype"], cols["dim"], cols["scale"], rowid))
+
+		try:
+			curr.executemany(
+				f"UPDATE {table} SET embedding = ?, format = ?, dtype = ?, dim = ?, scale = ? WHERE rowid = ?",
+				updates
+			)
+			conn.commit()
+		except Exception as e:
+			LOGGER.error(f"Could not rewrite rows of '{table}': {e}")
+			conn.rollback()
+			sys.exit(1)
+		count += len(updates)
+		LOGGER.debug(f"Re-encoded {count} rows of '{table}'")
+
+	LOGGER.info(f"Re-encoded {count} rows of '{table}' as {dtype}")
+	return count
+
+# =================================== MAIN =================================== #
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Rewrite stored embeddings in the compact binary format")
+	parser.add_argument("--dtype", default=DEFAULT_DTYPE, choices=sorted(DTYPES))
+	parser.add_argument("--vacuum", action="store_true", help="Reclaim freed pages afterwards")
+	args = parser.parse_args()
+
+	conn, curr = connect_to_db()
+	migrate_tables(conn, curr)
+	for table in TABLES:
+		migrate_table(conn, curr, table, args.dtype)
+
+	if args.vacuum:
+		LOGGER.info("Vacuuming database")
+		conn.execute("VACUUM")
+	conn.close()
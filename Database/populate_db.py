@@ -4,23 +4,40 @@
 # DATE         Description
 # ------------ -----------------------------------------------------------------
 # 11-MAY-2025  Initial Draft
+# 18-OCT-2026  Embed backfilled mails in batches
+# 18-OCT-2026  Store embeddings in the binary format
+# 18-OCT-2026  Mirror embeddings to vector shards
+# 18-OCT-2026  Fetch by UID in bulk FETCH commands
+# 18-OCT-2026  Search all clients in one OR-composed SEARCH
+# 18-OCT-2026  Only backfill UIDs above the stored sync cursor
+# 18-OCT-2026  Backfill memories through the LLM.backfill scheduler
+# 18-OCT-2026  Stream mails through bounded fetch/parse/embed/insert stages
+# 18-OCT-2026  Write mails in one transaction per batch
+# 18-OCT-2026  Look up client ids in the cached map
+# 18-OCT-2026  Retry client inserts when the DB is locked
+# 18-OCT-2026  Keep the backfill sync cursor apart from the fetch one
 # ============================================================================ #
 
 # ================================== IMPORTS ================================= #
 import os
 import time
 import email
-import pickle
+import queue
+import itertools
+import threading
+from collections import defaultdict
 from datetime import timedelta, datetime, date
 
-import numpy as np
 from dotenv import load_dotenv
 from dateutil.relativedelta import relativedelta
 
 from Logging import logger_init
-from Database import connect_to_dataset
+from Database import connect_to_dataset, get_client_id, write_transaction
+from Database.writer import existing_message_ids, insert_emails
 from LLM import BaseEmbedder, BaseChatbot
 from MailServer import imap_auth, check_smtp_auth
+from MailServer.imap import fetch_raw, fetch_messages, FETCH_CHUNK
+from MailServer.sync import MailboxSync
 from utils import load_secrets, load_config, escape_special_chars
 
 # ============================= GLOBAL VARIABLES ============================= #
@@ -42,6 +59,7 @@ CLIENTNAMES = secrets["Mail"]["ClientNames"]
 del secrets
 
 MAILCFG   = load_config()["MailServer"]
+LLMCFG    = load_config()["LLM"]
 
 LLM_MODEL = os.getenv("LLM_MODEL")
 EMB_MODEL = os.getenv("EMB_MODEL")
@@ -51,71 +69,84 @@ def populate_clients():
 	count = 0
 	db = connect_to_dataset()
 	for (name, email) in zip(CLIENTNAMES, CLIENTS):
-		db.begin()
 		try:
-			db['clients'].insert_ignore(dict(
+			write_transaction(db, db['clients'].insert_ignore, dict(
 				name  = name,
 				email = email
 			),
 			keys=['email'])
-			db.commit()
 			count += 1
 		except Exception as e:
 			LOGGER.error(f"Could not insert client into table, {e}")
-			db.rollback()
 	LOGGER.info(f"Inserted {count} out of {len(CLIENTS)} clients")
 
-def populate_emails():
-	# Login to Zoho
-	imap_server = imap_auth()
-	check_smtp_auth()
-
-	# Connect to DB
-	db = connect_to_dataset()
-	email_table = db['emails']
-	email_embed_table = db['email_embeddings']
-
-	# Init Embedder
-	emb = BaseEmbedder(EMB_MODEL)
-
-	all_mails = []
-	for mailbox in ('inbox', 'sent'):
-		LOGGER.debug(f"Checking mails from '{mailbox}'")
-		imap_server = imap_auth()
-		imap_server.select(mailbox)
+def prefetch(items, maxsize):
+	"""
+	Iterates items on a background thread and yields them through a queue of
+	maxsize, so a stage never runs more than maxsize items ahead of the next.
+	"""
+	buffer = queue.Queue(maxsize=maxsize)
+	done = object()
 
-		for client in CLIENTS:
+	def produce():
+		try:
+			for item in items:
+				buffer.put((item, None))
+		except Exception as e:
+			buffer.put((done, e))
+			return
+		buffer.put((done, None))
+
+	threading.Thread(target=produce, daemon=True).start()
+	while True:
+		item, error = buffer.get()
+		if item is done:
+			if error is not None:
+				raise error
+			return
+		yield item
+
+def fetch_dates(imap_server, mailbox, uids, failed):
+	"""Returns (mail_date, mailbox, uid) of uids from their Date header only."""
+	dates = []
+	fetched = set()
+	for mail_id, _, header in fetch_raw(imap_server, uids, items="BODY.PEEK[HEADER.FIELDS (DATE)]"):
+		fetched.add(mail_id)
+		try:
+			mail_date = email.utils.parsedate_to_datetime(email.message_from_bytes(header or b"").get("Date"))
+			dates.append((mail_date, mailbox, mail_id))
+		except Exception as e:
+			LOGGER.error(f"Could not read date of mail {mail_id} in '{mailbox}': {e}")
+	failed[mailbox].update(set(uids) - fetched)
+	return dates
+
+def stream_mails(imap_servers, order, failed, chunk_size=FETCH_CHUNK):
+	"""
+	Yields (mailbox, uid, message) in the given order. Full mails are
+	fetched chunk_size at a time, with one UID FETCH per mailbox per chunk.
+	"""
+	for i in range(0, len(order), chunk_size):
+		window = order[i:i + chunk_size]
+		mails = {}
+		for mailbox in {mailbox for _, mailbox, _ in window}:
+			uids = [mail_id for _, box, mail_id in window if box == mailbox]
 			try:
-				if mailbox == 'inbox':
-					# Select mails from clients
-					status, data = imap_server.search(None, 'FROM', client)
-				else:
-					# Select mails to clients
-					status, data = imap_server.search(None, 'TO', client)
+				for mail_id, _, raw_mail in fetch_messages(imap_servers[mailbox], uids, chunk_size):
+					mails[mailbox, mail_id] = raw_mail
 			except Exception as e:
-				LOGGER.error(f"Could not select mails from {client}: {e}")
-				continue
-			
-			if status != 'OK':
-				LOGGER.error(f"Could not select mails from {client}: {status}")
-				continue
-		
-			mail_ids = data[0].split()
-			for mail_id in mail_ids:
-				try:
-					status, raw_mail = imap_server.fetch(mail_id, "(RFC822)")
-					raw_mail = email.message_from_bytes(raw_mail[0][1])
-					mail_date = email.utils.parsedate_to_datetime(raw_mail.get("Date"))
-
-					all_mails.append((mail_date, raw_mail))
-				except Exception as e:
-					LOGGER.error(f"Could not fetch mail {mail_id} from {client}: {e}")
-					continue
-	
-	LOGGER.info(f"Found {len(all_mails)} mails")
-	all_mails.sort(key=lambda tup: tup[0])
+				LOGGER.error(f"Could not fetch mails from '{mailbox}': {e}")
+			failed[mailbox].update(mail_id for mail_id in uids if (mailbox, mail_id) not in mails)
+
+		for _, mailbox, mail_id in window:
+			if (mailbox, mail_id) in mails:
+				yield mailbox, mail_id, mails.pop((mailbox, mail_id))
 
-	for (mail_date, raw_mail) in all_mails:
+def parse_mails(mails, failed):
+	"""Yields (mailbox, uid, row) for every client mail, once per Message-ID."""
+	# Message-IDs on their way to the DB but not inserted yet
+	queued = set()
+
+	for mailbox, mail_id, raw_mail in mails:
 		try:		
 			subject  = raw_mail.get("Subject")
 			msg_id   = raw_mail.get("Message-ID", email.utils.make_msgid())
@@ -152,115 +183,153 @@ def populate_emails():
 		if "summary" in subject.lower() and from_addr == EMAIL:
 			continue
 
-		data = None
-		# Check if mail in DB
-		try:
-			LOGGER.debug(f"Checking if mail with msg_id {msg_id} exists in table 'emails'")
-
-			data = email_table.find_one(message_id=msg_id)
-		except Exception as e:
-			LOGGER.error(f"Could not check if mail {msg_id} in table 'emails': {e}")
+		if msg_id in queued:
+			continue
 
 		# Get Client ID
 		try:
 			client = to_addr if from_addr == EMAIL else from_addr
-			client_id = db['clients'].find_one(email=client)['id']
+			client_id = get_client_id(client)
+			if client_id is None:
+				raise LookupError("not in table 'clients'")
 		except Exception as e:
 			LOGGER.error(f"Could not get Client ID for {client}, {e}")
+			failed[mailbox].add(mail_id)
 			continue
 
-		# Add mail to DB
-		if data is None:
-			db.begin()
-			try:
-				LOGGER.debug(f"Inserting mail {msg_id} into table 'emails'")
-
-				email_id = email_table.insert(dict(
-					client_id = client_id,
-					message_id = msg_id,
-					to_addr = to_addr,
-					to_name = to_name,
-					from_addr = from_addr,
-					from_name = from_name,
-					subject = subject,
-					body = body,
-					time_received = mail_datetime,
-					responded = 1
-				))
-				embedding = emb.model.create_embedding(f"Subject:{subject}\nBody:{body}")['data'][0]['embedding']
-				embedding = np.array(embedding)
-				email_embed_table.insert(dict(
-					email_id = email_id,
-					client_id = client_id,
-					model = EMB_MODEL,
-					embedding = pickle.dumps(embedding)
-				))
-				db.commit()
-
-				LOGGER.debug("Inserted record in table 'emails'")
-			except Exception as e:
-				LOGGER.error(f"Could not insert mail {msg_id} in table 'emails': {e}")
-				db.rollback()
+		queued.add(msg_id)
+		yield mailbox, mail_id, dict(
+			client_id = client_id,
+			message_id = msg_id,
+			to_addr = to_addr,
+			to_name = to_name,
+			from_addr = from_addr,
+			from_name = from_name,
+			subject = subject,
+			body = body,
+			time_received = mail_datetime,
+			responded = 1
+		)
+
+def embed_batches(db, emb, rows, batch_size, failed):
+	"""
+	Yields (batch, embeddings) for batches of batch_size parsed mails, less
+	the mails already in the DB, which are found with one query per batch.
+	"""
+	batch = []
+	for row in itertools.chain(rows, [None]):
+		if row is not None:
+			batch.append(row)
+			if len(batch) < batch_size:
+				continue
+		if not batch:
+			break
+
+		try:
+			existing = existing_message_ids(db, [row['message_id'] for _, _, row in batch])
+		except Exception as e:
+			LOGGER.error(f"Could not check for known mails in table 'emails': {e}")
+			existing = set()
+		if existing:
+			LOGGER.debug(f"{len(existing)} mails of the batch exist in table 'emails'")
+			batch = [item for item in batch if item[2]['message_id'] not in existing]
+			if not batch:
 				continue
+
+		try:
+			embeddings = emb.embed_many([(row['subject'], row['body']) for _, _, row in batch])
+		except Exception as e:
+			LOGGER.error(f"Could not embed batch of {len(batch)} mails: {e}")
+			for mailbox, mail_id, _ in batch:
+				failed[mailbox].add(mail_id)
 		else:
-			LOGGER.debug(f"Mail with msg_id {msg_id} exists in table 'emails'")
+			yield batch, embeddings
+		batch = []
+
+def populate_emails():
+	"""
+	Backfills client mails of both mailboxes in date order. Only the Date
+	headers of all new mails are held at once; the full mails then stream
+	through fetch, parse, embed and insert stages joined by bounded queues,
+	so memory grows with the batch size rather than the mailbox.
+	"""
+	# Login to Zoho
+	check_smtp_auth()
 
-def populate_memories():
-	from LLM import summarize
+	# Connect to DB
+	db = connect_to_dataset()
 
-	# Init LLM
-	llm = BaseChatbot(LLM_MODEL)
 	# Init Embedder
 	emb = BaseEmbedder(EMB_MODEL)
 
+	order = []
+	syncs = {}
+	imap_servers = {}
+	# UIDs per mailbox that must be retried, the sync cursor stops before them
+	failed = defaultdict(set)
+	for mailbox in ('inbox', 'sent'):
+		LOGGER.debug(f"Checking mails from '{mailbox}'")
+		imap_server = imap_auth()
+		imap_server.select(mailbox)
+
+		sync = MailboxSync(mailbox, db, purpose='backfill')
+		try:
+			# Select mails from clients in inbox, and to clients in sent
+			field = 'FROM' if mailbox == 'inbox' else 'TO'
+			mail_ids = sync.pending(imap_server, CLIENTS, field=field)
+			order += fetch_dates(imap_server, mailbox, mail_ids, failed)
+		except Exception as e:
+			LOGGER.error(f"Could not select mails in '{mailbox}': {e}")
+			continue
+		syncs[mailbox] = sync
+		imap_servers[mailbox] = imap_server
+	
+	LOGGER.info(f"Found {len(order)} mails")
+	order.sort(key=lambda tup: tup[0])
+
+	batch_size = LLMCFG[EMB_MODEL].get("BatchSize", 32)
+	mails = prefetch(stream_mails(imap_servers, order, failed), maxsize=batch_size)
+	rows = prefetch(parse_mails(mails, failed), maxsize=batch_size)
+	batches = prefetch(embed_batches(db, emb, rows, batch_size, failed), maxsize=2)
+
+	# Add mails to DB
+	for batch, embeddings in batches:
+		try:
+			insert_emails(db, [row for _, _, row in batch], embeddings)
+			LOGGER.debug(f"Inserted {len(batch)} records in table 'emails'")
+		except Exception as e:
+			LOGGER.error(f"Could not insert batch of {len(batch)} mails in table 'emails': {e}")
+			for mailbox, mail_id, _ in batch:
+				failed[mailbox].add(mail_id)
+
+	for mailbox, sync in syncs.items():
+		sync.commit(failed=failed[mailbox])
+
+def populate_memories(workers=None, types=None):
+	"""Backfills summaries over the whole email history, see LLM.backfill."""
+	from LLM.backfill import Backfill, DEFAULT_WORKERS, DEFAULT_TYPES
+
+	workers = DEFAULT_WORKERS if workers is None else workers
+	types = DEFAULT_TYPES if types is None else types
+
 	# Connect to DB
 	db = connect_to_dataset()
 	email_table = db['emails']
-	memory_table = db['memories']
 
 	earliest = email_table.find_one(order_by='time_received')
 	latest = email_table.find_one(order_by='-time_received')
+	if earliest is None:
+		LOGGER.info("No mails to summarize")
+		return
 	min_date = earliest["time_received"].date()
 	max_date = latest["time_received"].date()
 
-	def memory_exists(memory_type, period_start, period_end):
-		return memory_table.find_one(memory_type=memory_type,
-									period_start=period_start,
-									period_end=period_end) is not None
+	# Init LLM, workers load their own
+	llm = BaseChatbot(LLM_MODEL) if workers <= 1 else None
+	# Init Embedder
+	emb = BaseEmbedder(EMB_MODEL)
 
-	def summarize_if_missing(summary_type, period_start, period_end, respond):
-		if not memory_exists(summary_type, period_start, period_end):
-			summarize.summarize(summary_type, period_end, llm, emb, respond)
-	
-	# Daily summaries
-	day = min_date
-	while day < max_date:
-		period_start = day
-		period_end = day + timedelta(days=1)
-		summarize_if_missing("daily", period_start, period_end, False)
-		day += timedelta(days=1)
-
-	# Weekly summaries (period ends on Sunday)
-	week_end = min_date + timedelta(days=(6 - min_date.weekday()))  # first Sunday
-	while week_end < max_date:
-		period_start = week_end - timedelta(days=7)
-		summarize_if_missing("weekly", period_start, week_end, False)
-		week_end += timedelta(weeks=1)
-
-	# Monthly summaries (1st to 1st of next month)
-	# month_start = date(min_date.year, min_date.month, 1)
-	# while month_start < max_date:
-	# 	month_end = month_start + relativedelta(months=1)
-	# 	summarize_if_missing("monthly", month_start, month_end, False)
-	# 	month_start = month_end
-
-	# Quarterly summaries (first of every 3rd month)
-	# q_month = ((min_date.month - 1) // 3) * 3 + 1
-	# quarter_start = date(min_date.year, q_month, 1)
-	# while quarter_start < max_date:
-	# 	quarter_end = quarter_start + relativedelta(months=3)
-	# 	summarize_if_missing("quarterly", quarter_start, quarter_end, False)
-	# 	quarter_start = quarter_end
+	Backfill(min_date, max_date, types).run(llm, emb, workers)
 
 # =================================== MAIN =================================== #
 if __name__ == "__main__":
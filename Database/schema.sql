@@ -18,8 +18,10 @@ CREATE TABLE emails (
   body           TEXT,
   time_received  DATETIME       NOT NULL DEFAULT CURRENT_TIMESTAMP,
   child_of       VARCHAR(255),       -- e.g. parent message_id
-  references     TEXT,               -- For threading
+  "references"   TEXT,               -- For threading, quoted as it is a keyword
   responded      BOOLEAN        NOT NULL DEFAULT 0,
+  reply_attempts INTEGER        NOT NULL DEFAULT 0,  -- generations cut off by a budget
+  retry_after    DATETIME,           -- no new reply attempt before this
   FOREIGN KEY(child_of) REFERENCES emails(message_id)
 );
 
@@ -28,7 +30,11 @@ CREATE TABLE email_embeddings (
   email_id     INTEGER     NOT NULL REFERENCES emails(id) ON DELETE CASCADE,
   client_id    INTEGER     NOT NULL REFERENCES clients(id),
   model        VARCHAR(100) NOT NULL,
-  embedding    BLOB        NOT NULL,   -- serialize e.g. Float32 array
+  embedding    BLOB        NOT NULL,   -- raw little-endian vector, see format
+  format       INTEGER,                -- storage format version, NULL for pickle
+  dtype        VARCHAR(10),            -- NumPy codes 'f4', 'f2' or 'i1' (int8)
+  dim          INTEGER,                -- number of dimensions
+  scale        REAL,                   -- dequantization scale for 'i1'
   created_at   DATETIME    NOT NULL DEFAULT CURRENT_TIMESTAMP,
   PRIMARY KEY (email_id, model)
 );
@@ -50,6 +56,10 @@ CREATE TABLE memory_embeddings (
   client_id   INTEGER      NOT NULL REFERENCES clients(id),
   model       VARCHAR(100) NOT NULL,
   embedding   BLOB         NOT NULL,
+  format      INTEGER,
+  dtype       VARCHAR(10),
+  dim         INTEGER,
+  scale       REAL,
   PRIMARY KEY (memory_id, model)
 );
 
@@ -72,3 +82,38 @@ CREATE TABLE obsidian_changes_history (
   change_type      VARCHAR(50),                      -- e.g. 'append', 'replace', 'delete', etc.
   created_at       TIMESTAMP   NOT NULL DEFAULT CURRENT_TIMESTAMP
 );
+
+
+-- 8) Incremental IMAP sync cursor per mailbox
+CREATE TABLE sync_state (
+  mailbox        VARCHAR(255) PRIMARY KEY NOT NULL,  -- '<purpose>:<mailbox>', e.g. 'fetch:inbox'
+  uidvalidity    INTEGER      NOT NULL,              -- UIDs are only valid under this value
+  last_uid       INTEGER      NOT NULL DEFAULT 0,    -- highest UID already ingested
+  highestmodseq  INTEGER,                            -- CONDSTORE only
+  clients_hash   VARCHAR(64),                        -- client list the cursor was built for
+  updated_at     DATETIME     NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- 9) Durable queue of outbound mails
+CREATE TABLE outbox (
+  id               INTEGER PRIMARY KEY AUTOINCREMENT,
+  message_id       VARCHAR(255),
+  from_addr        VARCHAR(255) NOT NULL,
+  to_addr          VARCHAR(255) NOT NULL,
+  subject          VARCHAR(255),
+  message          TEXT         NOT NULL,              -- full RFC 822 message
+  status           VARCHAR(10)  NOT NULL DEFAULT 'pending', -- 'pending','sending','sent','failed'
+  attempts         INTEGER      NOT NULL DEFAULT 0,
+  last_error       TEXT,
+  next_attempt_at  DATETIME     NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  created_at       DATETIME     NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  sent_at          DATETIME
+);
+
+-- 10) Indexes of the hot queries
+CREATE INDEX IF NOT EXISTS idx_emails_client_responded  ON emails(client_id, responded);
+CREATE INDEX IF NOT EXISTS idx_emails_client_time       ON emails(client_id, time_received);
+CREATE INDEX IF NOT EXISTS idx_emails_message_id        ON emails(message_id);
+CREATE INDEX IF NOT EXISTS idx_memories_client_type     ON memories(client_id, memory_type, id);
+CREATE INDEX IF NOT EXISTS idx_memory_embeddings_client ON memory_embeddings(client_id);
+CREATE INDEX IF NOT EXISTS idx_outbox_status_due        ON outbox(status, next_attempt_at);
@@ -0,0 +1,181 @@
+# ############################################################################ #
+#                              MAINTENANCE HISTORY                             #
+# ############################################################################ #
+# DATE         Description
+# ------------ -----------------------------------------------------------------
+# 18-OCT-2026  Initial Draft
+# ============================================================================ #
+
+# ================================== IMPORTS ================================= #
+import os
+import sys
+import json
+import fcntl
+from contextlib import contextmanager
+
+import numpy as np
+
+from Logging import logger_init
+from Database.embeddings import decode_embedding
+from utils import load_config, EMB_MODEL
+
+# ============================= GLOBAL VARIABLES ============================= #
+LOGGER = logger_init("Database")
+
+# ================================= CONSTANTS ================================ #
+DBPATH = os.environ["Db"]
+STORECFG = load_config().get("Database", {}).get("VectorStore", {})
+
+# Embeddings tables mirrored to shards, and the column holding the row id
+TABLE_KEYS = {
+	"email_embeddings": "email_id",
+	"memory_embeddings": "memory_id",
+}
+
+# ================================== CLASSES ================================= #
+class VectorStore:
+	"""
+	Append-only, memory-mapped copies of the embeddings tables.
+
+	Every (table, client) pair gets a raw float32 shard of unit-length rows
+	and an int64 side-array with the matching row ids, next to db.sqlite3.
+	The ids file is written last, so a row only exists once its id does.
+	"""
+	def __init__(
+			self,
+			root=STORECFG.get("Path", os.path.join(DBPATH, "vectors")),
+			model=EMB_MODEL,
+		):
+		self.root = root
+		self.model = model
+
+	def _dir(self, table):
+		return os.path.join(self.root, self.model or "default", table)
+
+	def _paths(self, table, client_id):
+		base = os.path.join(self._dir(table), f"client_{client_id}")
+		return base + ".f32", base + ".ids"
+
+	def _meta_path(self, table):
+		return os.path.join(self._dir(table), "meta.json")
+
+	def dim(self, table):
+		try:
+			with open(self._meta_path(table), "r") as fp:
+				return json.load(fp)["dim"]
+		except FileNotFoundError:
+			return None
+
+	@contextmanager
+	def _locked(self, table, client_id):
+		os.makedirs(self._dir(table), exist_ok=True)
+		vec_path, ids_path = self._paths(table, client_id)
+		with open(ids_path + ".lock", "a") as lock:
+			fcntl.flock(lock, fcntl.LOCK_EX)
+			try:
+				yield vec_path, ids_path
+			finally:
+				fcntl.flock(lock, fcntl.LOCK_UN)
+
+	def append(self, table, client_id, ids, vectors):
+		with self._locked(table, client_id) as paths:
+			self._write(table, *paths, ids, vectors)
+
+	def _write(self, table, vec_path, ids_path, ids, vectors):
+		vectors = np.asarray(vectors, dtype=np.float32)
+		if vectors.ndim == 1:
+			vectors = vectors.reshape(1, -1)
+		ids = np.asarray(ids, dtype=np.int64)
+		if len(ids) == 0:
+			return
+
+		norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+		norms[norms == 0] = 1
+		vectors = (vectors / norms).astype("<f4")
+
+		dim = self.dim(table)
+		if dim is None:
+			dim = vectors.shape[1]
+			with open(self._meta_path(table), "w") as fp:
+				json.dump(dict(dim=dim, model=self.model), fp)
+		if vectors.shape[1] != dim:
+			raise ValueError(f"Shard '{table}' holds {dim}-d vectors, got {vectors.shape[1]}-d")
+
+		# Drop rows left behind by an append that died before its ids
+		count = os.path.getsize(ids_path) // 8 if os.path.exists(ids_path) else 0
+		with open(vec_path, "ab") as fp:
+			fp.truncate(count * dim * 4)
+			fp.write(vectors.tobytes())
+			fp.flush()
+			os.fsync(fp.fileno())
+		with open(ids_path, "ab") as fp:
+			fp.write(ids.astype("<i8").tobytes())
+			fp.flush()
+			os.fsync(fp.fileno())
+
+	def load(self, table, client_id):
+		"""Returns (ids, vectors) of a client as read-only memory maps."""
+		vec_path, ids_path = self._paths(table, client_id)
+		dim = self.dim(table)
+		if dim is None or not os.path.exists(ids_path) or os.path.getsize(ids_path) == 0:
+			return np.empty(0, dtype=np.int64), np.empty((0, dim or 0), dtype=np.float32)
+
+		count = min(os.path.getsize(ids_path) // 8, os.path.getsize(vec_path) // (dim * 4))
+		if count == 0:
+			return np.empty(0, dtype=np.int64), np.empty((0, dim), dtype=np.float32)
+		ids = np.memmap(ids_path, dtype="<i8", mode="r", shape=(count,))
+		vectors = np.memmap(vec_path, dtype="<f4", mode="r", shape=(count, dim))
+		return ids, vectors
+
+	def rebuild(self, db, table, client_id):
+		"""Rewrites a client's shard from the database."""
+		key = TABLE_KEYS[table]
+		query = {"client_id": client_id}
+		if self.model:
+			query["model"] = self.model
+
+		ids, vectors = [], []
+		for row in db[table].find(**query, order_by=key):
+			ids.append(row[key])
+			vectors.append(decode_embedding(row))
+
+		with self._locked(table, client_id) as (vec_path, ids_path):
+			for path in (vec_path, ids_path):
+				if os.path.exists(path):
+					os.unlink(path)
+			if ids:
+				self._write(table, vec_path, ids_path, ids, np.vstack(vectors))
+		LOGGER.info(f"Rebuilt shard '{table}' of client {client_id} with {len(ids)} vectors")
+		return len(ids)
+
+# ================================= FUNCTIONS ================================ #
+def get_vector_store():
+	"""Returns the shared VectorStore, or None when shards are disabled."""
+	if not STORECFG.get("Enable", False):
+		return None
+	return VectorStore()
+
+def append_vectors(table, client_id, ids, vectors):
+	"""Mirrors freshly committed embeddings rows to the shards, if enabled."""
+	store = get_vector_store()
+	if store is None:
+		return
+	try:
+		store.append(table, client_id, ids, vectors)
+	except Exception as e:
+		# The shard is rebuilt from the DB when its row count falls behind
+		LOGGER.error(f"Could not append to shard '{table}' of client {client_id}: {e}")
+
+# =================================== MAIN =================================== #
+if __name__ == "__main__":
+	from Database import connect_to_dataset
+
+	if len(sys.argv) < 2 or sys.argv[1] != "rebuild":
+		print("Usage: python -m Database.shards rebuild")
+		sys.exit(1)
+
+	db = connect_to_dataset()
+	store = VectorStore()
+	for table in TABLE_KEYS:
+		for row in db.query(f"SELECT DISTINCT client_id FROM {table}"):
+			store.rebuild(db, table, row["client_id"])
@@ -0,0 +1,94 @@
+# ############################################################################ #
+#                              MAINTENANCE HISTORY                             #
+# ############################################################################ #
+# DATE         Description
+# ------------ -----------------------------------------------------------------
+# 18-OCT-2026  Initial Draft
+# 18-OCT-2026  Retry batches blocked by another job's write lock
+# ============================================================================ #
+
+# ================================== IMPORTS ================================= #
+from collections import defaultdict
+
+from Logging import logger_init
+from Database.db_utils import write_transaction
+from Database.embeddings import encode_embedding
+from Database.shards import append_vectors
+from utils import EMB_MODEL
+
+# ============================= GLOBAL VARIABLES ============================= #
+LOGGER = logger_init("Database")
+
+# ================================= CONSTANTS ================================ #
+# Values per IN (...) query, below SQLite's bound parameter limit
+IN_CHUNK = 500
+
+# ================================= FUNCTIONS ================================ #
+def existing_message_ids(db, message_ids):
+	"""Returns the subset of message_ids already in table 'emails'."""
+	message_ids = list(set(message_ids))
+	existing = set()
+	for i in range(0, len(message_ids), IN_CHUNK):
+		rows = db['emails'].find(message_id=message_ids[i:i + IN_CHUNK], _step=None)
+		existing.update(row['message_id'] for row in rows)
+	return existing
+
+def insert_emails(db, rows, embeddings, model=EMB_MODEL):
+	"""
+	Writes a batch of mails and their embeddings in one transaction and
+	returns their new ids in order, None for mails that were already stored.
+
+	The batch is deduplicated on message_id with one IN query, both tables
+	are written with executemany, and the new ids are read back by
+	message_id for the embeddings rows. Raises if the batch did not commit.
+	"""
+	if not rows:
+		return []
+	new, email_ids = write_transaction(db, write_emails, db, rows, embeddings, model)
+
+	# Shards are only appended once the rows exist
+	by_client = defaultdict(list)
+	for message_id, i in new.items():
+		by_client[rows[i]['client_id']].append((email_ids[message_id], embeddings[i]))
+	for client_id, items in by_client.items():
+		append_vectors('email_embeddings', client_id, *map(list, zip(*items)))
+
+	LOGGER.debug(f"Inserted {len(new)} of {len(rows)} mails in table 'emails'")
+	ids = {i: email_ids[message_id] for message_id, i in new.items()}
+	return [ids.get(i) for i in range(len(rows))]
+
+def write_emails(db, rows, embeddings, model):
+	"""
+	The transaction body of insert_emails. Returns {message_id: row index}
+	of the mails written and {message_id: email id}.
+	"""
+	email_table = db['emails']
+
+	existing = existing_message_ids(db, [row['message_id'] for row in rows])
+	new = {}
+	for i, row in enumerate(rows):
+		if row['message_id'] not in existing and row['message_id'] not in new:
+			new[row['message_id']] = i
+
+	email_table.insert_many([rows[i] for i in new.values()])
+
+	email_ids = {}
+	message_ids = list(new)
+	for i in range(0, len(message_ids), IN_CHUNK):
+		for row in email_table.find(message_id=message_ids[i:i + IN_CHUNK], _step=None):
+			email_ids[row['message_id']] = max(row['id'], email_ids.get(row['message_id'], 0))
+
+	db['email_embeddings'].insert_many([
+		dict(
+			email_id=email_ids[message_id],
+			client_id=rows[i]['client_id'],
+			model=model,
+			**encode_embedding(embeddings[i])
+		)
+		for message_id, i in new.items()
+	])
+	return new, email_ids
+
+# =================================== MAIN =================================== #
+if __name__ == "__main__":
+	pass
@@ -1,4 +1,5 @@
 from .cosine import cosine
+from .index import EmbeddingIndex
 # from .summarize import summarize
 # from .parse import parse, remove_commands
 from .main import BaseChatbot, BaseEmbedder
\ No newline at end of file
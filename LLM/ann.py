@@ -0,0 +1,287 @@
+# ############################################################################ #
+#                              MAINTENANCE HISTORY                             #
+# ############################################################################ #
+# DATE         Description
+# ------------ -----------------------------------------------------------------
+# 18-OCT-2026  Initial Draft
+# 18-OCT-2026  Do not cache a missing index of a client without mails
+# ============================================================================ #
+
+# ================================== IMPORTS ================================= #
+import os
+import sys
+import time
+import argparse
+import threading
+
+import numpy as np
+
+from Logging import logger_init
+from LLM.index import EmbeddingIndex, normalize
+from Database import connect_to_dataset, decode_embedding
+from utils import load_config, EMB_MODEL
+
+# ============================= GLOBAL VARIABLES ============================= #
+LOGGER = logger_init("LLM")
+
+# ================================= CONSTANTS ================================ #
+ANNCFG = load_config()["LLM"].get("ANN", {})
+
+ANN_DIR = ANNCFG.get("Path", os.path.join(os.environ["Data"], "ann"))
+NPROBE = ANNCFG.get("NProbe", 4)
+# Below this many vectors a client is served by a single exact list
+MIN_TRAIN = ANNCFG.get("MinTrain", 256)
+KMEANS_ITERS = ANNCFG.get("KMeansIters", 15)
+
+# ================================== CLASSES ================================= #
+class IVFIndex:
+	"""
+	Inverted-file index over unit-length vectors.
+
+	Vectors are bucketed under their nearest k-means centroid, and a query
+	only scores the vectors of its nprobe closest buckets.
+	"""
+	def __init__(self, centroids):
+		self.centroids = np.asarray(centroids, dtype=np.float32)
+		self.list_ids = [np.empty(0, dtype=np.int64) for _ in range(len(self.centroids))]
+		self.list_vectors = [np.empty((0, self.centroids.shape[1]), dtype=np.float32) for _ in range(len(self.centroids))]
+
+	@classmethod
+	def train(cls, ids, vectors, nlist=None, iters=KMEANS_ITERS, seed=0):
+		vectors = normalize(vectors)
+		if nlist is None:
+			nlist = 1 if len(vectors) < MIN_TRAIN else int(np.sqrt(len(vectors)))
+		index = cls(kmeans(vectors, nlist, iters, seed))
+		index.add(ids, vectors)
+		return index
+
+	def __len__(self):
+		return sum(len(ids) for ids in self.list_ids)
+
+	@property
+	def max_id(self):
+		return max((int(ids.max()) for ids in self.list_ids if len(ids)), default=0)
+
+	def add(self, ids, vectors):
+		vectors = normalize(np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1))
+		ids = np.asarray(ids, dtype=np.int64)
+		assignments = np.argmax(vectors @ self.centroids.T, axis=1)
+		for l in np.unique(assignments):
+			mask = assignments == l
+			self.list_ids[l] = np.concatenate((self.list_ids[l], ids[mask]))
+			self.list_vectors[l] = np.vstack((self.list_vectors[l], vectors[mask]))
+
+	def search(self, query, top_k=3, nprobe=NPROBE, exclude=()):
+		query = normalize(np.asarray(query, dtype=np.float32).reshape(1, -1))[0]
+		probes = np.argsort(-(self.centroids @ query))[:nprobe]
+
+		ids = np.concatenate([self.list_ids[l] for l in probes])
+		if len(ids) == 0:
+			return []
+		scores = np.concatenate([self.list_vectors[l] @ query for l in probes])
+		if len(exclude):
+			keep = ~np.isin(ids, np.asarray(list(exclude), dtype=np.int64))
+			ids, scores = ids[keep], scores[keep]
+
+		k = min(top_k, len(scores))
+		if k <= 0:
+			return []
+		top = np.argpartition(-scores, k - 1)[:k]
+		top = top[np.argsort(-scores[top], kind="stable")]
+		return [(float(scores[i]), int(ids[i])) for i in top]
+
+	def save(self, path):
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		sizes = np.array([len(ids) for ids in self.list_ids], dtype=np.int64)
+		tmp_path = path + ".tmp.npz"
+		np.savez(
+			tmp_path,
+			centroids=self.centroids,
+			sizes=sizes,
+			ids=np.concatenate(self.list_ids),
+			vectors=np.vstack(self.list_vectors),
+		)
+		os.replace(tmp_path, path)
+
+	@classmethod
+	def load(cls, path):
+		with np.load(path) as data:
+			index = cls(data["centroids"])
+			offsets = np.concatenate(([0], np.cumsum(data["sizes"])))
+			ids, vectors = data["ids"], data["vectors"]
+		for l in range(len(index.centroids)):
+			index.list_ids[l] = ids[offsets[l]:offsets[l + 1]]
+			index.list_vectors[l] = vectors[offsets[l]:offsets[l + 1]]
+		return index
+
+class EmailANNIndex:
+	"""
+	Per-client IVF indexes over email_embeddings, persisted under $Data/ann.
+
+	On first use a client's index is loaded from disk and caught up with any
+	rows inserted since it was saved, or trained from scratch if missing.
+	"""
+	def __init__(self, db, model=EMB_MODEL, root=ANN_DIR):
+		self.db = db
+		self.model = model
+		self.root = root
+
+		self._indexes = {}
+		self._lock = threading.Lock()
+
+	def _path(self, client_id):
+		return os.path.join(self.root, self.model or "default", f"emails_client_{client_id}.npz")
+
+	def _query(self, client_id, **filters):
+		query = {"client_id": client_id, **filters}
+		if self.model:
+			query["model"] = self.model
+		return query
+
+	def _catch_up(self, client_id, index):
+		ids, vectors = [], []
+		rows = self.db['email_embeddings'].find(**self._query(client_id, email_id={'gt': index.max_id}), order_by='email_id')
+		for row in rows:
+			ids.append(row['email_id'])
+			vectors.append(decode_embedding(row))
+		if ids:
+			LOGGER.debug(f"Adding {len(ids)} new emails to ANN index of client {client_id}")
+			index.add(ids, np.vstack(vectors))
+		return len(ids)
+
+	def _ensure(self, client_id):
+		if client_id in self._indexes:
+			return self._indexes[client_id]
+
+		path = self._path(client_id)
+		index = None
+		if os.path.exists(path):
+			try:
+				index = IVFIndex.load(path)
+			except Exception as e:
+				LOGGER.error(f"Could not load ANN index {path}, rebuilding: {e}")
+
+		# Retrain once a client has outgrown its lists
+		if index is not None and self._catch_up(client_id, index):
+			if len(index.centroids) == 1 and len(index) >= MIN_TRAIN:
+				index = None
+			else:
+				index.save(path)
+
+		if index is None:
+			# Not cached when None, the client's first mails build it later
+			return self.rebuild(client_id)
+
+		self._indexes[client_id] = index
+		return index
+
+	def rebuild(self, client_id):
+		ids, matrix = EmbeddingIndex(self.db, "email_embeddings", "email_id", self.model).vectors(client_id)
+		if len(ids) == 0:
+			return None
+
+		start = time.perf_counter()
+		index = IVFIndex.train(ids, matrix)
+		index.save(self._path(client_id))
+		LOGGER.info(f"Built ANN index of client {client_id} with {len(ids)} emails in {len(index.centroids)} lists in {time.perf_counter() - start:.2f}s")
+		self._indexes[client_id] = index
+		return index
+
+	def add(self, client_id, email_id, embedding):
+		with self._lock:
+			index = self._indexes.get(client_id)
+			if index is not None:
+				index.add([email_id], np.asarray(embedding).reshape(1, -1))
+
+	def search(self, client_id, query, top_k=3, nprobe=NPROBE, exclude=()):
+		with self._lock:
+			index = self._ensure(client_id)
+		if index is None:
+			return []
+		return index.search(query, top_k, nprobe, exclude)
+
+# ================================= FUNCTIONS ================================ #
+def kmeans(vectors, k, iters=KMEANS_ITERS, seed=0):
+	"""Spherical k-means, returns k unit-length centroids."""
+	rng = np.random.default_rng(seed)
+	k = max(1, min(k, len(vectors)))
+	centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+
+	for _ in range(iters):
+		assignments = np.argmax(vectors @ centroids.T, axis=1)
+		sums = np.zeros_like(centroids)
+		np.add.at(sums, assignments, vectors)
+		empty = ~np.any(sums, axis=1)
+		# Re-seed empty lists from random points
+		sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+		centroids = normalize(sums)
+	return centroids
+
+def benchmark(vectors, ids=None, top_k=5, queries=100, nprobe=NPROBE, seed=0):
+	"""Recall@k and mean latency of IVF search against exact brute force."""
+	rng = np.random.default_rng(seed)
+	vectors = normalize(vectors)
+	if ids is None:
+		ids = np.arange(len(vectors), dtype=np.int64)
+
+	start = time.perf_counter()
+	index = IVFIndex.train(ids, vectors)
+	build_time = time.perf_counter() - start
+
+	picks = rng.choice(len(vectors), min(queries, len(vectors)), replace=False)
+	query_set = normalize(vectors[picks] + rng.normal(scale=0.05, size=(len(picks), vectors.shape[1])))
+
+	exact_time, ann_time, hits = 0.0, 0.0, 0
+	for query in query_set:
+		start = time.perf_counter()
+		scores = vectors @ query
+		exact = set(ids[np.argpartition(-scores, top_k - 1)[:top_k]].tolist())
+		exact_time += time.perf_counter() - start
+
+		start = time.perf_counter()
+		approx = {i for _, i in index.search(query, top_k, nprobe)}
+		ann_time += time.perf_counter() - start
+
+		hits += len(exact & approx)
+
+	return dict(
+		vectors=len(vectors),
+		lists=len(index.centroids),
+		nprobe=nprobe,
+		build_s=build_time,
+		recall=hits / (len(query_set) * top_k),
+		exact_ms=1000 * exact_time / len(query_set),
+		ann_ms=1000 * ann_time / len(query_set),
+	)
+
+# =================================== MAIN =================================== #
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Email ANN index maintenance")
+	parser.add_argument("command", choices=("rebuild", "bench"))
+	parser.add_argument("--synthetic", type=int, default=0, help="Benchmark on N random clustered vectors instead of the DB")
+	parser.add_argument("--dim", type=int, default=768)
+	parser.add_argument("--k", type=int, default=5)
+	parser.add_argument("--queries", type=int, default=100)
+	parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+	args = parser.parse_args()
+
+	if args.command == "bench" and args.synthetic:
+		rng = np.random.default_rng(0)
+		centers = rng.normal(size=(max(1, args.synthetic // 200), args.dim))
+		data = centers[rng.integers(len(centers), size=args.synthetic)] + rng.normal(scale=0.5, size=(args.synthetic, args.dim))
+		for nprobe in args.nprobe:
+			print(benchmark(data, top_k=args.k, queries=args.queries, nprobe=nprobe))
+		sys.exit(0)
+
+	db = connect_to_dataset()
+	ann = EmailANNIndex(db)
+	clients = [row["client_id"] for row in db.query("SELECT DISTINCT client_id FROM email_embeddings")]
+	for client_id in clients:
+		if args.command == "rebuild":
+			ann.rebuild(client_id)
+			continue
+		ids, matrix = EmbeddingIndex(db, "email_embeddings", "email_id").vectors(client_id)
+		if len(ids) < args.k:
+			continue
+		for nprobe in args.nprobe:
+			print(f"client {client_id}:", benchmark(matrix, ids, args.k, args.queries, nprobe))
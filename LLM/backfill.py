@@ -0,0 +1,250 @@
+# ############################################################################ #
+#                              MAINTENANCE HISTORY                             #
+# ############################################################################ #
+# DATE         Description
+# ------------ -----------------------------------------------------------------
+# 18-OCT-2026  Initial Draft
+# 18-OCT-2026  Fit prompts into a token budget
+# 18-OCT-2026  Map-reduce periods too large for one prompt
+# ============================================================================ #
+
+# ================================== IMPORTS ================================= #
+import os
+import json
+import argparse
+import multiprocessing
+from collections import deque
+from datetime import timedelta, date
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from dateutil.relativedelta import relativedelta
+
+from Logging import logger_init
+from LLM import BaseChatbot, BaseEmbedder, EmbeddingIndex
+from LLM.summarize import (
+	plan_summary,
+	prepare_summary,
+	generate_summary,
+	run_summary,
+	store_summary,
+	init_worker,
+	worker_generate,
+)
+from LLM.context import token_counter
+from Database import connect_to_dataset, get_or_create_client
+from utils import load_config, LLM_MODEL, EMB_MODEL, CLIENTS, CLIENTNAMES
+
+# ============================= GLOBAL VARIABLES ============================= #
+LOGGER = logger_init("LLM")
+
+# ================================= CONSTANTS ================================ #
+BACKFILLCFG = load_config().get("Database", {}).get("Backfill", {})
+
+SUMMARY_TYPES = ("daily", "weekly", "monthly", "quarterly")
+# Monthly and quarterly backfills stay opt-in, as they were before
+DEFAULT_TYPES = BACKFILLCFG.get("Types", ["daily", "weekly"])
+DEFAULT_WORKERS = BACKFILLCFG.get("Workers", 1)
+CHECKPOINT_PATH = BACKFILLCFG.get("Checkpoint", os.path.join(os.environ["Data"], "backfill_checkpoint.json"))
+
+# ================================== CLASSES ================================= #
+class Backfill:
+	"""
+	Summarizes every period between two dates as a dependency graph.
+
+	Each (summary type, period) is a node that depends on the nodes of its
+	source memory type inside its window, e.g. a week on its seven days.
+	Ready nodes are prepared here and generated on a pool of workers, and
+	finished nodes are recorded in a JSON checkpoint so a rerun resumes.
+	"""
+	def __init__(self, min_date, max_date, types=DEFAULT_TYPES, checkpoint=CHECKPOINT_PATH):
+		self.types = [t for t in SUMMARY_TYPES if t in types]
+		self.checkpoint = checkpoint
+
+		self.plans = {}
+		self.deps = {}
+		for summary_type in self.types:
+			for period_end in periods(summary_type, min_date, max_date):
+				self.plans[node_key(summary_type, period_end)] = plan_summary(summary_type, period_end)
+		self._link()
+
+		self.done = self._load_checkpoint()
+		self.failed = set()
+
+	def _link(self):
+		"""Makes every node depend on its source nodes with a start in its window."""
+		for key, plan in self.plans.items():
+			source_type = plan['cfg'].get("source_filter", {}).get("memory_type")
+			self.deps[key] = {
+				other for other, source in self.plans.items()
+				if source['summary_type'] == source_type
+				and plan['period_start'] <= source['period_start'] <= plan['period_end']
+			}
+
+	def _load_checkpoint(self):
+		try:
+			with open(self.checkpoint, "r") as fp:
+				done = set(json.load(fp)["done"])
+		except FileNotFoundError:
+			return set()
+		except Exception as e:
+			LOGGER.warning(f"Could not read backfill checkpoint {self.checkpoint}, starting over: {e}")
+			return set()
+		LOGGER.info(f"Resuming backfill, {len(done & self.plans.keys())} of {len(self.plans)} periods done")
+		return done
+
+	def _save_checkpoint(self):
+		tmp_path = self.checkpoint + ".tmp"
+		with open(tmp_path, "w") as fp:
+			json.dump(dict(done=sorted(self.done)), fp)
+		os.replace(tmp_path, self.checkpoint)
+
+	def _ready(self, key):
+		return key not in self.done and self.deps[key] <= self.done
+
+	def run(self, llm=None, emb=None, workers=DEFAULT_WORKERS):
+		if emb is None:
+			emb = BaseEmbedder(EMB_MODEL)
+
+		db = connect_to_dataset()
+		mem_table = db['memories']
+		mem_index = EmbeddingIndex(db)
+		clients = [
+			(client, client_name, get_or_create_client(client, client_name))
+			for client, client_name in zip(CLIENTS, CLIENTNAMES)
+		]
+
+		if workers <= 1:
+			if llm is None:
+				llm = BaseChatbot(LLM_MODEL)
+			pool = ThreadPoolExecutor(max_workers=1)
+			submit = lambda history: pool.submit(generate_summary, llm, history)
+		else:
+			n_threads = max(1, (os.cpu_count() or 1) // workers)
+			LOGGER.info(f"Backfilling on {workers} workers with {n_threads} threads each")
+			pool = ProcessPoolExecutor(
+				max_workers=workers,
+				mp_context=multiprocessing.get_context("spawn"),
+				initializer=init_worker,
+				initargs=(n_threads,),
+			)
+			submit = lambda history: pool.submit(worker_generate, history)
+
+		count_tokens = token_counter(LLM_MODEL, llm)
+
+		order = {t: i for i, t in enumerate(SUMMARY_TYPES)}
+		ready = deque(sorted(
+			(key for key in self.plans if self._ready(key)),
+			key=lambda key: (order[self.plans[key]['summary_type']], self.plans[key]['period_end'])
+		))
+		queued = set(ready)
+		futures = {}
+		outstanding = {}
+
+		def finish(key):
+			if key in self.failed:
+				LOGGER.warning(f"Backfill of {key} incomplete, its dependents wait for a rerun")
+				return
+			self.done.add(key)
+			self._save_checkpoint()
+			LOGGER.info(f"Backfilled {key} ({len(self.done & self.plans.keys())}/{len(self.plans)})")
+			for other in self.plans:
+				if other not in queued and key in self.deps[other] and self._ready(other):
+					queued.add(other)
+					ready.append(other)
+
+		# Drivers only wait on the pool, walking split periods through map and reduce
+		with pool, ThreadPoolExecutor(max_workers=max(1, workers)) as drivers:
+			while ready or futures:
+				while ready:
+					key = ready.popleft()
+					plan = self.plans[key]
+					outstanding[key] = 0
+					for client, client_name, client_id in clients:
+						# Clients finished before an interruption are not redone
+						if client_id == -1 or mem_table.find_one(
+								client_id=client_id,
+								memory_type=plan['summary_type'],
+								period_start=plan['period_start'],
+								period_end=plan['period_end']) is not None:
+							continue
+						job = prepare_summary(db, emb, plan, client, client_name, mem_index, count_tokens)
+						if job is None:
+							continue
+						futures[drivers.submit(run_summary, job, submit)] = (key, job)
+						outstanding[key] += 1
+					if outstanding[key] == 0:
+						finish(key)
+
+				if not futures:
+					break
+				completed, _ = wait(futures, return_when=FIRST_COMPLETED)
+				for future in completed:
+					key, job = futures.pop(future)
+					try:
+						llm_output = future.result()
+					except Exception as e:
+						LOGGER.error(f"Backfill worker failed on {key} for client {job['client_id']}: {e}")
+						llm_output = None
+
+					if llm_output is None:
+						self.failed.add(key)
+					else:
+						store_summary(db, emb, mem_index, self.plans[key], job, llm_output, False)
+
+					outstanding[key] -= 1
+					if outstanding[key] == 0:
+						finish(key)
+
+		pending = len(self.plans) - len(self.done & self.plans.keys())
+		if pending:
+			LOGGER.warning(f"Backfill finished with {pending} periods left for a rerun")
+		else:
+			LOGGER.info(f"Backfill of {len(self.plans)} periods complete")
+
+# ================================= FUNCTIONS ================================ #
+def node_key(summary_type, period_end):
+	return f"{summary_type}:{period_end.isoformat()}"
+
+def periods(summary_type, min_date, max_date):
+	"""Yields the period end dates of summary_type covering min_date to max_date."""
+	if summary_type == "daily":
+		day = min_date
+		while day < max_date:
+			yield day + timedelta(days=1)
+			day += timedelta(days=1)
+
+	elif summary_type == "weekly":
+		# Weeks end on Sunday
+		week_end = min_date + timedelta(days=(6 - min_date.weekday()))
+		while week_end < max_date:
+			yield week_end
+			week_end += timedelta(weeks=1)
+
+	elif summary_type == "monthly":
+		# 1st to 1st of next month
+		month_start = date(min_date.year, min_date.month, 1)
+		while month_start < max_date:
+			month_start += relativedelta(months=1)
+			yield month_start
+
+	elif summary_type == "quarterly":
+		# First of every 3rd month
+		q_month = ((min_date.month - 1) // 3) * 3 + 1
+		quarter_start = date(min_date.year, q_month, 1)
+		while quarter_start < max_date:
+			quarter_start += relativedelta(months=3)
+			yield quarter_start
+
+# =================================== MAIN =================================== #
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Backfill historical summaries")
+	parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Generate on N worker processes, each with its own model")
+	parser.add_argument("--types", nargs="+", choices=SUMMARY_TYPES, default=DEFAULT_TYPES)
+	parser.add_argument("--reset", action="store_true", help="Ignore the checkpoint and revisit every period")
+	args = parser.parse_args()
+
+	if args.reset and os.path.exists(CHECKPOINT_PATH):
+		os.unlink(CHECKPOINT_PATH)
+
+	from Database.populate_db import populate_memories
+	populate_memories(args.workers, args.types)
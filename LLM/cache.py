@@ -0,0 +1,195 @@
+# ############################################################################ #
+#                              MAINTENANCE HISTORY                             #
+# ############################################################################ #
+# DATE         Description
+# ------------ -----------------------------------------------------------------
+# 18-OCT-2026  Initial Draft
+# 18-OCT-2026  Count the disk rows only when they may exceed the limit
+# ============================================================================ #
+
+# ================================== IMPORTS ================================= #
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+from Logging import logger_init
+from utils import load_config
+
+# ============================= GLOBAL VARIABLES ============================= #
+LOGGER = logger_init("LLM")
+
+# ================================= CONSTANTS ================================ #
+CACHECFG = load_config()["LLM"].get("EmbeddingCache", {})
+
+DEFAULT_PATH = os.path.join(os.environ["Data"], "embedding_cache.sqlite3")
+# Share of DiskItems left after an eviction
+EVICT_TO = 0.9
+
+CREATE_CACHE_TABLE = """
+CREATE TABLE IF NOT EXISTS embedding_cache (
+  model      VARCHAR(100) NOT NULL,
+  hash       CHAR(64)     NOT NULL,
+  embedding  BLOB         NOT NULL,
+  last_used  REAL         NOT NULL,
+  PRIMARY KEY (model, hash)
+);
+CREATE INDEX IF NOT EXISTS idx_embedding_cache_last_used ON embedding_cache(last_used);
+"""
+
+# ================================== CLASSES ================================= #
+class EmbeddingCache:
+	"""
+	Two level cache of embeddings keyed by (model, sha256 of normalized text).
+
+	An in-process LRU sits in front of a SQLite file shared by every job,
+	which is trimmed back to disk_items rows by least recent use.
+	"""
+	def __init__(
+			self,
+			model,
+			path=CACHECFG.get("Path", DEFAULT_PATH),
+			memory_items=CACHECFG.get("MemoryItems", 1024),
+			disk_items=CACHECFG.get("DiskItems", 100000),
+		):
+		self.model = model
+		self.path = path
+		self.memory_items = memory_items
+		self.disk_items = disk_items
+
+		self.hits = 0
+		self.disk_hits = 0
+		self.misses = 0
+
+		self._memory = OrderedDict()
+		self._lock = threading.Lock()
+		self._conn = None
+		# Upper bound of the disk rows, see _evict
+		self._disk_count = 0
+		try:
+			self._conn = sqlite3.connect(path, check_same_thread=False)
+			self._conn.executescript(CREATE_CACHE_TABLE)
+			self._conn.commit()
+			self._disk_count = self._count()
+		except Exception as e:
+			LOGGER.warning(f"Embedding cache at {path} unavailable, using memory only: {e}")
+			self._conn = None
+
+	def _remember(self, key, vector):
+		self._memory[key] = vector
+		self._memory.move_to_end(key)
+		while len(self._memory) > self.memory_items:
+			self._memory.popitem(last=False)
+
+	def get(self, text):
+		key = text_hash(text)
+		with self._lock:
+			if key in self._memory:
+				self._memory.move_to_end(key)
+				self.hits += 1
+				return self._memory[key]
+
+			row = None
+			if self._conn is not None:
+				try:
+					row = self._conn.execute(
+						"SELECT embedding FROM embedding_cache WHERE model = ? AND hash = ?",
+						(self.model, key)
+					).fetchone()
+					if row is not None:
+						self._conn.execute(
+							"UPDATE embedding_cache SET last_used = ? WHERE model = ? AND hash = ?",
+							(time.time(), self.model, key)
+						)
+						self._conn.commit()
+				except Exception as e:
+					LOGGER.warning(f"Could not read embedding cache: {e}")
+					row = None
+
+			if row is None:
+				self.misses += 1
+				return None
+
+			vector = np.frombuffer(row[0], dtype=np.float32)
+			self._remember(key, vector)
+			self.hits += 1
+			self.disk_hits += 1
+			return vector
+
+	def put(self, text, vector):
+		self.put_many([text], [vector])
+
+	def put_many(self, texts, vectors):
+		now = time.time()
+		rows = []
+		with self._lock:
+			for text, vector in zip(texts, vectors):
+				key = text_hash(text)
+				vector = np.asarray(vector, dtype=np.float32)
+				self._remember(key, vector)
+				rows.append((self.model, key, vector.tobytes(), now))
+
+			if self._conn is None or not rows:
+				return
+			try:
+				self._conn.executemany(
+					"INSERT OR REPLACE INTO embedding_cache (model, hash, embedding, last_used) VALUES (?, ?, ?, ?)",
+					rows
+				)
+				self._evict(len(rows))
+				self._conn.commit()
+			except Exception as e:
+				LOGGER.warning(f"Could not write embedding cache: {e}")
+				self._conn.rollback()
+
+	def _count(self):
+		return self._conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+
+	def _evict(self, inserted):
+		"""
+		Trims the table to EVICT_TO of disk_items rows once it holds more
+		than disk_items. Every insert is counted as a new row, replaced ones
+		included, so the table is only scanned once that bound passes the
+		limit, and rows other processes added are found then. Trimming below
+		the limit keeps the scans from coming back on every put.
+		"""
+		self._disk_count += inserted
+		if self._disk_count <= self.disk_items:
+			return
+		count = self._count()
+		if count > self.disk_items:
+			keep = int(self.disk_items * EVICT_TO)
+			LOGGER.debug(f"Evicting {count - keep} embeddings from cache")
+			self._conn.execute(
+				"DELETE FROM embedding_cache WHERE rowid IN "
+				"(SELECT rowid FROM embedding_cache ORDER BY last_used LIMIT ?)",
+				(count - keep,)
+			)
+			count = keep
+		self._disk_count = count
+
+	def stats(self):
+		lookups = self.hits + self.misses
+		return dict(
+			hits=self.hits,
+			disk_hits=self.disk_hits,
+			misses=self.misses,
+			hit_rate=self.hits / lookups if lookups else 0.0,
+			memory_items=len(self._memory),
+		)
+
+# ================================= FUNCTIONS ================================ #
+def normalize_text(text):
+	return unicodedata.normalize("NFC", text).replace("\r\n", "\n").strip()
+
+def text_hash(text):
+	return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+# =================================== MAIN =================================== #
+if __name__ == "__main__":
+	pass
@@ -0,0 +1,153 @@
+# ############################################################################ #
+#                              MAINTENANCE HISTORY                             #
+# ############################################################################ #
+# DATE         Description
+# ------------ -----------------------------------------------------------------
+# 18-OCT-2026  Initial Draft
+# 18-OCT-2026  Drop the ranks of empty items along with them
+# ============================================================================ #
+
+# ================================== IMPORTS ================================= #
+import functools
+
+from Logging import logger_init
+from LLM.main import connect_to_server, load_llama, TOKEN_CACHE_ITEMS
+from utils import load_config
+
+# ============================= GLOBAL VARIABLES ============================= #
+LOGGER = logger_init("LLM")
+
+# Token counters of models loaded only for their vocabulary, by model_type
+COUNTERS = {}
+
+# ================================= CONSTANTS ================================ #
+LLMCFG = load_config()["LLM"]
+CTXCFG = LLMCFG.get("Context", {})
+
+# Tokens kept free for the model's answer
+RESPONSE_TOKENS = CTXCFG.get("ResponseTokens", 2048)
+# Share of the context budget per section, unused tokens go to the others
+SECTION_SHARES = CTXCFG.get("Sections", {
+	"current": 0.6,
+	"time": 0.2,
+	"similar": 0.2,
+})
+# Items that would be cut below this many tokens are dropped instead
+MIN_ITEM_TOKENS = CTXCFG.get("MinItemTokens", 64)
+TRUNCATION_MARK = "\n[...]"
+
+# ================================== CLASSES ================================= #
+class ContextBuilder:
+	"""
+	Packs prompt context into a token budget, section by section.
+
+	Each section gets its share of the budget, and tokens a section leaves
+	unused are handed to the sections that overflowed. Within a section the
+	least important items are dropped first, and an item larger than what
+	is left is cut down instead. With budget None nothing is trimmed.
+	"""
+	def __init__(self, count_tokens, budget=None):
+		self.count_tokens = count_tokens
+		self.budget = budget
+
+		self.sections = {}
+
+	def add(self, name, items, ranks=None, share=None):
+		"""
+		Adds a section of items in output order. ranks gives each item's
+		importance, 0 being the most important, and defaults to list order.
+		"""
+		items = list(items)
+		if ranks is None:
+			ranks = list(range(len(items)))
+		pairs = [(item, rank) for item, rank in zip(items, ranks) if item]
+		items = [item for item, _ in pairs]
+		ranks = [rank for _, rank in pairs]
+		self.sections[name] = dict(
+			items=items,
+			ranks=ranks,
+			share=SECTION_SHARES.get(name, 0) if share is None else share,
+			tokens=[self.count_tokens(item) for item in items] if self.budget is not None else [],
+		)
+
+	def _fit(self, section, budget):
+		"""Returns the items that fit in budget, in output order, and their tokens."""
+		kept = {}
+		used = 0
+		for i in sorted(range(len(section['items'])), key=lambda i: section['ranks'][i]):
+			tokens = section['tokens'][i]
+			if used + tokens <= budget:
+				kept[i] = section['items'][i]
+				used += tokens
+			elif budget - used >= MIN_ITEM_TOKENS:
+				kept[i] = self.truncate(section['items'][i], budget - used)
+				used += self.count_tokens(kept[i])
+		return [kept[i] for i in sorted(kept)], used
+
+	def truncate(self, text, max_tokens):
+		"""Cuts text down to at most max_tokens, keeping its beginning."""
+		tokens = self.count_tokens(text)
+		length = len(text)
+		while tokens > max_tokens and length > 0:
+			length = int(length * max_tokens / tokens * 0.95)
+			tokens = self.count_tokens(text[:length] + TRUNCATION_MARK)
+		return text[:length] + TRUNCATION_MARK
+
+	def build(self):
+		"""Returns {section: [items]} trimmed to the budget, and logs the sizes."""
+		if self.budget is None:
+			return {name: section['items'] for name, section in self.sections.items()}
+
+		total_share = sum(section['share'] for section in self.sections.values()) or 1
+		budgets = {
+			name: int(self.budget * section['share'] / total_share)
+			for name, section in self.sections.items()
+		}
+		# Hand what small sections leave over to the ones that need more
+		needs = {name: sum(section['tokens']) for name, section in self.sections.items()}
+		spare = sum(max(0, budgets[name] - needs[name]) for name in budgets)
+		for name in sorted(budgets, key=lambda name: -self.sections[name]['share']):
+			shortfall = needs[name] - budgets[name]
+			if shortfall > 0 and spare > 0:
+				extra = min(spare, shortfall)
+				budgets[name] += extra
+				spare -= extra
+
+		result = {}
+		for name, section in self.sections.items():
+			result[name], used = self._fit(section, budgets[name])
+			dropped = len(section['items']) - len(result[name])
+			LOGGER.info(
+				f"Context section '{name}': {used}/{needs[name]} tokens, budget {budgets[name]}, "
+				f"{len(result[name])} of {len(section['items'])} items kept"
+				+ (f", {dropped} dropped" if dropped else "")
+			)
+		return result
+
+# ================================= FUNCTIONS ================================ #
+def context_budget(model_type, prompt_tokens):
+	"""Tokens left for context once the prompt itself and the answer fit."""
+	context_length = LLMCFG[model_type]["ContextLength"]
+	return max(0, context_length - RESPONSE_TOKENS - prompt_tokens)
+
+def token_counter(model_type, llm=None):
+	"""
+	Returns a cached text -> token count function for model_type. Uses llm
+	when given, else the LLM server, else a vocabulary-only local load.
+	"""
+	if llm is not None:
+		return llm.count_tokens
+	if model_type not in COUNTERS:
+		model = connect_to_server("chat", model_type)
+		if model is None:
+			model = load_llama(model_type, vocab_only=True)
+
+		@functools.lru_cache(maxsize=TOKEN_CACHE_ITEMS)
+		def count_tokens(text):
+			return len(model.tokenize(text.encode("utf-8"), add_bos=False, special=True))
+		COUNTERS[model_type] = count_tokens
+	return COUNTERS[model_type]
+
+# =================================== MAIN =================================== #
+if __name__ == "__main__":
+	pass
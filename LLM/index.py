@@ -0,0 +1,163 @@
+# ############################################################################ #
+#                              MAINTENANCE HISTORY                             #
+# ############################################################################ #
+# DATE         Description
+# ------------ -----------------------------------------------------------------
+# 18-OCT-2026  Initial Draft
+# 18-OCT-2026  Decode embeddings with Database.decode_embedding
+# 18-OCT-2026  Read vectors from memory-mapped shards when enabled
+# ============================================================================ #
+
+# ================================== IMPORTS ================================= #
+import threading
+
+import numpy as np
+
+from Logging import logger_init
+from Database import decode_embedding
+from Database.shards import get_vector_store
+from utils import EMB_MODEL
+
+# ============================= GLOBAL VARIABLES ============================= #
+LOGGER = logger_init("LLM")
+
+# ================================= CONSTANTS ================================ #
+
+# ================================== CLASSES ================================= #
+class EmbeddingIndex:
+	"""
+	In-memory cosine index over an embeddings table, partitioned by client.
+
+	Each client's vectors are kept as one pre-normalized float32 matrix, so a
+	top-k query is a single matrix-vector product followed by argpartition.
+	Clients are loaded lazily on first query and updated in place by add().
+	"""
+	def __init__(
+			self,
+			db,
+			table="memory_embeddings",
+			key="memory_id",
+			model=EMB_MODEL,
+		):
+		self.db = db
+		self.table = table
+		self.key = key
+		self.model = model
+
+		self.store = get_vector_store()
+
+		self._matrices = {}
+		self._ids = {}
+		self._lock = threading.Lock()
+
+	def _load(self, client_id):
+		LOGGER.debug(f"Loading '{self.table}' vectors for client {client_id}")
+		query = {"client_id": client_id}
+		if self.model:
+			query["model"] = self.model
+
+		if self.store is not None and self._load_shard(client_id, query):
+			return
+
+		ids, vectors = [], []
+		for row in self.db[self.table].find(**query, order_by=self.key):
+			ids.append(row[self.key])
+			vectors.append(decode_embedding(row))
+
+		if vectors:
+			matrix = normalize(np.vstack(vectors))
+		else:
+			matrix = np.empty((0, 0), dtype=np.float32)
+
+		self._matrices[client_id] = matrix
+		self._ids[client_id] = np.asarray(ids, dtype=np.int64)
+		LOGGER.info(f"Loaded {len(ids)} '{self.table}' vectors for client {client_id}")
+
+	def _load_shard(self, client_id, query):
+		"""Maps the client's shard, rebuilding it if it lags the DB."""
+		try:
+			ids, matrix = self.store.load(self.table, client_id)
+			count = self.db[self.table].count(**query)
+			if len(ids) != count:
+				LOGGER.warning(f"Shard '{self.table}' of client {client_id} has {len(ids)} of {count} vectors")
+				self.store.rebuild(self.db, self.table, client_id)
+				ids, matrix = self.store.load(self.table, client_id)
+		except Exception as e:
+			LOGGER.error(f"Could not load shard '{self.table}' of client {client_id}: {e}")
+			return False
+
+		# Shard rows are stored unit-length already
+		self._matrices[client_id] = matrix
+		self._ids[client_id] = ids
+		LOGGER.info(f"Mapped {len(ids)} '{self.table}' vectors for client {client_id}")
+		return True
+
+	def _ensure(self, client_id):
+		if client_id not in self._matrices:
+			self._load(client_id)
+
+	def vectors(self, client_id):
+		"""Returns the (ids, unit-length matrix) pair of a client."""
+		with self._lock:
+			self._ensure(client_id)
+			return self._ids[client_id], self._matrices[client_id]
+
+	def __len__(self):
+		return sum(len(ids) for ids in self._ids.values())
+
+	def add(self, client_id, item_id, embedding):
+		"""Appends a freshly inserted vector to an already loaded client."""
+		with self._lock:
+			# Unloaded clients pick the row up from the DB on first query
+			if client_id not in self._matrices:
+				return
+
+			vector = normalize(np.asarray(embedding, dtype=np.float32).reshape(1, -1))
+			matrix = self._matrices[client_id]
+			if matrix.size == 0:
+				self._matrices[client_id] = vector
+			else:
+				self._matrices[client_id] = np.vstack((matrix, vector))
+			self._ids[client_id] = np.append(self._ids[client_id], np.int64(item_id))
+
+	def invalidate(self, client_id=None):
+		with self._lock:
+			if client_id is None:
+				self._matrices.clear()
+				self._ids.clear()
+			else:
+				self._matrices.pop(client_id, None)
+				self._ids.pop(client_id, None)
+
+	def search(self, client_id, query, top_k=3):
+		"""Returns up to top_k (similarity, id) pairs, most similar first."""
+		with self._lock:
+			self._ensure(client_id)
+			matrix = self._matrices[client_id]
+			ids = self._ids[client_id]
+
+		if top_k <= 0 or len(ids) == 0:
+			return []
+
+		query = normalize(np.asarray(query, dtype=np.float32).reshape(1, -1))[0]
+		scores = matrix @ query
+
+		if top_k < len(scores):
+			top = np.argpartition(-scores, top_k - 1)[:top_k]
+		else:
+			top = np.arange(len(scores))
+		top = top[np.argsort(-scores[top], kind="stable")]
+
+		return [(float(scores[i]), int(ids[i])) for i in top]
+
+# ================================= FUNCTIONS ================================ #
+def normalize(vectors):
+	"""Scales each row to unit length, leaving all-zero rows untouched."""
+	vectors = np.asarray(vectors, dtype=np.float32)
+	norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+	norms[norms == 0] = 1
+	return vectors / norms
+
+# =================================== MAIN =================================== #
+if __name__ == "__main__":
+	pass
@@ -5,17 +5,37 @@
 # ------------ -----------------------------------------------------------------
 # 23-MAR-2025  Initial Draft
 # 12-JUL-2025  Refactor to use shared constants from utils
+# 18-OCT-2026  Serve models through LLM.server with in-process fallback
+# 18-OCT-2026  Add BaseEmbedder.embed_many for batched embeddings
+# 18-OCT-2026  Cache embeddings by content hash
+# 18-OCT-2026  Serialize embedding calls across threads
+# 18-OCT-2026  Allow pinning the chatbot's thread count
+# 18-OCT-2026  Reuse prompt prefix KV state through a llama.cpp cache
+# 18-OCT-2026  Add cached token counting for context budgets
+# 18-OCT-2026  Stream generations under a token, time and think budget
+# 18-OCT-2026  Optional speculative decoding with acceptance stats
+# 18-OCT-2026  Keep the server socket and its authkey in a private directory
+# 18-OCT-2026  Reset draft acceptance counters per generation
+# 18-OCT-2026  Prompt cache off unless configured
 # ============================================================================ #
 
 # ================================== IMPORTS ================================= #
 import os
 import sys
+import time
+import secrets
+import functools
+import threading
+from collections import namedtuple
+from multiprocessing.connection import Client
 
 import numpy as np
-from llama_cpp import Llama
+from llama_cpp import Llama, LlamaRAMCache, LlamaDiskCache
 
 from Logging import logger_init
 from LLM.parse import remove_commands
+from LLM.cache import EmbeddingCache, CACHECFG
+from LLM.speculative import CountingDraft, draft_model
 from Database import connect_to_dataset
 from utils import (
     load_config,
@@ -31,56 +51,185 @@ LOGGER = logger_init("LLM")
 
 # ================================= CONSTANTS ================================ #
 LLMCFG = load_config()["LLM"]
+SERVERCFG = LLMCFG.get("Server", {})
+
+# Requests are unpickled, so the socket and its key live in a 0700 directory
+SERVER_DIR = SERVERCFG.get("Dir", os.path.join(os.environ["Data"], "llm_server"))
+SERVER_ADDRESS = SERVERCFG.get("Address", os.path.join(SERVER_DIR, "blueberry.llm.sock"))
+SERVER_AUTHKEY_PATH = SERVERCFG.get("AuthKeyFile", os.path.join(SERVER_DIR, "authkey"))
+
+TOKEN_CACHE_ITEMS = LLMCFG.get("TokenCacheItems", 4096)
+
+GENCFG = LLMCFG.get("Generation", {})
+MAX_TOKENS = GENCFG.get("MaxTokens", 8196)
+# Wall-clock limit of one generation, checked as tokens arrive
+MAX_SECONDS = GENCFG.get("MaxSeconds", 600)
+# Tokens allowed inside <think> blocks, /nothink only leaves room for an empty one
+MAX_THINK_TOKENS = GENCFG.get("MaxThinkTokens", 2048)
+NOTHINK_TOKENS = GENCFG.get("NoThinkTokens", 16)
+
+# Outcome of a generation, reason is 'stop', 'length', 'time' or 'think'
+Generation = namedtuple("Generation", ("text", "truncated", "reason", "tokens", "elapsed"))
 
 # ================================== CLASSES ================================= #
+class RemoteModel:
+	"""
+	Stand-in for a Llama instance that lives in the LLM.server daemon.
+
+	Only the calls the rest of the code makes on a model are forwarded, so
+	callers can keep using `self.model.create_embedding(...)` unchanged.
+	"""
+	def __init__(self, kind, model_type, address=SERVER_ADDRESS):
+		self.kind = kind
+		self.model_type = model_type
+		self.address = address
+
+		self._lock = threading.Lock()
+		self._authkey = load_authkey()
+		self._conn = Client(address, family="AF_UNIX", authkey=self._authkey)
+		self._request({"op": "load"})
+
+	def _request(self, request):
+		request = {**request, "kind": self.kind, "model_type": self.model_type}
+		with self._lock:
+			try:
+				self._conn.send(request)
+				response = self._conn.recv()
+			except (EOFError, OSError):
+				# Daemon restarted between calls, retry once on a new connection
+				LOGGER.warning("Lost connection to LLM server. Reconnecting...")
+				self._conn = Client(self.address, family="AF_UNIX", authkey=self._authkey)
+				self._conn.send(request)
+				response = self._conn.recv()
+
+		if not response["ok"]:
+			raise RuntimeError(response["error"])
+		return response.get("result")
+
+	def _call(self, method, *args, **kwargs):
+		return self._request({"op": "call", "method": method, "args": args, "kwargs": kwargs})
+
+	def create_embedding(self, input, **kwargs):
+		return self._call("create_embedding", input, **kwargs)
+
+	def create_chat_completion(self, messages, **kwargs):
+		return self._call("create_chat_completion", messages, **kwargs)
+
+	def tokenize(self, text, add_bos=True, special=False):
+		return self._call("tokenize", text, add_bos=add_bos, special=special)
+
+	def generate(self, messages, **kwargs):
+		"""Runs stream_chat in the server, which applies the budgets there."""
+		return Generation(*self._call("generate", messages, **kwargs))
+
+	def close(self):
+		with self._lock:
+			self._conn.close()
+
 class BaseEmbedder:
 	def __init__(
 			self,
 			model_type,
+			local=False,
 		):
 		self.model_type = model_type
 
-		try:
-			self.model = Llama.from_pretrained(
-				repo_id=LLMCFG[model_type]["ModelName"],
-				filename=LLMCFG[model_type]["ModelFile"],
-				local_dir=os.path.join(os.environ["Dev"], "LLM", "models"),
-				embedding=True,
-				verbose=False
-			)
-			LOGGER.info(f"Initialized Embedder {model_type}")
-		except Exception as e:
-			LOGGER.error(f"Error occured while initialzing Embedder {model_type}: {e}")
-			sys.exit(1)
+		self.model = None if local else connect_to_server("embed", model_type)
+		if self.model is None:
+			try:
+				self.model = load_llama(
+					model_type,
+					local_dir=os.path.join(os.environ["Dev"], "LLM", "models"),
+					embedding=True,
+				)
+				LOGGER.info(f"Initialized Embedder {model_type}")
+			except Exception as e:
+				LOGGER.error(f"Error occured while initialzing Embedder {model_type}: {e}")
+				sys.exit(1)
+
+		self.cache = EmbeddingCache(model_type) if CACHECFG.get("Enable", True) else None
+		# A llama.cpp context must not be used from two threads at once
+		self._lock = threading.Lock()
 	
+	@staticmethod
+	def format_input(subject, body):
+		return f"Subject:{subject}\nBody:{remove_commands(body)}"
+
 	def embed(self, subject, body):
-		return np.array(
-			self.model.create_embedding(f"Subject:{subject}\nBody:{remove_commands(body)}")['data'][0]['embedding']
-		)
+		return self.embed_many([(subject, body)])[0]
+
+	def embed_many(self, items, batch_size=None):
+		"""
+		Embeds (subject, body) pairs with one llama.cpp call per batch and
+		returns them as a float32 matrix, one row per item. Inputs already
+		in the cache are not sent to the model.
+		"""
+		if batch_size is None:
+			batch_size = LLMCFG[self.model_type].get("BatchSize", 32)
+
+		texts = [self.format_input(subject, body) for subject, body in items]
+		vectors = [None] * len(texts)
+		if self.cache is not None:
+			vectors = [self.cache.get(text) for text in texts]
+		missing = [i for i, vector in enumerate(vectors) if vector is None]
+
+		for i in range(0, len(missing), batch_size):
+			batch = missing[i:i + batch_size]
+			LOGGER.debug(f"Embedding batch of {len(batch)} inputs")
+			with self._lock:
+				response = self.model.create_embedding([texts[j] for j in batch])
+			embeddings = [row['embedding'] for row in sorted(response['data'], key=lambda row: row['index'])]
+			for j, embedding in zip(batch, embeddings):
+				vectors[j] = np.asarray(embedding, dtype=np.float32)
+			if self.cache is not None:
+				self.cache.put_many([texts[j] for j in batch], embeddings)
+
+		if self.cache is not None and texts:
+			LOGGER.debug(f"Embedding cache stats: {self.cache.stats()}")
+
+		if not vectors:
+			return np.empty((0, 0), dtype=np.float32)
+		return np.vstack(vectors)
 
 class BaseChatbot:
 	def __init__(
 			self,
 			model_type,
+			local=False,
+			n_threads=None,
 		):
 		self.model_type = model_type
 
-		try:
-			self.model = Llama.from_pretrained(
-				repo_id=LLMCFG[model_type]["ModelName"],
-				filename=LLMCFG[model_type]["ModelFile"],
+		self.model = None if local else connect_to_server("chat", model_type)
+		if self.model is None:
+			kwargs = {} if n_threads is None else dict(n_threads=n_threads, n_threads_batch=n_threads)
+			draft = draft_model(model_type)
+			if draft is not None:
+				kwargs["draft_model"] = draft
+			try:
+				self.model = load_llama(
+					model_type,
+					n_ctx=LLMCFG[model_type]["ContextLength"],
+					chat_format=LLMCFG[model_type]["ChatFormat"] if LLMCFG[model_type]["ChatFormat"] else None,
+					**kwargs
+				)
+				LOGGER.info(f"Initialized LLM {model_type}")
+			except Exception as e:
+				LOGGER.error(f"Error occured while initialzing LLM {model_type}: {e}")
+				sys.exit(1)
 
-				n_ctx=LLMCFG[model_type]["ContextLength"],
-				chat_format=LLMCFG[model_type]["ChatFormat"] if LLMCFG[model_type]["ChatFormat"] else None,
-				verbose=False
-			)
-			LOGGER.info(f"Initialized LLM {model_type}")
-		except Exception as e:
-			LOGGER.error(f"Error occured while initialzing LLM {model_type}: {e}")
-			sys.exit(1)
+			cache = prompt_cache(model_type)
+			if cache is not None:
+				self.model.set_cache(cache)
 
 		self.history = None
 		self.interface = None
+
+		# Context builders count the same memories and mails over and over
+		self.count_tokens = functools.lru_cache(maxsize=TOKEN_CACHE_ITEMS)(self._count_tokens)
+
+	def _count_tokens(self, text):
+		return len(self.model.tokenize(text.encode("utf-8"), add_bos=False, special=True))
 	
 	def init_history(self, interface=None, history=None):
 		LOGGER.debug(f"Initializing history for interface '{interface}'")
@@ -107,25 +256,191 @@ class BaseChatbot:
 		
 		LOGGER.debug(f"Added {len(self.history)} records to history")
 
-	def generate_response(self, input=None):
+	def generate(self, max_tokens=MAX_TOKENS, max_seconds=MAX_SECONDS, max_think_tokens=None):
+		"""
+		Streams a response to the history and returns a Generation. Output
+		cut off by a budget is returned with truncated set, or None on error.
+		"""
 		if self.history is None:
 			LOGGER.critical("History not initialized!")
 			return None
-		
+
+		if isinstance(self.model, RemoteModel):
+			stream = self.model.generate
+		else:
+			stream = functools.partial(stream_chat, self.model)
+
 		try:
 			LOGGER.debug(f"Generating response from history for interface '{self.interface}'")
-			output = self.model.create_chat_completion(
+			generation = stream(
 				self.history,
-				max_tokens=8196,
-			)['choices'][0]['message']['content']
+				max_tokens=max_tokens,
+				max_seconds=max_seconds,
+				max_think_tokens=max_think_tokens,
+			)
 		except Exception as e:
 			LOGGER.error(f"Could not generate a response! {e}")
 			return None
+
+		LOGGER.debug(f"Generated {generation.tokens} tokens in {generation.elapsed:.1f}s ({generation.reason})")
+		if generation.truncated:
+			LOGGER.warning(f"Generation for interface '{self.interface}' cut off by its {generation.reason} budget after {generation.tokens} tokens")
+		return generation
+
+	def generate_response(self, input=None):
+		"""Returns the response text, or None when it failed or was cut off."""
+		generation = self.generate()
+		if generation is None or generation.truncated:
+			return None
 		
 		LOGGER.debug(f"Response generated")
-		return output
+		return generation.text
 
 # ================================= FUNCTIONS ================================ #
+def load_llama(model_type, **kwargs):
+	return Llama.from_pretrained(
+		repo_id=LLMCFG[model_type]["ModelName"],
+		filename=LLMCFG[model_type]["ModelFile"],
+		verbose=False,
+		**kwargs
+	)
+
+def prompt_cache(model_type):
+	"""
+	Returns the KV state cache configured under LLM.<model>.PromptCache, or
+	None when there is no such entry. For example:
+
+		"PromptCache": {"Type": "ram", "CapacityBytes": 536870912}
+
+	Type is 'ram', 'disk' (with an optional Path) or 'none'. Each cached
+	state holds a KV cache of up to ContextLength tokens, so size the
+	capacity to the memory the box can spare.
+
+	llama.cpp looks up the longest cached token prefix of each prompt and
+	restores its state, so the static head of a system prompt is only
+	evaluated once, even when mail and summary prompts alternate.
+	"""
+	cfg = LLMCFG[model_type].get("PromptCache", {})
+	cache_type = cfg.get("Type", "ram" if cfg else "none")
+	capacity = cfg.get("CapacityBytes", 512 << 20)
+	try:
+		if cache_type == "ram":
+			cache = LlamaRAMCache(capacity_bytes=capacity)
+		elif cache_type == "disk":
+			path = cfg.get("Path", os.path.join(os.environ["Data"], "llama_cache", model_type))
+			cache = LlamaDiskCache(cache_dir=path, capacity_bytes=capacity)
+		else:
+			return None
+	except Exception as e:
+		LOGGER.warning(f"Prompt cache for {model_type} unavailable: {e}")
+		return None
+	LOGGER.info(f"Using {cache_type} prompt cache of {capacity >> 20} MiB for {model_type}")
+	return cache
+
+def think_budget(messages):
+	"""Think tokens allowed by the last /think or /nothink switch of a prompt."""
+	content = messages[-1]["content"] if messages else ""
+	if content.rfind("/nothink") > content.rfind("/think"):
+		return NOTHINK_TOKENS
+	return MAX_THINK_TOKENS
+
+def stream_chat(model, messages, max_tokens=MAX_TOKENS, max_seconds=MAX_SECONDS, max_think_tokens=None):
+	"""
+	Streams a chat completion from a Llama model and stops it early when it
+	runs over max_seconds or spends more than max_think_tokens inside a
+	<think> block. Returns a Generation with whatever text was produced.
+	"""
+	if max_think_tokens is None:
+		max_think_tokens = think_budget(messages)
+
+	start = time.monotonic()
+	parts = []
+	tokens = think_tokens = 0
+	thinking = False
+	tail = ""
+	reason = None
+
+	draft = getattr(model, "draft_model", None)
+	if isinstance(draft, CountingDraft):
+		# Calls made outside stream_chat must not count towards this one
+		draft.reset()
+
+	stream = model.create_chat_completion(messages, max_tokens=max_tokens, stream=True)
+	try:
+		for chunk in stream:
+			choice = chunk["choices"][0]
+			delta = choice["delta"].get("content") or ""
+			if delta:
+				parts.append(delta)
+				tokens += 1
+				# Tags may be split over chunks, so look at the recent text
+				window = tail + delta
+				tail = window[-16:]
+				if window.rfind("</think>") > window.rfind("<think>"):
+					thinking = False
+				elif "<think>" in window:
+					thinking = True
+				think_tokens += thinking
+
+			if choice.get("finish_reason"):
+				reason = choice["finish_reason"]
+				break
+			if time.monotonic() - start > max_seconds:
+				reason = "time"
+				break
+			if think_tokens > max_think_tokens:
+				reason = "think"
+				break
+	finally:
+		# Closing the generator stops llama.cpp from sampling further
+		stream.close()
+
+	reason = reason or "stop"
+	elapsed = time.monotonic() - start
+
+	if isinstance(draft, CountingDraft):
+		proposed, accepted = draft.stats()
+		if proposed:
+			LOGGER.info(
+				f"Speculative decoding accepted {accepted}/{proposed} draft tokens "
+				f"({accepted / proposed:.0%}), {tokens / max(elapsed, 1e-6):.1f} tokens/s"
+			)
+	return Generation("".join(parts), reason != "stop", reason, tokens, elapsed)
+
+def load_authkey(create=False):
+	"""
+	Returns the LLM server's authkey, LLM.Server.AuthKey if set, else the one
+	in SERVER_AUTHKEY_PATH. With create, a missing key file is generated
+	with mode 0600. Raises FileNotFoundError if there is no key.
+	"""
+	if SERVERCFG.get("AuthKey"):
+		return SERVERCFG["AuthKey"].encode()
+
+	if create and not os.path.exists(SERVER_AUTHKEY_PATH):
+		os.makedirs(os.path.dirname(SERVER_AUTHKEY_PATH), mode=0o700, exist_ok=True)
+		fd = os.open(SERVER_AUTHKEY_PATH, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+		with os.fdopen(fd, "w") as fp:
+			fp.write(secrets.token_hex(32))
+		LOGGER.info(f"Generated LLM server authkey in {SERVER_AUTHKEY_PATH}")
+
+	with open(SERVER_AUTHKEY_PATH, "r") as fp:
+		authkey = fp.read().strip()
+	if not authkey:
+		raise ValueError(f"Empty LLM server authkey in {SERVER_AUTHKEY_PATH}")
+	return authkey.encode()
+
+def connect_to_server(kind, model_type):
+	"""Returns a RemoteModel if the LLM server is up, else None."""
+	if not SERVERCFG.get("Enable", True) or not os.path.exists(SERVER_ADDRESS):
+		return None
+
+	try:
+		model = RemoteModel(kind, model_type)
+		LOGGER.info(f"Connected to LLM server for {kind} model {model_type}")
+		return model
+	except Exception as e:
+		LOGGER.warning(f"LLM server unavailable, loading {model_type} in-process: {e}")
+		return None
 
 # =================================== MAIN =================================== #
 if __name__ == "__main__":
@@ -4,11 +4,14 @@
 # DATE         Description
 # ------------ -----------------------------------------------------------------
 # 14-MAY-2025  Initial Draft
+# 18-OCT-2026  Add /similar command
+# 18-OCT-2026  Handle empty /remember arguments
 # ============================================================================ #
 
 # ================================== IMPORTS ================================= #
 import os
 import re
+import copy
 
 from Logging import logger_init
 from utils import CFGDIR
@@ -35,13 +38,18 @@ DEFAULT_CONTEXT_CONFIG = {
 		"enable": True,
 		"topk": 3
 	},
+	# /similar[T/F,3]
+	"similar": {
+		"enable": False,
+		"topk": 3
+	},
 	# /readobs[T/F]
 	"readobs": {
 		"enable": False
 	}
 }
 
-COMMAND_RE_PATTERN = r'\/.+\[.*\]'
+COMMAND_RE_PATTERN = r'\/\w+\[[^\]]*\]'
 # ================================== CLASSES ================================= #
 
 # ================================= FUNCTIONS ================================ #
@@ -50,7 +58,7 @@ def remove_commands(body):
 
 def parse(body):
 	LOGGER.debug("Parsing mail body(s) for commands")
-	context_config = DEFAULT_CONTEXT_CONFIG.copy()
+	context_config = copy.deepcopy(DEFAULT_CONTEXT_CONFIG)
 	
 	commands = re.findall(COMMAND_RE_PATTERN, body)
 	for command in commands:
@@ -58,21 +66,26 @@ def parse(body):
 
 		if args[0] == "remember":
 			LOGGER.debug(f"Command '{args[0]}' found with args: {args[1:]}")
-			context_config["remember"] = parse_remember()
+			context_config["remember"] = parse_remember(args)
 		elif args[0] == "embeds":
 			LOGGER.debug(f"Command '{args[0]}' found with args: {args[1:]}")
-			context_config["embeds"] = parse_embeds()
+			context_config["embeds"] = parse_embeds(args)
+		elif args[0] == "similar":
+			LOGGER.debug(f"Command '{args[0]}' found with args: {args[1:]}")
+			context_config["similar"] = parse_similar(args)
 		else:
 			LOGGER.warning(f"Command {args[0]} is not recognized!")
 			continue
 	return context_config
 
 def parse_remember(args):
-	config = DEFAULT_CONTEXT_CONFIG["remember"].copy()
-	for arg in args[1:]:
+	config = copy.deepcopy(DEFAULT_CONTEXT_CONFIG["remember"])
+	# /remember[] turns memories off, empty items as in /remember[3D,] are skipped
+	items = [arg for arg in args[1:] if arg]
+	if not items:
+		config["enable"] = False
+	for arg in items:
 		match arg[-1]:
-			case "":
-				config["enable"] = False
 			case "E":
 				if arg[:-1] == "T":
 					config["today_emails"] = True
@@ -95,7 +108,7 @@ def parse_remember(args):
 	return config
 
 def parse_embeds(args):
-	config = DEFAULT_CONTEXT_CONFIG["embeds"].copy()
+	config = copy.deepcopy(DEFAULT_CONTEXT_CONFIG["embeds"])
 	if args[1] == "T":
 		config["enable"] = True
 	else:
@@ -105,5 +118,14 @@ def parse_embeds(args):
 	else:
 		LOGGER.warning(f"Argument {args[1:]} of Command {args[0]} is invalid!")
 	return config
+
+def parse_similar(args):
+	config = copy.deepcopy(DEFAULT_CONTEXT_CONFIG["similar"])
+	config["enable"] = len(args) > 1 and args[1] == "T"
+	if len(args) > 2 and args[2].isnumeric():
+		config["topk"] = int(args[2])
+	elif len(args) > 2:
+		LOGGER.warning(f"Argument {args[2]} of Command {args[0]} is invalid!")
+	return config
 		
 # =================================== MAIN =================================== #
\ No newline at end of file
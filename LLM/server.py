@@ -0,0 +1,144 @@
+# ############################################################################ #
+#                              MAINTENANCE HISTORY                             #
+# ############################################################################ #
+# DATE         Description
+# ------------ -----------------------------------------------------------------
+# 18-OCT-2026  Initial Draft
+# 18-OCT-2026  Allow tokenize calls on chat models
+# 18-OCT-2026  Serve budgeted streaming generations
+# 18-OCT-2026  Require an authkey and bind the socket in a private directory
+# ============================================================================ #
+
+# ================================== IMPORTS ================================= #
+import os
+import sys
+import threading
+from multiprocessing.connection import Listener
+
+from Logging import logger_init
+from LLM.main import (
+	BaseChatbot,
+	BaseEmbedder,
+	stream_chat,
+	load_authkey,
+	SERVER_ADDRESS,
+)
+from utils import LLM_MODEL, EMB_MODEL
+
+# ============================= GLOBAL VARIABLES ============================= #
+LOGGER = logger_init("LLM")
+
+# Loaded models and their locks, keyed by (kind, model_type)
+MODELS = {}
+LOCKS = {}
+MODELS_LOCK = threading.Lock()
+
+# ================================= CONSTANTS ================================ #
+ALLOWED_METHODS = {
+	"chat": ("create_chat_completion", "tokenize", "generate"),
+	"embed": ("create_embedding",),
+}
+
+# ================================= FUNCTIONS ================================ #
+def get_model(kind, model_type):
+	key = (kind, model_type)
+	with MODELS_LOCK:
+		if key not in MODELS:
+			LOGGER.info(f"Loading {kind} model {model_type}")
+			if kind == "chat":
+				MODELS[key] = BaseChatbot(model_type, local=True).model
+			else:
+				MODELS[key] = BaseEmbedder(model_type, local=True).model
+			LOCKS[key] = threading.Lock()
+	return MODELS[key], LOCKS[key]
+
+def handle_request(request):
+	kind = request.get("kind")
+	if kind not in ALLOWED_METHODS:
+		raise ValueError(f"Invalid model kind '{kind}'")
+
+	model, lock = get_model(kind, request["model_type"])
+
+	if request["op"] == "load":
+		return None
+	if request["op"] != "call":
+		raise ValueError(f"Invalid op '{request['op']}'")
+
+	method = request["method"]
+	if method not in ALLOWED_METHODS[kind]:
+		raise ValueError(f"Method '{method}' not allowed for {kind} models")
+
+	# Tokenizing only reads the vocabulary, so it need not wait for generation
+	if method == "tokenize":
+		return model.tokenize(*request["args"], **request["kwargs"])
+
+	# llama.cpp contexts are not thread safe, calls on one model are serialized
+	with lock:
+		# Budgets end the stream here, so one generation can't hold the lock for long
+		if method == "generate":
+			return tuple(stream_chat(model, *request["args"], **request["kwargs"]))
+		return getattr(model, method)(*request["args"], **request["kwargs"])
+
+def handle_connection(conn):
+	with conn:
+		while True:
+			try:
+				request = conn.recv()
+			except EOFError:
+				return
+
+			try:
+				response = {"ok": True, "result": handle_request(request)}
+			except Exception as e:
+				LOGGER.error(f"Could not serve request {request.get('op')}: {e}")
+				response = {"ok": False, "error": str(e)}
+
+			try:
+				conn.send(response)
+			except OSError as e:
+				LOGGER.warning(f"Client went away before response was sent: {e}")
+				return
+
+def private_dir(path):
+	"""Creates path as a 0700 directory, refuses one other users can enter."""
+	os.makedirs(path, mode=0o700, exist_ok=True)
+	st = os.stat(path)
+	if st.st_uid != os.getuid() or st.st_mode & 0o077:
+		raise PermissionError(f"Socket directory {path} must be owned by this user with mode 0700")
+
+def serve(address=SERVER_ADDRESS):
+	# Requests are unpickled, so never serve without an authkey
+	authkey = load_authkey(create=True)
+	private_dir(os.path.dirname(os.path.abspath(address)))
+
+	# Preload the default models so the first client doesn't pay for it
+	get_model("chat", LLM_MODEL)
+	get_model("embed", EMB_MODEL)
+
+	if os.path.exists(address):
+		os.unlink(address)
+
+	# The socket is created 0600, there is no window where others can connect
+	umask = os.umask(0o177)
+	try:
+		listener = Listener(address, family="AF_UNIX", authkey=authkey)
+	finally:
+		os.umask(umask)
+
+	with listener:
+		LOGGER.info(f"LLM server listening on {address}")
+
+		while True:
+			try:
+				conn = listener.accept()
+			except Exception as e:
+				LOGGER.error(f"Could not accept connection: {e}")
+				continue
+			threading.Thread(target=handle_connection, args=(conn,), daemon=True).start()
+
+# =================================== MAIN =================================== #
+if __name__ == "__main__":
+	try:
+		serve()
+	except KeyboardInterrupt:
+		sys.exit(0)
@@ -0,0 +1,127 @@
+# ############################################################################ #
+#                              MAINTENANCE HISTORY                             #
+# ############################################################################ #
+# DATE         Description
+# ------------ -----------------------------------------------------------------
+# 18-OCT-2026  Initial Draft
+# 18-OCT-2026  Forget the unchecked draft when stats are taken
+# ============================================================================ #
+
+# ================================== IMPORTS ================================= #
+import numpy as np
+from llama_cpp import Llama
+from llama_cpp.llama_speculative import LlamaDraftModel, LlamaPromptLookupDecoding
+
+from Logging import logger_init
+from utils import load_config
+
+# ============================= GLOBAL VARIABLES ============================= #
+LOGGER = logger_init("LLM")
+
+# ================================= CONSTANTS ================================ #
+LLMCFG = load_config()["LLM"]
+
+# ================================== CLASSES ================================= #
+class SmallModelDraft(LlamaDraftModel):
+	"""
+	Drafts tokens greedily with a small model sharing the main model's
+	vocabulary. llama.cpp keeps the longest matching token prefix between
+	calls, so only the newly accepted tokens are evaluated each time.
+	"""
+	def __init__(self, model, num_pred_tokens=8):
+		self.model = model
+		self.num_pred_tokens = num_pred_tokens
+
+	def __call__(self, input_ids, /, **kwargs):
+		draft = []
+		tokens = self.model.generate(input_ids.tolist(), top_k=1, temp=0.0)
+		try:
+			for token in tokens:
+				draft.append(token)
+				if len(draft) >= self.num_pred_tokens:
+					break
+		finally:
+			tokens.close()
+		return np.array(draft, dtype=np.intc)
+
+class CountingDraft(LlamaDraftModel):
+	"""
+	Wraps a draft model and counts how many of its tokens the main model
+	accepts. Every step keeps the accepted draft tokens plus one sampled
+	token, so the acceptance follows from how far input_ids grew since
+	the previous call.
+	"""
+	def __init__(self, draft):
+		self.draft = draft
+		self.reset()
+
+	def __call__(self, input_ids, /, **kwargs):
+		n_tokens = len(input_ids)
+		if self._last_len is not None and n_tokens > self._last_len:
+			self.accepted += min(self._last_proposed, n_tokens - self._last_len - 1)
+		else:
+			# A new prompt, the previous draft was never checked
+			self.proposed -= self._last_proposed
+
+		draft = self.draft(input_ids, **kwargs)
+		self.proposed += len(draft)
+		self._last_len = n_tokens
+		self._last_proposed = len(draft)
+		return draft
+
+	def stats(self):
+		"""
+		Returns (proposed, accepted) since the last call and resets them.
+		Called at the end of a generation, so the draft of its last step is
+		never checked and the next call starts on a new prompt.
+		"""
+		stats = (self.proposed - self._last_proposed, self.accepted)
+		self.reset()
+		return stats
+
+	def reset(self):
+		"""Drops the counters and the draft of a previous generation."""
+		self.proposed = 0
+		self.accepted = 0
+		self._last_len = None
+		self._last_proposed = 0
+
+# ================================= FUNCTIONS ================================ #
+def draft_model(model_type):
+	"""
+	Returns the draft model configured under LLM.<model>.Speculative, or None.
+
+	'lookup' drafts by matching the last n-grams against the prompt, which
+	pays off when the output quotes its input, as summaries do with names,
+	dates and subjects. 'draft' runs a small GGUF model of the same family.
+	"""
+	cfg = LLMCFG[model_type].get("Speculative", {})
+	draft_type = cfg.get("Type", "none")
+	num_pred_tokens = cfg.get("NumPredTokens", 10 if draft_type == "lookup" else 8)
+	try:
+		if draft_type == "lookup":
+			draft = LlamaPromptLookupDecoding(
+				max_ngram_size=cfg.get("MaxNgramSize", 2),
+				num_pred_tokens=num_pred_tokens,
+			)
+		elif draft_type == "draft":
+			draft = SmallModelDraft(
+				Llama.from_pretrained(
+					repo_id=cfg["DraftModelName"],
+					filename=cfg["DraftModelFile"],
+					n_ctx=LLMCFG[model_type]["ContextLength"],
+					verbose=False,
+				),
+				num_pred_tokens=num_pred_tokens,
+			)
+		else:
+			return None
+	except Exception as e:
+		LOGGER.warning(f"Speculative decoding for {model_type} unavailable: {e}")
+		return None
+	LOGGER.info(f"Using {draft_type} speculative decoding with {num_pred_tokens} draft tokens for {model_type}")
+	return CountingDraft(draft)
+
+# =================================== MAIN =================================== #
+if __name__ == "__main__":
+	pass
@@ -5,15 +5,24 @@
 # ------------ -----------------------------------------------------------------
 # 15-MAY-2025  Initial Draft
 # 12-JUL-2025  Refactor for thematic context summarization
+# 18-OCT-2026  Use EmbeddingIndex for past memory retrieval
+# 18-OCT-2026  Store embeddings in the binary format
+# 18-OCT-2026  Mirror embeddings to vector shards
+# 18-OCT-2026  Queue summaries in the outbox and send over one SMTP session
+# 18-OCT-2026  Generate summaries on a process pool with --workers
+# 18-OCT-2026  Fit period data and memories into a token budget
+# 18-OCT-2026  Map-reduce periods too large for one prompt
+# 18-OCT-2026  Retry summary writes when the DB is locked
+# 18-OCT-2026  Reduce notes too large for one prompt recursively
 # ============================================================================ #
 
 # ================================== IMPORTS ================================= #
 import os
 import sys
 import email
-import pickle
-import smtplib
-import numpy as np
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from email.mime.text import MIMEText
 from datetime import timedelta, datetime
 from email.mime.multipart import MIMEMultipart
@@ -21,9 +30,11 @@ from email.mime.multipart import MIMEMultipart
 from dateutil.relativedelta import relativedelta
 
 from Logging import logger_init
-from LLM.cosine import cosine
-from LLM import BaseChatbot, BaseEmbedder
-from Database import connect_to_dataset, get_or_create_client
+from LLM import BaseChatbot, BaseEmbedder, EmbeddingIndex
+from LLM.context import ContextBuilder, context_budget, token_counter
+from Database import connect_to_dataset, get_or_create_client, encode_embedding, write_transaction
+from Database.shards import append_vectors
+from MailServer.outbox import enqueue, flush
 from utils import (
     load_config,
 	remove_think_blocks,
@@ -31,9 +42,6 @@ from utils import (
     LLM_MODEL,
     EMB_MODEL,
     EMAIL,
-    PASSWORD,
-    SMTP_HOST,
-    SMTP_PORT,
     CLIENTS,
     CLIENTNAMES,
 )
@@ -41,13 +49,18 @@ from utils import (
 # ============================= GLOBAL VARIABLES ============================= #
 LOGGER = logger_init("LLM")
 
+# Model of a summary worker process, see init_worker
+WORKER_LLM = None
+
 # ================================= CONSTANTS ================================ #
 LLMCFG = load_config()["LLM"]
+# Rounds of summarizing notes again before the rest is trimmed to fit
+MAX_REDUCE_LEVELS = LLMCFG.get("SummaryReduceLevels", 3)
 
 # ================================== CLASSES ================================= #
 
 # ================================= FUNCTIONS ================================ #
-def get_relevant_past_memories(db, emb, client_id, current_period_text, top_k=3):
+def get_relevant_past_memories(db, emb, client_id, current_period_text, top_k=3, index=None):
     """Retrieves past memories thematically relevant to the current period's text."""
     if not current_period_text:
         return []
@@ -57,25 +70,16 @@ def get_relevant_past_memories(db, emb, client_id, current_period_text, top_k=3)
         # Embed the summary of the current period's content
         current_embedding = emb.embed("Current Period Summary", current_period_text)
 
-        # Fetch all past memory embeddings for the client
-        past_memories = list(db['memory_embeddings'].find(client_id=client_id))
-        if not past_memories:
+        if index is None:
+            index = EmbeddingIndex(db)
+
+        # Rank all past memory embeddings for the client
+        similarities = index.search(client_id, current_embedding, top_k)
+        if not similarities:
             LOGGER.info("No past memories found to compare against.")
             return []
 
-        # Calculate cosine similarity
-        similarities = []
-        for mem in past_memories:
-            past_embedding = pickle.loads(mem['embedding'])
-            sim = cosine(np.array(current_embedding), np.array(past_embedding))
-            similarities.append((sim, mem['memory_id']))
-
-        # Sort by similarity and get top_k
-        similarities.sort(key=lambda x: x[0], reverse=True)
-        top_memory_ids = [mem_id for sim, mem_id in similarities[:top_k]]
-
-        if not top_memory_ids:
-            return []
+        top_memory_ids = [mem_id for sim, mem_id in similarities]
 
         # Retrieve the text of the most relevant memories
         relevant_memories = list(db['memories'].find(id=top_memory_ids))
@@ -87,23 +91,12 @@ def get_relevant_past_memories(db, emb, client_id, current_period_text, top_k=3)
         return []
 
 
-def summarize(summary_type, start_date, llm, emb, respond=True):
-	if summary_type not in ("daily", "weekly", "monthly", "quarterly"):
-		LOGGER.warning(f"Invalid summary type {summary_type}! Ignoring.")
-		return
-	
-	LOGGER.debug(f"Creating {summary_type} summaries")
-
+def plan_summary(summary_type, start_date):
+	"""Returns the period, source query and subject of a summary ending at start_date."""
 	cfg = load_config()["Summarizer"][summary_type]
 	period_start = start_date - relativedelta(**cfg["delta"])
 	period_end = start_date
 
-	# Connect to DB
-	db = connect_to_dataset()
-	table = db[cfg['source_table']]
-	mem_table = db['memories']
-	mem_emb_table = db['memory_embeddings']
-
 	# Build filter dict
 	query = {**cfg.get("source_filter", {}),
 			 "client_id": None}
@@ -126,26 +119,45 @@ def summarize(summary_type, start_date, llm, emb, respond=True):
 		today = period_start
 		subject = f'{summary_type.capitalize()} Summary {period_start.strftime("%a, %d %B")}'
 
-	for client, client_name in zip(CLIENTS, CLIENTNAMES):
-		client_id = get_or_create_client(client, client_name)
-		if client_id == -1:
-			continue
-		query["client_id"] = client_id
+	return dict(
+		summary_type=summary_type,
+		cfg=cfg,
+		period_start=period_start,
+		period_end=period_end,
+		query=query,
+		today=today,
+		subject=subject,
+	)
+
+def prepare_summary(db, emb, plan, client, client_name, mem_index, count_tokens=None):
+	"""
+	Collects a client's data for the period and builds the summary prompt,
+	trimmed to the context window when count_tokens is given.
+	"""
+	cfg = plan['cfg']
+	summary_type = plan['summary_type']
+	today = plan['today']
+	table = db[cfg['source_table']]
 
-		try:
-			records = tuple(table.find(**query, order_by='id'))
-		except Exception as e:
-			LOGGER.error(f"Could not retrieve data for the current period, {e}")
-			continue
-		if len(records) == 0:
-			LOGGER.info(f"No data to summarize for client {client_id} in the current period.")
-			continue
-
-		# --- Build Current Period Context ---
-		current_period_content_list = []
-		if summary_type == "daily":
-			for r in records:
-				current_period_content_list.append(f'''[EMAIL]
+	client_id = get_or_create_client(client, client_name)
+	if client_id == -1:
+		return None
+	query = {**plan['query'], "client_id": client_id}
+
+	try:
+		records = tuple(table.find(**query, order_by='id'))
+	except Exception as e:
+		LOGGER.error(f"Could not retrieve data for the current period, {e}")
+		return None
+	if len(records) == 0:
+		LOGGER.info(f"No data to summarize for client {client_id} in the current period.")
+		return None
+
+	# --- Build Current Period Context ---
+	current_period_content_list = []
+	if summary_type == "daily":
+		for r in records:
+			current_period_content_list.append(f'''[EMAIL]
 From: {r["from_name"]}
 To: {r["to_name"]}
 Date: {r["time_received"]}
@@ -153,113 +165,303 @@ Subject: {r["subject"]}
 Body:
 {r["body"]}
 [/EMAIL]''')
-		else:
-			for r in records:
-				current_period_content_list.append(f"[SUMMARY FROM {r['created_at']}]\n{r['text']}\n[/SUMMARY]")
-		
-		current_period_text = "\n\n".join(current_period_content_list)
-
-		# --- Get Relevant Past Memories ---
-		relevant_memories = get_relevant_past_memories(db, emb, client_id, current_period_text)
-		
-		past_memories_text = ""
-		if relevant_memories:
-			past_memories_list = []
-			for mem in relevant_memories:
-				past_memories_list.append(f"[PAST MEMORY from {mem['period_start'].strftime('%Y-%m-%d')}]\n{mem['text']}\n[/PAST MEMORY]")
-			past_memories_text = "\n\n".join(past_memories_list)
-
-		# --- Construct Final Content for Prompt ---
-		final_content = "--- DATA FOR CURRENT PERIOD ---\n"
-		final_content += current_period_text
-		if past_memories_text:
-			final_content += "\n\n--- RELEVANT PAST MEMORIES FOR CONTEXT ---\n"
-			final_content += past_memories_text
-		
-		final_content = remove_think_blocks(final_content)
-
-		prompt_template = read_prompt_from_file("summary_prompt.txt")
-		if not prompt_template:
-			LOGGER.error("Failed to read summary prompt, aborting summarization for this client.")
-			continue
-
-		prompt = prompt_template.format(
+	else:
+		for r in records:
+			current_period_content_list.append(f"[SUMMARY FROM {r['created_at']}]\n{r['text']}\n[/SUMMARY]")
+	
+	current_period_text = "\n\n".join(current_period_content_list)
+
+	prompt_template = read_prompt_from_file("summary_prompt.txt")
+	if not prompt_template:
+		LOGGER.error("Failed to read summary prompt, aborting summarization for this client.")
+		return None
+
+	def format_prompt(content):
+		return prompt_template.format(
 			client_name=client_name,
 			today=today.strftime("%a, %d %B"),
 			summary_type=summary_type,
 			header=cfg["header"].format(client_name=client_name),
-			content=final_content
+			content=content
 		)
 
-		history = [{"role": "system", "content": prompt}]
-		llm.init_history('summary', history)
+	# --- Get Relevant Past Memories ---
+	relevant_memories = get_relevant_past_memories(db, emb, client_id, current_period_text, index=mem_index)
+	past_memories_list = [
+		f"[PAST MEMORY from {mem['period_start'].strftime('%Y-%m-%d')}]\n{mem['text']}\n[/PAST MEMORY]"
+		for mem in relevant_memories
+	]
+
+	budget = None
+	if count_tokens is not None:
+		budget = context_budget(LLM_MODEL, count_tokens(format_prompt("")))
+
+	def build_history(current_items):
+		prompt = fit_summary_prompt(format_prompt, current_items, past_memories_list, count_tokens, budget)
+		return [{"role": "system", "content": prompt}]
+
+	job = dict(
+		client=client,
+		client_id=client_id,
+	)
+
+	# --- Split periods too large for one prompt into parts ---
+	chunks = split_period(cfg, current_period_content_list, count_tokens, budget)
+	if chunks is None:
+		job['history'] = build_history(current_period_content_list)
+		return job
+
+	chunk_template = read_prompt_from_file("summary_chunk_prompt.txt")
+	if not chunk_template:
+		LOGGER.error("Failed to read summary chunk prompt, aborting summarization for this client.")
+		return None
+
+	def build_chunks(chunks):
+		return [
+			[{"role": "system", "content": remove_think_blocks(chunk_template.format(
+				client_name=client_name,
+				summary_type=summary_type,
+				part=i + 1,
+				parts=len(chunks),
+				content="\n\n".join(chunk),
+			))}]
+			for i, chunk in enumerate(chunks)
+		]
+
+	def reduce(notes, level):
+		"""Returns the final prompt, or the notes split into parts for another round."""
+		parts = [f"[PART {i + 1} OF {len(notes)}]\n{note}\n[/PART]" for i, note in enumerate(notes)]
+		if level < MAX_REDUCE_LEVELS and sum(map(count_tokens, parts)) > budget:
+			chunks = chunk_items(parts, count_tokens, cfg.get("MapReduce", {}).get("ChunkTokens"))
+			if len(chunks) < len(notes):
+				LOGGER.info(f"Notes of client {client_id} exceed the budget, summarizing them again in {len(chunks)} parts")
+				return dict(chunks=build_chunks(chunks))
+		return dict(history=build_history(parts))
+
+	LOGGER.info(f"Summarizing {summary_type} period of client {client_id} in {len(chunks)} parts")
+	job['chunks'] = build_chunks(chunks)
+	job['reduce'] = reduce
+	return job
+
+def fit_summary_prompt(format_prompt, current_items, memory_items, count_tokens=None, budget=None):
+	"""Builds the summary prompt, fitting newest period data first into budget."""
+	builder = ContextBuilder(count_tokens, budget)
+	builder.add("current", current_items, ranks=list(range(len(current_items)))[::-1])
+	builder.add("similar", memory_items)
+	sections = builder.build()
+
+	# --- Construct Final Content for Prompt ---
+	final_content = "--- DATA FOR CURRENT PERIOD ---\n"
+	final_content += "\n\n".join(sections["current"])
+	if sections["similar"]:
+		final_content += "\n\n--- RELEVANT PAST MEMORIES FOR CONTEXT ---\n"
+		final_content += "\n\n".join(sections["similar"])
+	
+	final_content = remove_think_blocks(final_content)
+	return format_prompt(final_content)
+
+def split_period(cfg, items, count_tokens=None, budget=None):
+	"""
+	Returns the period's items grouped into parts of at most ChunkTokens
+	tokens when they exceed the MapReduce threshold of the summary type, or
+	None when they fit in one prompt. Oversized items are truncated.
+	"""
+	mapcfg = cfg.get("MapReduce", {})
+	if count_tokens is None or budget is None or not mapcfg.get("Enable", True):
+		return None
+
+	threshold = mapcfg.get("Threshold") or budget
+	if sum(map(count_tokens, items)) <= threshold:
+		return None
+	return chunk_items(items, count_tokens, mapcfg.get("ChunkTokens"))
+
+def chunk_items(items, count_tokens, chunk_tokens=None):
+	"""Groups items in order into parts that fit the chunk prompt."""
+	chunk_template = read_prompt_from_file("summary_chunk_prompt.txt") or ""
+	max_tokens = context_budget(LLM_MODEL, count_tokens(chunk_template))
+	if chunk_tokens:
+		max_tokens = min(max_tokens, chunk_tokens)
+
+	tokens = [count_tokens(item) for item in items]
+	builder = ContextBuilder(count_tokens, max_tokens)
+	chunks = [[]]
+	used = 0
+	for item, item_tokens in zip(items, tokens):
+		if item_tokens > max_tokens:
+			item = builder.truncate(item, max_tokens)
+			item_tokens = count_tokens(item)
+		if chunks[-1] and used + item_tokens > max_tokens:
+			chunks.append([])
+			used = 0
+		chunks[-1].append(item)
+		used += item_tokens
+	return chunks
+
+def generate_summary(llm, history):
+	llm.init_history('summary', history)
+
+	LOGGER.info("Calling LLM to generate a reply")
+	llm_output = llm.generate_response()
+	if llm_output is None:
+		return None
+	return remove_think_blocks(llm_output)
+
+def run_summary(job, submit):
+	"""
+	Generates a job's summary through submit(history) -> Future. The parts
+	of a split period are submitted together, then reduced into one summary.
+	Notes too large to reduce at once are split and summarized again.
+	"""
+	history = job.get('history')
+	chunks = job.get('chunks')
+	level = 0
+	while history is None:
+		futures = [submit(chunk) for chunk in chunks]
+		notes = [future.result() for future in futures]
+		if any(note is None for note in notes):
+			LOGGER.error(f"Could not summarize every part of the period for client {job['client_id']}")
+			return None
+		level += 1
+		step = job['reduce'](notes, level)
+		history = step.get('history')
+		chunks = step.get('chunks')
+	return submit(history).result()
+
+def store_summary(db, emb, mem_index, plan, job, llm_output, respond):
+	"""Writes a generated summary and, if respond, queues it for the client."""
+	summary_type = plan['summary_type']
+	subject = plan['subject']
+	mem_table = db['memories']
+	mem_emb_table = db['memory_embeddings']
+	client = job['client']
+	client_id = job['client_id']
+
+	# Add summary to Memory DB
+	def write(embedding):
+		memory_id = mem_table.insert(dict(
+			client_id=client_id,
+			memory_type=summary_type,
+			text=llm_output,
+			period_start=plan['period_start'],
+			period_end=plan['period_end'],
+		))
+		mem_emb_table.insert(dict(
+			memory_id=memory_id,
+			client_id=client_id,
+			model=EMB_MODEL,
+			**encode_embedding(embedding)
+		))
+		return memory_id
+
+	try:
+		LOGGER.debug(f'Inserting {subject} for client {client_id} to memory')
+
+		# Embed the combination of the subject and the generated text for better semantic meaning
+		embedding_text = f"Subject: {subject}\n\nSummary:\n{llm_output}"
+		embedding = emb.embed("Summary Embedding", embedding_text)
+		memory_id = write_transaction(db, write, embedding)
+		append_vectors('memory_embeddings', client_id, [memory_id], [embedding])
+		mem_index.add(client_id, memory_id, embedding)
+		LOGGER.debug(f"Inserted {summary_type} summary in table 'memories'")
+	except Exception as e:
+		LOGGER.error(f"Could not insert memory in table 'memories': {e}")
+	
+	# Send summary to client
+	if respond:
+		response_mail = MIMEMultipart()
+		response_mail["From"] = EMAIL
+		response_mail["To"] = client
+		response_mail["Subject"] = subject
+		response_mail["Message-ID"] = email.utils.make_msgid()
 
-		LOGGER.info("Calling LLM to generate a reply")
-		llm_output = llm.generate_response()
-		if llm_output is None:
-			continue
-		
-		llm_output = remove_think_blocks(llm_output)
+		response_mail.attach(MIMEText(llm_output, "plain"))
+		LOGGER.debug("Response mail formatted")
 
-		# Add summary to Memory DB
-		db.begin()
 		try:
-			LOGGER.debug(f'Inserting {subject} for client {client_id} to memory')
-
-			memory_id = mem_table.insert(dict(
-				client_id=client_id,
-				memory_type=summary_type,
-				text=llm_output,
-				period_start=period_start,
-				period_end=period_end,
-			))
-			# Embed the combination of the subject and the generated text for better semantic meaning
-			embedding_text = f"Subject: {subject}\n\nSummary:\n{llm_output}"
-			embedding = emb.embed("Summary Embedding", embedding_text)
-			mem_emb_table.insert(dict(
-				memory_id=memory_id,
-				client_id=client_id,
-				model=EMB_MODEL,
-				embedding=pickle.dumps(embedding)
-			))
-			db.commit()
-			LOGGER.debug(f"Inserted {summary_type} summary in table 'memories'")
+			write_transaction(db, enqueue, db, response_mail, client)
 		except Exception as e:
-			LOGGER.error(f"Could not insert memory in table 'memories': {e}")
-			db.rollback()
-		
-		# Send summary to client
-		if respond:
-			response_mail = MIMEMultipart()
-			response_mail["From"] = EMAIL
-			response_mail["To"] = client
-			response_mail["Subject"] = subject
-			response_mail["Message-ID"] = email.utils.make_msgid()
-
-			response_mail.attach(MIMEText(llm_output, "plain"))
-			LOGGER.debug("Response mail formatted")
+			LOGGER.error(f"Could not queue summary mail for {client}, {e}")
+
+def summarize(summary_type, start_date, llm, emb, respond=True, workers=1):
+	"""
+	Summarizes the period ending at start_date for every client.
+
+	With workers > 1 the prompts are generated on a pool of processes, each
+	with its own model copy and an equal share of the CPU threads, while this
+	process keeps retrieval and remains the only DB writer. llm may then be None.
+	"""
+	if summary_type not in ("daily", "weekly", "monthly", "quarterly"):
+		LOGGER.warning(f"Invalid summary type {summary_type}! Ignoring.")
+		return
+	
+	LOGGER.debug(f"Creating {summary_type} summaries")
+
+	plan = plan_summary(summary_type, start_date)
 
+	# Connect to DB
+	db = connect_to_dataset()
+	mem_index = EmbeddingIndex(db)
+
+	def store(job, llm_output):
+		store_summary(db, emb, mem_index, plan, job, llm_output, respond)
+
+	count_tokens = token_counter(LLM_MODEL, llm)
+	jobs = (
+		prepare_summary(db, emb, plan, client, client_name, mem_index, count_tokens)
+		for client, client_name in zip(CLIENTS, CLIENTNAMES)
+	)
+
+	if workers <= 1:
+		pool = ThreadPoolExecutor(max_workers=1)
+		submit = lambda history: pool.submit(generate_summary, llm, history)
+	else:
+		n_threads = max(1, (os.cpu_count() or 1) // workers)
+		LOGGER.info(f"Summarizing on {workers} workers with {n_threads} threads each")
+		# Spawned workers do not inherit this process's models or connections
+		pool = ProcessPoolExecutor(
+			max_workers=workers,
+			mp_context=multiprocessing.get_context("spawn"),
+			initializer=init_worker,
+			initargs=(n_threads,),
+		)
+		submit = lambda history: pool.submit(worker_generate, history)
+
+	# Drivers only wait on the pool, walking split periods through map and reduce
+	with pool, ThreadPoolExecutor(max_workers=max(1, workers)) as drivers:
+		futures = {drivers.submit(run_summary, job, submit): job for job in jobs if job is not None}
+		for future in as_completed(futures):
 			try:
-				LOGGER.debug("Sending mail to client...")
-				with smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT) as smtp_server:
-					smtp_server.login(EMAIL, PASSWORD)
-					smtp_server.sendmail(EMAIL, client, response_mail.as_string())
+				llm_output = future.result()
 			except Exception as e:
-				LOGGER.error(f"Error occured while sending mail, {e}")
+				LOGGER.error(f"Summary worker failed for client {futures[future]['client_id']}: {e}")
 				continue
+			if llm_output is not None:
+				store(futures[future], llm_output)
+
+	# Send all summaries over one SMTP session
+	if respond:
+		flush(db)
+
+def init_worker(n_threads):
+	"""Loads this worker process's own model copy."""
+	global WORKER_LLM
+	WORKER_LLM = BaseChatbot(LLM_MODEL, local=True, n_threads=n_threads)
+
+def worker_generate(history):
+	return generate_summary(WORKER_LLM, history)
 
 # =================================== MAIN =================================== #
 if __name__ == "__main__":
-	if len(sys.argv) < 2:
-		print("Usage: python -m LLM.summarize <summary_type>")
-		sys.exit(1)
-	summary_type = sys.argv[1]
+	parser = argparse.ArgumentParser(description="Summarize the last period for every client")
+	parser.add_argument("summary_type", choices=("daily", "weekly", "monthly", "quarterly"))
+	parser.add_argument("--workers", type=int, default=LLMCFG.get("SummaryWorkers", 1), help="Generate on N worker processes, each with its own model")
+	args = parser.parse_args()
 
-	# Init LLM
-	llm = BaseChatbot(LLM_MODEL)
+	# Init LLM, workers load their own
+	llm = BaseChatbot(LLM_MODEL) if args.workers <= 1 else None
 	# Init Embedder
 	emb = BaseEmbedder(EMB_MODEL)
 
 	today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-	summarize(summary_type, today, llm, emb, True)
+	summarize(args.summary_type, today, llm, emb, True, args.workers)
 	sys.exit(0)
\ No newline at end of file
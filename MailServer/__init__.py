@@ -1 +1 @@
-from .auth import imap_auth, check_smtp_auth
\ No newline at end of file
+from .auth import imap_auth, imap_connect, check_smtp_auth
\ No newline at end of file
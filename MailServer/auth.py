@@ -5,6 +5,7 @@
 # ------------ -----------------------------------------------------------------
 # 07-MAR-2025  Initial Draft
 # 12-JUL-2025  Refactor to use shared constants from utils
+# 18-OCT-2026  Split out imap_connect for long-lived sessions
 # ============================================================================ #
 
 # ================================== IMPORTS ================================= #
@@ -28,14 +29,26 @@ LOGGER = logger_init("MailServer")
 # to avoid circular dependency if we move imap_auth to utils.
 
 # ================================= FUNCTIONS ================================ #
+def imap_connect(host=None, port=None, ssl=True):
+	"""Logs into IMAP, raising on failure. host/port default to secrets.yml."""
+	if host is None:
+		# IMAP_HOST is intentionally loaded here to keep auth logic separate
+		from utils import load_secrets
+		imap_cfg = load_secrets()["Mail"]["Zoho"]["imap"]
+		host = imap_cfg["host"]
+		port = port or imap_cfg.get("port")
+
+	if ssl:
+		mailserver = imaplib.IMAP4_SSL(host, port or imaplib.IMAP4_SSL_PORT)
+	else:
+		mailserver = imaplib.IMAP4(host, port or imaplib.IMAP4_PORT)
+	mailserver.login(EMAIL, PASSWORD)
+	return mailserver
+
 def imap_auth():
 	LOGGER.debug("Logging into blueberry IMAP...")
 	try:
-		# IMAP_HOST is intentionally loaded here to keep auth logic separate
-		from utils import load_secrets
-		IMAP_HOST = load_secrets()["Mail"]["Zoho"]["imap"]["host"]
-		mailserver = imaplib.IMAP4_SSL(IMAP_HOST)
-		mailserver.login(EMAIL, PASSWORD)
+		mailserver = imap_connect()
 		LOGGER.info("Logged in to blueberry IMAP")
 	except Exception as e:
 		LOGGER.error(f"Could not log into IMAP: {e}")
@@ -5,21 +5,33 @@
 # ------------ -----------------------------------------------------------------
 # 13-MAY-2025  Initial Draft
 # 12-JUL-2025  Refactor to use shared constants and add threading logic
+# 18-OCT-2026  Embed new mails in batches
+# 18-OCT-2026  Store embeddings in the binary format
+# 18-OCT-2026  Mirror embeddings to vector shards
+# 18-OCT-2026  Add IMAP IDLE daemon mode
+# 18-OCT-2026  Fetch by UID in bulk FETCH commands
+# 18-OCT-2026  Search all clients in one OR-composed SEARCH
+# 18-OCT-2026  Only search UIDs above the stored sync cursor
+# 18-OCT-2026  Write new mails in one transaction per batch
 # ============================================================================ #
 
 # ================================== IMPORTS ================================= #
 import os
+import sys
 import time
 import email
-import pickle
+import fcntl
+import argparse
 from datetime import timedelta, datetime
 
-import numpy as np
-
 from LLM import BaseEmbedder
 from Logging import logger_init
 from MailServer import imap_auth
+from MailServer.idle import IdleSession
+from MailServer.imap import fetch_messages, mark_seen
+from MailServer.sync import MailboxSync
 from Database import connect_to_dataset, get_or_create_client
+from Database.writer import existing_message_ids, insert_emails
 from utils import (
     load_secrets,
     strip_quoted_reply,
@@ -33,13 +45,18 @@ LOGGER = logger_init("MailServer")
 # ================================= CONSTANTS ================================ #
 IMAP_HOST = load_secrets()["Mail"]["Zoho"]["imap"]["host"]
 
+# Shared with the reply cron job so the daemon never replies concurrently
+REPLY_LOCK_PATH = "/tmp/blueberry.reply.lock"
+
 # ================================== CLASSES ================================= #
 
 # ================================= FUNCTIONS ================================ #
-def fetch_mails():
-	# Login to Zoho
-	imap_server = imap_auth()
-	imap_server.select('inbox')
+def fetch_mails(imap_server=None, sync=None):
+	own_session = imap_server is None
+	if own_session:
+		# Login to Zoho
+		imap_server = imap_auth()
+		imap_server.select('inbox')
 
 	mail_ids = None
 	try:
@@ -55,144 +72,184 @@ def fetch_mails():
 			imap_server.select('inbox')
 
 		# Select unseen mails from clients
-		all_ids = set()
-		for client in current_clients:
-			status, data = imap_server.search(None, 'UNSEEN', 'FROM', client)
-			if status == 'OK':
-				ids = data[0].split()
-				if ids:
-					all_ids.update(ids)
-		mail_ids = sorted(map(int, all_ids))
+		if sync is None:
+			sync = MailboxSync('inbox')
+		mail_ids = sorted(sync.pending(imap_server, current_clients, 'UNSEEN'))
 
 		LOGGER.info(f"Found {len(mail_ids)} mails")
 	except Exception as e:
 		LOGGER.debug(f"Could not fetch mails: {e}")
 		return None
 
-	imap_server.logout()
+	if own_session:
+		imap_server.logout()
 
 	return mail_ids
 
-def insert_mails_to_db(mail_ids):
-	if mail_ids is None or len(mail_ids) == 0:
+def insert_mails_to_db(mail_ids, imap_server=None, emb=None, sync=None):
+	if mail_ids is None:
+		return
+	if len(mail_ids) == 0:
+		if sync is not None:
+			sync.commit()
 		return
 	
-	# Login to Zoho
-	imap_server = imap_auth()
-	imap_server.select('inbox')
+	own_session = imap_server is None
+	if own_session:
+		# Login to Zoho
+		imap_server = imap_auth()
+		imap_server.select('inbox')
 
 	# Connect to DB
 	db = connect_to_dataset()
-	email_table = db['emails']
-	email_embed_table = db['email_embeddings']
 	
 	# Init Embedder
-	emb = BaseEmbedder(EMB_MODEL)
+	if emb is None:
+		emb = BaseEmbedder(EMB_MODEL)
 
-	for mail_id in mail_ids:
-		try:
-			LOGGER.debug(f"Fetching mail {mail_id}")
+	new_mails = []
+	seen_ids = []
+	# Mails that can never be decoded should not hold the sync cursor back
+	skipped_ids = []
+	try:
+		messages = fetch_messages(imap_server, mail_ids)
+		for mail_id, _, raw_mail in messages:
+			try:
+				subject    = raw_mail.get("Subject")
+				msg_id     = raw_mail.get("Message-ID", email.utils.make_msgid())
+				references = raw_mail.get("References")
+				to_name,   to_addr   = email.utils.parseaddr(raw_mail.get("To"))
+				from_name, from_addr = email.utils.parseaddr(raw_mail.get("From"))
+
+				# To store as UTC Time
+				date = email.utils.parsedate(raw_mail.get("Date"))
+				mail_datetime = datetime.fromtimestamp(time.mktime(date) - timedelta(hours=5, minutes=30).seconds)
+		
+				body = ""
+				if raw_mail.is_multipart():
+					for part in raw_mail.walk():
+						content_type = part.get_content_type()
+						if content_type == "text/plain":
+							body = part.get_payload(decode=True).decode()
+							break
+				else:
+					body = raw_mail.get_payload(decode=True).decode()
+			
+				clean_body = strip_quoted_reply(body)
 
-			status, _ = imap_server.noop()
-			if status != 'OK':
-				LOGGER.warning("IMAP NOOP Failed. Reconnecting...")
-				imap_server.logout()
-				imap_server = imap_auth()
-				imap_server.select('inbox')
+			except Exception as e:
+				LOGGER.error(f"Error occured while decoding mail {msg_id}, {e}")
+				skipped_ids.append(mail_id)
+				continue
 
-			_, raw_mail_data = imap_server.fetch(str(mail_id).encode(), "(RFC822)")
-		except Exception as e:
-			LOGGER.error(f"Could not fetch mail {mail_id} from {IMAP_HOST}: {e}")
-			continue
+			# Get Client ID
+			client_id = get_or_create_client(from_addr, from_name)
+			if client_id == -1:
+				continue
 
-		try:
-			raw_mail = email.message_from_bytes(raw_mail_data[0][1])
-			
-			subject    = raw_mail.get("Subject")
-			msg_id     = raw_mail.get("Message-ID", email.utils.make_msgid())
-			references = raw_mail.get("References")
-			to_name,   to_addr   = email.utils.parseaddr(raw_mail.get("To"))
-			from_name, from_addr = email.utils.parseaddr(raw_mail.get("From"))
-
-			# To store as UTC Time
-			date = email.utils.parsedate(raw_mail.get("Date"))
-			mail_datetime = datetime.fromtimestamp(time.mktime(date) - timedelta(hours=5, minutes=30).seconds)
-		
-			body = ""
-			if raw_mail.is_multipart():
-				for part in raw_mail.walk():
-					content_type = part.get_content_type()
-					if content_type == "text/plain":
-						body = part.get_payload(decode=True).decode()
-						break
-			else:
-				body = raw_mail.get_payload(decode=True).decode()
-			
-			clean_body = strip_quoted_reply(body)
+			new_mails.append((mail_id, dict(
+				client_id=client_id,
+				message_id=msg_id,
+				to_addr=to_addr,
+				to_name=to_name,
+				from_addr=from_addr,
+				from_name=from_name,
+				subject=subject,
+				body=clean_body,
+				references=references,
+				time_received=mail_datetime,
+				responded=0
+			)))
+	except Exception as e:
+		LOGGER.error(f"Could not fetch mails from {IMAP_HOST}: {e}")
 
-		except Exception as e:
-			LOGGER.error(f"Error occured while decoding mail {msg_id}, {e}")
-			continue
+	# Check the whole batch against the DB at once
+	try:
+		existing = existing_message_ids(db, [row['message_id'] for _, row in new_mails])
+	except Exception as e:
+		LOGGER.error(f"Could not check for known mails in table 'emails': {e}")
+		existing = set()
+	for mail_id, row in new_mails:
+		if row['message_id'] in existing:
+			LOGGER.debug(f"Mail with msg_id {row['message_id']} exists in table 'emails'")
+			seen_ids.append(mail_id)
+	new_mails = [(mail_id, row) for mail_id, row in new_mails if row['message_id'] not in existing]
+
+	# Embed all new mails in batches
+	try:
+		embeddings = emb.embed_many([(row['subject'], row['body']) for _, row in new_mails])
+	except Exception as e:
+		LOGGER.error(f"Could not embed {len(new_mails)} new mails: {e}")
+		new_mails, embeddings = [], []
 
-		# Check if mail in DB
-		data = None
+	# Add Mails to DB
+	if new_mails:
 		try:
-			LOGGER.debug(f"Checking if mail with msg_id {msg_id} exists in table 'emails'")
-			data = email_table.find_one(message_id=msg_id)
+			insert_emails(db, [row for _, row in new_mails], embeddings)
+			seen_ids += [mail_id for mail_id, _ in new_mails]
+			LOGGER.debug(f"Inserted {len(new_mails)} records in table 'emails'")
 		except Exception as e:
-			LOGGER.error(f"Could not check if mail {msg_id} in table 'emails': {e}")
+			LOGGER.error(f"Could not insert {len(new_mails)} mails in table 'emails': {e}")
+
+	# Mark mails as SEEN
+	status, _ = imap_server.noop()
+	if status != 'OK':
+		LOGGER.warning("IMAP NOOP Failed. Reconnecting...")
+		imap_server.logout()
+		imap_server = imap_auth()
+		imap_server.select('inbox')
+	mark_seen(imap_server, seen_ids)
+
+	if sync is not None:
+		sync.commit(failed=set(mail_ids) - set(seen_ids) - set(skipped_ids))
+
+	if own_session:
+		imap_server.logout()
+
+def run_daemon():
+	"""Holds one IMAP session open and ingests and replies as mail arrives."""
+	from LLM import BaseChatbot
+	from MailServer.reply import reply
+	from utils import LLM_MODEL
+
+	llm = BaseChatbot(LLM_MODEL)
+	emb = BaseEmbedder(EMB_MODEL)
+
+	sync = MailboxSync('inbox')
 
-		# Get Client ID
-		client_id = get_or_create_client(from_addr, from_name)
-		if client_id == -1:
-			continue
+	def on_wake(imap_server):
+		mail_ids = fetch_mails(imap_server, sync)
+		insert_mails_to_db(mail_ids, imap_server, emb, sync)
+		if not mail_ids:
+			return
 
-		# Add Mail to DB
-		if data is None:
-			db.begin()
+		with open(REPLY_LOCK_PATH, "a") as lock:
 			try:
-				LOGGER.debug(f"Inserting mail {mail_id} into table 'emails'")
-
-				email_id = email_table.insert(dict(
-					client_id=client_id,
-					message_id=msg_id,
-					to_addr=to_addr,
-					to_name=to_name,
-					from_addr=from_addr,
-					from_name=from_name,
-					subject=subject,
-					body=clean_body,
-					references=references,
-					time_received=mail_datetime,
-					responded=0
-				))
-				embedding = emb.embed(subject, clean_body)
-				embedding = np.array(embedding)
-				email_embed_table.insert(dict(
-					email_id=email_id,
-					client_id=client_id,
-					model=EMB_MODEL,
-					embedding=pickle.dumps(embedding)
-				))
-				db.commit()
-
-				LOGGER.debug("Inserted record in table 'emails'")
+				fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+			except BlockingIOError:
+				LOGGER.info("Reply job already running, leaving new mails to it")
+				return
+			try:
+				reply(llm, emb)
 			except Exception as e:
-				LOGGER.error(f"Could not insert mail {msg_id} in table 'emails': {e}")
-				db.rollback()
-				continue
-		else:
-			LOGGER.debug(f"Mail with msg_id {msg_id} exists in table 'emails'")
-		
-		# Mark mail as SEEN
-		status, _ = imap_server.noop()
-		if status != 'OK':
-			LOGGER.warning("IMAP NOOP Failed. Reconnecting...")
-			imap_server.logout()
-			imap_server = imap_auth()
-			imap_server.select('inbox')
-		imap_server.store(str(mail_id).encode(), "+FLAGS", "\\Seen")
-	
+				LOGGER.error(f"Reply run failed: {e}")
+			finally:
+				fcntl.flock(lock, fcntl.LOCK_UN)
+
+	LOGGER.info("Starting fetch daemon")
+	IdleSession('inbox').run(on_wake)
+
 # =================================== MAIN =================================== #
 if __name__ == "__main__":
-	insert_mails_to_db(fetch_mails())
+	parser = argparse.ArgumentParser(description="Fetch client mails into the database")
+	parser.add_argument("--daemon", action="store_true", help="Stay connected and react to new mail via IMAP IDLE")
+	args = parser.parse_args()
+
+	if args.daemon:
+		try:
+			run_daemon()
+		except KeyboardInterrupt:
+			sys.exit(0)
+	else:
+		sync = MailboxSync('inbox')
+		insert_mails_to_db(fetch_mails(sync=sync), sync=sync)
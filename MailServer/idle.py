@@ -0,0 +1,189 @@
+# ############################################################################ #
+#                              MAINTENANCE HISTORY                             #
+# ############################################################################ #
+# DATE         Description
+# ------------ -----------------------------------------------------------------
+# 18-OCT-2026  Initial Draft
+# 18-OCT-2026  Read responses already buffered by imaplib before selecting
+# ============================================================================ #
+
+# ================================== IMPORTS ================================= #
+import ssl
+import time
+import select
+import imaplib
+
+from Logging import logger_init
+from MailServer.auth import imap_connect
+from utils import load_config
+
+# ============================= GLOBAL VARIABLES ============================= #
+LOGGER = logger_init("MailServer")
+
+# ================================= CONSTANTS ================================ #
+IDLECFG = load_config()["MailServer"].get("Idle", {})
+
+# RFC 2177 servers may drop an IDLE after 30 minutes, re-issue well before
+IDLE_TIMEOUT = IDLECFG.get("Timeout", 540)
+# Poll interval when the server does not advertise IDLE
+NOOP_INTERVAL = IDLECFG.get("KeepAlive", 30)
+BACKOFF_START = IDLECFG.get("BackoffStart", 5)
+BACKOFF_MAX = IDLECFG.get("BackoffMax", 300)
+
+# ================================== CLASSES ================================= #
+class IdleSession:
+	"""
+	One authenticated IMAP session that blocks until the mailbox changes.
+
+	Uses IDLE when the server supports it and falls back to NOOP polling.
+	connect is any zero-argument callable returning a logged-in IMAP4, so a
+	local stand-in server can be used in place of the real one.
+	"""
+	def __init__(
+			self,
+			mailbox="inbox",
+			connect=imap_connect,
+			idle_timeout=IDLE_TIMEOUT,
+			noop_interval=NOOP_INTERVAL,
+		):
+		self.mailbox = mailbox
+		self._connect = connect
+		self.idle_timeout = idle_timeout
+		self.noop_interval = noop_interval
+
+		self.imap = None
+		self.supports_idle = False
+
+	def connect(self):
+		self.close()
+		LOGGER.debug(f"Opening IMAP session on '{self.mailbox}'")
+		self.imap = self._connect()
+		status, _ = self.imap.select(self.mailbox)
+		if status != 'OK':
+			raise imaplib.IMAP4.error(f"Could not select '{self.mailbox}'")
+		self.supports_idle = "IDLE" in self.imap.capabilities
+		# Drop the counts reported by SELECT so only later changes wake us
+		self.imap.response('EXISTS')
+		self.imap.response('RECENT')
+		LOGGER.info(f"IMAP session ready on '{self.mailbox}' (IDLE {'on' if self.supports_idle else 'off'})")
+
+	def close(self):
+		if self.imap is None:
+			return
+		try:
+			self.imap.logout()
+		except Exception:
+			pass
+		self.imap = None
+
+	def _buffered(self):
+		"""
+		True if imaplib's reader holds bytes not handed out yet, e.g. an
+		EXISTS sent in the same packet as the IDLE continuation. select()
+		only sees the socket, so it would wait for the next packet.
+		"""
+		sock = self.imap.sock
+		timeout = sock.gettimeout()
+		sock.setblocking(False)
+		try:
+			return bool(self.imap.file.peek(1))
+		except (BlockingIOError, ssl.SSLWantReadError):
+			return False
+		finally:
+			sock.settimeout(timeout)
+
+	def _readline(self, timeout):
+		"""Reads one server line, or returns None if nothing arrives in time."""
+		sock = self.imap.sock
+		pending = getattr(sock, "pending", lambda: 0)() or self._buffered()
+		if not pending:
+			readable, _, _ = select.select([sock], [], [], timeout)
+			if not readable:
+				return None
+		line = self.imap.readline()
+		if not line:
+			raise imaplib.IMAP4.abort("IMAP connection closed by server")
+		return line
+
+	def _idle(self, timeout):
+		tag = self.imap._new_tag()
+		self.imap.send(tag + b" IDLE\r\n")
+		line = self.imap.readline()
+		if not line.startswith(b"+"):
+			raise imaplib.IMAP4.error(f"IDLE refused: {line!r}")
+
+		changed = False
+		deadline = time.monotonic() + timeout
+		try:
+			while not changed:
+				remaining = deadline - time.monotonic()
+				if remaining <= 0:
+					break
+				line = self._readline(remaining)
+				if line is None:
+					break
+				LOGGER.debug(f"IDLE update: {line.strip()!r}")
+				changed = line.startswith(b"*") and (b"EXISTS" in line or b"RECENT" in line)
+		finally:
+			self.imap.send(b"DONE\r\n")
+			while True:
+				line = self.imap.readline()
+				if not line:
+					raise imaplib.IMAP4.abort("IMAP connection closed during IDLE")
+				if line.startswith(tag):
+					break
+		return changed
+
+	def _poll(self, timeout):
+		deadline = time.monotonic() + timeout
+		while time.monotonic() < deadline:
+			time.sleep(min(self.noop_interval, max(0, deadline - time.monotonic())))
+			status, _ = self.imap.noop()
+			if status != 'OK':
+				raise imaplib.IMAP4.abort("IMAP NOOP failed")
+			# Servers only send EXISTS/RECENT when the mailbox changed
+			_, exists = self.imap.response('EXISTS')
+			_, recent = self.imap.response('RECENT')
+			if any(exists) or any(recent):
+				return True
+		return False
+
+	def wait(self, timeout=None):
+		"""Blocks until the mailbox reports new mail or timeout passes."""
+		timeout = self.idle_timeout if timeout is None else timeout
+		if self.supports_idle:
+			return self._idle(timeout)
+		return self._poll(timeout)
+
+	def run(self, on_wake):
+		"""
+		Calls on_wake(imap) once on connect and then after every wake-up or
+		IDLE timeout, reconnecting with exponential backoff on failures.
+		"""
+		backoff = BACKOFF_START
+		while True:
+			try:
+				if self.imap is None:
+					self.connect()
+					on_wake(self.imap)
+				backoff = BACKOFF_START
+
+				changed = self.wait()
+				LOGGER.debug(f"Woke up on '{self.mailbox}', new mail: {changed}")
+				# A timed out IDLE still checks, in case an update was missed
+				on_wake(self.imap)
+			except (imaplib.IMAP4.abort, imaplib.IMAP4.error, OSError) as e:
+				LOGGER.warning(f"IMAP session lost ({e}), reconnecting in {backoff}s")
+				self.close()
+				time.sleep(backoff)
+				backoff = min(backoff * 2, BACKOFF_MAX)
+			except Exception as e:
+				LOGGER.error(f"Error while handling new mail, retrying in {backoff}s: {e}")
+				time.sleep(backoff)
+				backoff = min(backoff * 2, BACKOFF_MAX)
+
+# ================================= FUNCTIONS ================================ #
+
+# =================================== MAIN =================================== #
+if __name__ == "__main__":
+	pass
@@ -0,0 +1,168 @@
+# ############################################################################ #
+#                              MAINTENANCE HISTORY                             #
+# ############################################################################ #
+# DATE         Description
+# ------------ -----------------------------------------------------------------
+# 18-OCT-2026  Initial Draft
+# 18-OCT-2026  Add OR-composed client search
+# ============================================================================ #
+
+# ================================== IMPORTS ================================= #
+import re
+import email
+import email.utils
+from datetime import datetime
+
+from Logging import logger_init
+from utils import load_config
+
+# ============================= GLOBAL VARIABLES ============================= #
+LOGGER = logger_init("MailServer")
+
+# ================================= CONSTANTS ================================ #
+FETCH_CHUNK = load_config()["MailServer"].get("FetchChunk", 100)
+# Clients per OR-composed SEARCH, keeps the command line within server limits
+SEARCH_CHUNK = load_config()["MailServer"].get("SearchChunk", 25)
+
+UID_RE = re.compile(rb"UID (\d+)")
+INTERNALDATE_RE = re.compile(rb'INTERNALDATE "([^"]+)"')
+
+# ================================= FUNCTIONS ================================ #
+def uid_ranges(uids):
+	"""Compresses UIDs into an IMAP sequence set, e.g. '1:50,53,60:70'."""
+	uids = sorted({int(uid) for uid in uids})
+	ranges = []
+	start = prev = None
+	for uid in uids:
+		if start is None:
+			start = prev = uid
+		elif uid == prev + 1:
+			prev = uid
+		else:
+			ranges.append(f"{start}:{prev}" if start != prev else str(start))
+			start = prev = uid
+	if start is not None:
+		ranges.append(f"{start}:{prev}" if start != prev else str(start))
+	return ",".join(ranges)
+
+def parse_internaldate(value):
+	return datetime.strptime(value.decode().strip(), "%d-%b-%Y %H:%M:%S %z")
+
+def parse_fetch_response(data):
+	"""
+	Yields (uid, internaldate, literal) from a multi-message FETCH response.
+	Servers may put UID and INTERNALDATE before or after the literal.
+	"""
+	current = None
+	for item in data:
+		if isinstance(item, tuple):
+			if current is not None:
+				yield current
+			meta, literal = item
+			current = [None, None, literal, meta]
+		elif isinstance(item, bytes) and current is not None:
+			current[3] += item
+		else:
+			continue
+
+		uid = UID_RE.search(current[3])
+		date = INTERNALDATE_RE.search(current[3])
+		current[0] = int(uid.group(1)) if uid else None
+		current[1] = parse_internaldate(date.group(1)) if date else None
+
+	if current is not None:
+		yield current
+
+def fetch_raw(imap_server, uids, items="BODY.PEEK[]", chunk_size=FETCH_CHUNK):
+	"""
+	Fetches (uid, internaldate, bytes) for many UIDs using one UID FETCH per
+	chunk of chunk_size messages. BODY.PEEK leaves the \\Seen flag alone.
+	"""
+	uids = sorted({int(uid) for uid in uids})
+	for i in range(0, len(uids), chunk_size):
+		chunk = uids[i:i + chunk_size]
+		LOGGER.debug(f"Fetching {len(chunk)} mails by UID")
+		status, data = imap_server.uid('FETCH', uid_ranges(chunk), f"(UID INTERNALDATE {items})")
+		if status != 'OK':
+			LOGGER.error(f"Could not fetch UIDs {uid_ranges(chunk)}: {status}")
+			continue
+
+		for uid, internaldate, literal, _ in parse_fetch_response(data):
+			if uid is None:
+				LOGGER.warning("FETCH response without UID, skipping")
+				continue
+			yield uid, internaldate, literal
+
+def fetch_messages(imap_server, uids, chunk_size=FETCH_CHUNK):
+	"""Streams (uid, internaldate, email.message.Message) for the given UIDs."""
+	for uid, internaldate, literal in fetch_raw(imap_server, uids, chunk_size=chunk_size):
+		try:
+			yield uid, internaldate, email.message_from_bytes(literal)
+		except Exception as e:
+			LOGGER.error(f"Could not parse mail with UID {uid}: {e}")
+
+def or_criteria(field, values):
+	"""Builds 'OR FROM a OR FROM b FROM c' as a list of SEARCH arguments."""
+	values = list(values)
+	criteria = []
+	for value in values[:-1]:
+		criteria += ['OR', field, value]
+	if values:
+		criteria += [field, values[-1]]
+	return criteria
+
+def match_client(header, clients):
+	"""Returns the client whose address appears in a From/To header, if any."""
+	addresses = {addr.lower() for _, addr in email.utils.getaddresses([header or ""])}
+	for client in clients:
+		if client.lower() in addresses:
+			return client
+	# SEARCH matches substrings, so fall back to the same rule
+	header = (header or "").lower()
+	for client in clients:
+		if client.lower() in header:
+			return client
+	return None
+
+def search_clients(imap_server, clients, *criteria, field='FROM', chunk_size=SEARCH_CHUNK):
+	"""
+	Returns {uid: client} for mails matching criteria whose field (FROM or TO)
+	matches any client. Clients are OR-composed into one UID SEARCH per chunk,
+	and the matching client is recovered with one header FETCH per chunk.
+	"""
+	clients = list(clients)
+	tagged = {}
+	for i in range(0, len(clients), chunk_size):
+		chunk = clients[i:i + chunk_size]
+		status, data = imap_server.uid('SEARCH', None, *criteria, *or_criteria(field, chunk))
+		if status != 'OK':
+			LOGGER.error(f"Could not search mails of {len(chunk)} client(s): {status}")
+			continue
+
+		uids = [int(uid) for uid in data[0].split()]
+		if not uids:
+			continue
+		if len(chunk) == 1:
+			tagged.update((uid, chunk[0]) for uid in uids)
+			continue
+
+		headers = fetch_raw(imap_server, uids, items=f"BODY.PEEK[HEADER.FIELDS ({field})]")
+		for uid, _, literal in headers:
+			header = email.message_from_bytes(literal or b"").get(field, "")
+			client = match_client(header, chunk)
+			if client is None:
+				LOGGER.warning(f"Mail with UID {uid} matched no client on {field}")
+				continue
+			tagged[uid] = client
+	return tagged
+
+def mark_seen(imap_server, uids):
+	if not uids:
+		return
+	status, _ = imap_server.uid('STORE', uid_ranges(uids), '+FLAGS', '(\\Seen)')
+	if status != 'OK':
+		LOGGER.error(f"Could not mark {len(uids)} mails as seen: {status}")
+
+# =================================== MAIN =================================== #
+if __name__ == "__main__":
+	pass
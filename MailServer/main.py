@@ -4,15 +4,19 @@
 # DATE         Description
 # ------------ -----------------------------------------------------------------
 # 05-MAR-2025  Initial Draft
+# 18-OCT-2026  Store embeddings in the binary format
+# 18-OCT-2026  Fetch by UID in bulk FETCH commands
+# 18-OCT-2026  Search all clients in one OR-composed SEARCH
+# 18-OCT-2026  Queue responses in the outbox and send over one SMTP session
+# 18-OCT-2026  Write fetched mails in one transaction
+# 18-OCT-2026  Retry writes when the DB is locked
 # ============================================================================ #
 
 # ================================== IMPORTS ================================= #
 import os
 import time
 import email
-import pickle
 import imaplib
-import smtplib
 
 from collections import defaultdict
 from email.mime.text import MIMEText
@@ -21,9 +25,12 @@ from email.mime.multipart import MIMEMultipart
 from dotenv import load_dotenv
 
 from Logging import logger_init
-from Database import connect_to_dataset
+from Database import connect_to_dataset, encode_embedding, write_transaction
 from LLM import BaseChatbot, BaseEmbedder
 from MailServer import imap_auth, check_smtp_auth
+from MailServer.imap import fetch_messages, mark_seen, search_clients
+from MailServer.outbox import enqueue, flush
+from Database.writer import existing_message_ids, insert_emails
 from Database.populate_db import get_or_create_client
 from utils import load_secrets, load_config, escape_special_chars
 
@@ -85,15 +92,10 @@ def main():
 				imap_server.select('inbox')
 
 			# Select unseen mails from clients
-			all_ids = set()
-			for client in CLIENTS:
-				status, data = imap_server.search(None, 'UNSEEN', 'FROM', client)
-				if status == 'OK':
-					ids = data[0].split()
-					if ids:
-						all_ids.update(ids)
-						client_state_dict[client] = 1
-			mail_ids = sorted(map(int, all_ids))
+			tagged = search_clients(imap_server, CLIENTS, 'UNSEEN')
+			for client in tagged.values():
+				client_state_dict[client] = 1
+			mail_ids = sorted(tagged)
 
 			LOGGER.info(f"Found {len(mail_ids)} mails")
 		except imaplib.IMAP4.abort:
@@ -111,25 +113,18 @@ def main():
 			time.sleep(int(MAILCFG['CheckInterval']))
 			continue
 			
-		for mail_id in mail_ids:
-			try:
-				LOGGER.debug(f"Fetching mail {mail_id}")
-
-				status, _ = imap_server.noop()
-				if status != 'OK':
-					LOGGER.warning("IMAP NOOP Failed. Reconnecting...")
-					imap_server.logout()
-					imap_server = imap_auth()
-					imap_server.select('inbox')
+		try:
+			LOGGER.debug(f"Fetching {len(mail_ids)} mails")
+			messages = list(fetch_messages(imap_server, mail_ids))
+		except Exception as e:
+			LOGGER.error(f"Could not fetch mails from {IMAP_HOST}: {e}")
+			time.sleep(int(MAILCFG['CheckInterval']))
+			continue
 
-				_, raw_mail = imap_server.fetch(str(mail_id).encode(), "(RFC822)")
-			except Exception as e:
-				LOGGER.error(f"Could not fetch mail {mail_id} from {IMAP_HOST}: {e}")
-				continue
-			
+		seen_ids = []
+		new_mails = []
+		for mail_id, _, raw_mail in messages:
 			try:
-				raw_mail = email.message_from_bytes(raw_mail[0][1])
-				
 				subject  = raw_mail.get("Subject")
 				msg_id   = raw_mail.get("Message-ID", email.utils.make_msgid())
 				to_name  , to_addr   = email.utils.parseaddr(raw_mail.get("To"))
@@ -159,63 +154,40 @@ def main():
 				LOGGER.error(f"Error occured while decoding mail {msg_id}, {e}")
 				continue
 
-			data = None
-			# Check if mail in DB
-			try:
-				LOGGER.debug(f"Checking if mail with msg_id {msg_id} exists in table 'emails'")
-
-				data = email_table.find_one(message_id=msg_id)
-			except Exception as e:
-				LOGGER.error(f"Could not check if mail {msg_id} in table 'emails': {e}")
-			
 			# Get Client ID
-			client_id = get_or_create_client(from_name, from_addr)
+			client_id = get_or_create_client(from_addr, from_name)
 			if client_id == -1:
 				continue
 
-			# Add mail to DB
-			if data is None:
-				db.begin()
-				try:
-					LOGGER.debug(f"Inserting mail {mail_id} into table 'emails'")
+			new_mails.append((mail_id, dict(
+				client_id = client_id,
+				message_id = msg_id,
+				to_addr = to_addr,
+				to_name = to_name,
+				from_addr = from_addr,
+				from_name = from_name,
+				subject = subject,
+				body = body,
+				responded = 1
+			)))
+
+		# Add mails to DB in one transaction
+		try:
+			existing = existing_message_ids(db, [row['message_id'] for _, row in new_mails])
+			seen_ids += [mail_id for mail_id, row in new_mails if row['message_id'] in existing]
+			new_mails = [(mail_id, row) for mail_id, row in new_mails if row['message_id'] not in existing]
 
-					email_id = email_table.insert(dict(
-						client_id = client_id,
-						message_id = msg_id,
-						to_addr = to_addr,
-						to_name = to_name,
-						from_addr = from_addr,
-						from_name = from_name,
-						subject = subject,
-						body = body,
-						responded = 1
-					))
-					embedding = emb.model.create_embedding(f"Subject:{subject}\nBody:{body}")
-					email_embed_table.insert(dict(
-						email_id = email_id,
-						client_id = client_id,
-						model = EMB_MODEL,
-						embedding = pickle.dumps(embedding)
-					))
-					db.commit()
+			LOGGER.debug(f"Inserting {len(new_mails)} mails into table 'emails'")
+			embeddings = emb.embed_many([(row['subject'], row['body']) for _, row in new_mails])
+			insert_emails(db, [row for _, row in new_mails], embeddings)
+			seen_ids += [mail_id for mail_id, _ in new_mails]
 
-					LOGGER.debug("Inserted record in table 'emails'")
-				except Exception as e:
-					LOGGER.error(f"Could not insert mail {msg_id} in table 'emails': {e}")
-					# conn.rollback()
-					db.rollback()
-					continue
-			else:
-				LOGGER.debug(f"Mail with msg_id {msg_id} exists in table 'emails'")
-			
-			# Mark mail as SEEN
-			status, _ = imap_server.noop()
-			if status != 'OK':
-				LOGGER.warning("IMAP NOOP Failed. Reconnecting...")
-				imap_server.logout()
-				imap_server = imap_auth()
-				imap_server.select('inbox')
-			imap_server.store(str(mail_id).encode(), "+FLAGS", "\\Seen")
+			LOGGER.debug("Inserted records in table 'emails'")
+		except Exception as e:
+			LOGGER.error(f"Could not insert {len(new_mails)} mails in table 'emails': {e}")
+
+		# Mark mails as SEEN
+		mark_seen(imap_server, seen_ids)
 
 		# Call LLM for response
 		for client in CLIENTS:
@@ -230,10 +202,7 @@ def main():
 			if llm_output is not None:
 				client_state_dict[client] = 0
 				llm_output = escape_special_chars(llm_output)
-				db.begin()
-				try:
-					LOGGER.debug(f"Inserting response of {msg_id} into table 'emails'")
-
+				def write(embedding):
 					email_id = email_table.insert(dict(
 						client_id = client_id,
 						message_id = response_msg_id,
@@ -246,19 +215,20 @@ def main():
 						child_of = msg_id,
 						responded = 1
 					))
-					embedding = emb.model.create_embedding(f"Subject:{subject}\nBody:{llm_output}")
 					email_embed_table.insert(dict(
 						email_id = email_id,
 						client_id = client_id,
 						model = EMB_MODEL,
-						embedding = pickle.dumps(embedding)
+						**encode_embedding(embedding)
 					))
-					db.commit()
+
+				try:
+					LOGGER.debug(f"Inserting response of {msg_id} into table 'emails'")
+					write_transaction(db, write, emb.embed(subject, llm_output))
 
 					LOGGER.debug("Inserted record in table 'emails'")
 				except Exception as e:
 					LOGGER.error(f"Could not insert mail {msg_id} in table 'emails': {e}")
-					db.rollback()
 			else:
 				continue
 
@@ -280,14 +250,14 @@ def main():
 			LOGGER.debug("Response mail formatted")
 
 			try:
-				LOGGER.debug("Sending mail to client...")
-				with smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT) as smtp_server:
-					smtp_server.login(EMAIL, PASSWORD)
-					smtp_server.sendmail(EMAIL, from_addr, response_mail.as_string())
+				write_transaction(db, enqueue, db, response_mail, from_addr)
 			except Exception as e:
-				LOGGER.error(f"Error occured while sending mail, {e}")
+				LOGGER.error(f"Could not queue mail to {from_addr}, {e}")
 				continue
-	
+
+		# Send queued responses over one SMTP session
+		flush(db)
+
 
 # =================================== MAIN =================================== #
 if __name__ == "__main__":
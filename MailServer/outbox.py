@@ -0,0 +1,243 @@
+# ############################################################################ #
+#                              MAINTENANCE HISTORY                             #
+# ############################################################################ #
+# DATE         Description
+# ------------ -----------------------------------------------------------------
+# 18-OCT-2026  Initial Draft
+# 18-OCT-2026  Retry status updates when the DB is locked
+# 18-OCT-2026  Claim rows before sending so processes never send one twice
+# 18-OCT-2026  Count claims as attempts, keep sent mails out of the requeue
+# ============================================================================ #
+
+# ================================== IMPORTS ================================= #
+import sys
+import smtplib
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_
+
+from Logging import logger_init
+from Database import connect_to_dataset, write_transaction
+from utils import (
+    load_config,
+    EMAIL,
+    PASSWORD,
+    SMTP_HOST,
+    SMTP_PORT,
+)
+
+# ============================= GLOBAL VARIABLES ============================= #
+LOGGER = logger_init("MailServer")
+
+# ================================= CONSTANTS ================================ #
+OUTBOXCFG = load_config()["MailServer"].get("Outbox", {})
+
+BATCH_SIZE = OUTBOXCFG.get("BatchSize", 50)
+MAX_ATTEMPTS = OUTBOXCFG.get("MaxAttempts", 5)
+BACKOFF_START = OUTBOXCFG.get("BackoffStart", 60)
+BACKOFF_MAX = OUTBOXCFG.get("BackoffMax", 3600)
+# A row claimed longer ago than this belongs to a sender that died
+CLAIM_TIMEOUT = OUTBOXCFG.get("ClaimTimeout", 600)
+STALE_ERROR = "Claim expired, the mail may have been sent"
+
+# ================================== CLASSES ================================= #
+class SMTPSender:
+	"""
+	One authenticated SMTP session reused across messages.
+
+	The connection is opened lazily and re-established once per message when
+	the server has dropped it in between.
+	"""
+	def __init__(self, host=SMTP_HOST, port=SMTP_PORT, user=EMAIL, password=PASSWORD):
+		self.host = host
+		self.port = port
+		self.user = user
+		self.password = password
+
+		self.server = None
+
+	def connect(self):
+		self.close()
+		LOGGER.debug("Opening SMTP session...")
+		self.server = smtplib.SMTP_SSL(self.host, self.port)
+		self.server.login(self.user, self.password)
+		LOGGER.info("SMTP session ready")
+
+	def close(self):
+		if self.server is None:
+			return
+		try:
+			self.server.quit()
+		except Exception:
+			pass
+		self.server = None
+
+	def send(self, from_addr, to_addr, message):
+		if self.server is None:
+			self.connect()
+		try:
+			self.server.sendmail(from_addr, to_addr, message)
+		except smtplib.SMTPServerDisconnected:
+			LOGGER.warning("SMTP session dropped, reconnecting")
+			self.connect()
+			self.server.sendmail(from_addr, to_addr, message)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+# ================================= FUNCTIONS ================================ #
+def enqueue(db, message, to_addr, from_addr=EMAIL):
+	"""
+	Queues a MIME message in table 'outbox' and returns its row id. Runs in
+	the caller's transaction, so the mail is only queued if its data commits.
+	"""
+	return db['outbox'].insert(dict(
+		message_id=message["Message-ID"],
+		from_addr=from_addr,
+		to_addr=to_addr,
+		subject=message["Subject"],
+		message=message.as_string(),
+		status='pending',
+		attempts=0,
+		next_attempt_at=datetime.now(),
+		created_at=datetime.now(),
+	))
+
+def backoff(attempts):
+	return timedelta(seconds=min(BACKOFF_START * 2 ** (attempts - 1), BACKOFF_MAX))
+
+def claim(db, outbox, row_id):
+	"""
+	Moves a pending row to 'sending' and returns True if this process got it.
+	The conditional UPDATE is atomic, so of several processes flushing the
+	same outbox exactly one sends each row. next_attempt_at is reused as the
+	claim's expiry, and the claim counts as an attempt, so a mail whose
+	sender died is only sent again up to MAX_ATTEMPTS times.
+	"""
+	table = outbox.table
+	stmt = table.update().where(and_(table.c.id == row_id, table.c.status == 'pending')).values(
+		status='sending',
+		attempts=table.c.attempts + 1,
+		next_attempt_at=datetime.now() + timedelta(seconds=CLAIM_TIMEOUT),
+	)
+	return write_transaction(db, lambda: db.executable.execute(stmt).rowcount) == 1
+
+def recover_stale(db, outbox):
+	"""
+	Puts rows claimed by a sender that never finished back in the queue.
+	The mail may have gone out before the sender died, so rows that used up
+	their attempts are failed instead, and the others are marked.
+	"""
+	table = outbox.table
+	stale = and_(table.c.status == 'sending', table.c.next_attempt_at <= datetime.now())
+	give_up = table.update().where(and_(stale, table.c.attempts >= MAX_ATTEMPTS)).values(
+		status='failed',
+		last_error=STALE_ERROR,
+	)
+	requeue = table.update().where(stale).values(
+		status='pending',
+		last_error=STALE_ERROR,
+	)
+
+	def recover():
+		return db.executable.execute(give_up).rowcount, db.executable.execute(requeue).rowcount
+
+	failed, recovered = write_transaction(db, recover)
+	if failed:
+		LOGGER.error(f"Gave up on {failed} mails whose sender stopped after the last attempt, they may have been sent")
+	if recovered:
+		LOGGER.warning(f"Requeued {recovered} mails whose sender stopped before finishing")
+
+def record_sent(db, outbox, row):
+	write_transaction(db, outbox.update, dict(id=row['id'], status='sent', last_error=None, sent_at=datetime.now()), ['id'])
+
+def flush(db=None, sender=None, batch_size=BATCH_SIZE):
+	"""
+	Sends every due message in the outbox over one SMTP session, batch_size
+	rows at a time. Failed messages are retried with exponential backoff and
+	given up on after MAX_ATTEMPTS. Returns the number of messages sent.
+	"""
+	if db is None:
+		db = connect_to_dataset()
+	outbox = db['outbox']
+	own_sender = sender is None
+	if own_sender:
+		sender = SMTPSender()
+
+	recover_stale(db, outbox)
+
+	sent = 0
+	failed = set()
+	# Sent, but their status update failed
+	unrecorded = []
+	try:
+		while True:
+			rows = [
+				row for row in outbox.find(status='pending', next_attempt_at={'lte': datetime.now()}, order_by='id', _limit=batch_size + len(failed))
+				if row['id'] not in failed
+			][:batch_size]
+			if not rows:
+				break
+
+			for row in rows:
+				if sender.server is None:
+					try:
+						sender.connect()
+					except Exception as e:
+						# Leave the queue untouched until SMTP is reachable again
+						LOGGER.error(f"Could not open SMTP session, {len(rows)} mails left queued: {e}")
+						return sent
+				if not claim(db, outbox, row['id']):
+					LOGGER.debug(f"Mail {row['message_id']} is being sent by another process")
+					continue
+				try:
+					sender.send(row['from_addr'], row['to_addr'], row['message'])
+				except smtplib.SMTPRecipientsRefused as e:
+					LOGGER.error(f"Recipient {row['to_addr']} refused, dropping mail {row['message_id']}: {e}")
+					write_transaction(db, outbox.update, dict(id=row['id'], status='failed', last_error=str(e)), ['id'])
+					continue
+				except Exception as e:
+					# The claim already counted this attempt
+					attempts = row['attempts'] + 1
+					status = 'failed' if attempts >= MAX_ATTEMPTS else 'pending'
+					LOGGER.error(f"Could not send mail {row['message_id']} to {row['to_addr']} (attempt {attempts}): {e}")
+					write_transaction(db, outbox.update, dict(
+						id=row['id'],
+						status=status,
+						last_error=str(e),
+						next_attempt_at=datetime.now() + backoff(attempts),
+					), ['id'])
+					failed.add(row['id'])
+					# A broken session is reopened for the next message
+					sender.close()
+					continue
+
+				sent += 1
+				LOGGER.info(f"Sent mail {row['message_id']} to {row['to_addr']}")
+				try:
+					record_sent(db, outbox, row)
+				except Exception as e:
+					LOGGER.error(f"Mail {row['message_id']} was sent but could not be marked sent, retrying later: {e}")
+					unrecorded.append(row)
+	finally:
+		if own_sender:
+			sender.close()
+
+		# One more try, a row left 'sending' would be requeued after CLAIM_TIMEOUT
+		for row in unrecorded:
+			try:
+				record_sent(db, outbox, row)
+			except Exception as e:
+				LOGGER.critical(f"Mail {row['message_id']} (outbox id {row['id']}) was sent but is still marked sending, mark it sent by hand: {e}")
+
+	if sent or failed:
+		LOGGER.info(f"Outbox flushed, {sent} sent, {len(failed)} failed")
+	return sent
+
+# =================================== MAIN =================================== #
+if __name__ == "__main__":
+	flush()
+	sys.exit(0)
@@ -5,31 +5,42 @@
 # ------------ -----------------------------------------------------------------
 # 14-MAY-2025  Initial Draft
 # 12-JUL-2025  Refactor for threading and context
+# 18-OCT-2026  Use EmbeddingIndex for similarity-based memories
+# 18-OCT-2026  Store embeddings in the binary format
+# 18-OCT-2026  Mirror embeddings to vector shards
+# 18-OCT-2026  Add similar past emails to context via /similar
+# 18-OCT-2026  Accept preloaded models from the fetch daemon
+# 18-OCT-2026  Queue replies in the outbox and send over one SMTP session
+# 18-OCT-2026  Pipeline preparation, generation and sending across clients
+# 18-OCT-2026  Fit retrieved context into a token budget
+# 18-OCT-2026  Retry the reply transaction when the DB is locked
+# 18-OCT-2026  Think budget from the client mail, back off cut off replies
 # ============================================================================ #
 
 # ================================== IMPORTS ================================= #
 import os
 import email
-import pickle
-import smtplib
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
-import numpy as np
-
 from Logging import logger_init
 from LLM.parse import parse, remove_commands
-from LLM import BaseChatbot, BaseEmbedder, cosine
-from Database import connect_to_dataset, get_or_create_client
+from LLM import BaseChatbot, BaseEmbedder, EmbeddingIndex
+from LLM.main import MAX_THINK_TOKENS, NOTHINK_TOKENS
+from LLM.ann import EmailANNIndex
+from LLM.context import ContextBuilder, context_budget
+from Database import connect_to_dataset, get_or_create_client, encode_embedding, write_transaction
+from Database.shards import append_vectors
+from MailServer.outbox import enqueue, flush, SMTPSender
 from utils import (
+    load_config,
     remove_think_blocks,
     read_prompt_from_file,
     LLM_MODEL,
     EMB_MODEL,
     EMAIL,
-    PASSWORD,
-    SMTP_HOST,
-    SMTP_PORT,
     CLIENTS,
     CLIENTNAMES,
 )
@@ -37,12 +48,24 @@ from utils import (
 # ============================= GLOBAL VARIABLES ============================= #
 LOGGER = logger_init("MailServer")
 
+# ================================= CONSTANTS ================================ #
+# Threads for the DB, retrieval and SMTP stages, generation is always serial
+MAILCFG = load_config()["MailServer"]
+REPLY_WORKERS = MAILCFG.get("ReplyWorkers", 4)
+# Wait before regenerating a reply that was cut off, doubled per attempt
+RETRY_START = MAILCFG.get("ReplyRetryStart", 1800)
+RETRY_MAX = MAILCFG.get("ReplyRetryMax", 86400)
+
 # ================================== CLASSES ================================= #
 
 # ================================= FUNCTIONS ================================ #
-def get_context_from_config(db, emb, client_id, current_email_text, config):
-    """Builds the context string based on the parsed command configuration."""
-    context_parts = []
+def get_context_from_config(db, emb, client_id, current_email_text, config, index=None, email_index=None, exclude_ids=(), count_tokens=None, budget=None):
+    """
+    Builds the context string based on the parsed command configuration,
+    trimmed to budget tokens when count_tokens and budget are given.
+    """
+    time_parts = []
+    similar_parts, similar_ranks = [], []
 
     # 1. Handle time-based memories from /remember command
     if config.get("remember", {}).get("enable"):
@@ -59,7 +82,7 @@ def get_context_from_config(db, emb, client_id, current_email_text, config):
                     _limit=limit
                 ))
                 for row in records:
-                    context_parts.append(f"[{row['memory_type'].upper()} SUMMARY from {row['period_start']}]\n{row['text']}\n")
+                    time_parts.append(f"[{row['memory_type'].upper()} SUMMARY from {row['period_start']}]\n{row['text']}\n")
             except Exception as e:
                 LOGGER.error(f"Could not find {period} memories: {e}")
 
@@ -70,163 +93,288 @@ def get_context_from_config(db, emb, client_id, current_email_text, config):
         
         try:
             current_embedding = emb.embed("Current Email", current_email_text)
-            past_memories = list(db['memory_embeddings'].find(client_id=client_id))
-            if past_memories:
-                similarities = []
-                for mem in past_memories:
-                    past_embedding = pickle.loads(mem['embedding'])
-                    sim = cosine(np.array(current_embedding), np.array(past_embedding))
-                    similarities.append((sim, mem['memory_id']))
-
-                similarities.sort(key=lambda x: x[0], reverse=True)
-                top_memory_ids = [mem_id for sim, mem_id in similarities[:top_k]]
-
-                if top_memory_ids:
-                    relevant_memories = list(db['memories'].find(id=top_memory_ids))
-                    for mem in relevant_memories:
-                        context_parts.append(f"[PAST MEMORY from {mem['period_start'].strftime('%Y-%m-%d')}]\n{mem['text']}\n[/PAST MEMORY]")
+            if index is None:
+                index = EmbeddingIndex(db)
+            top_memory_ids = [mem_id for sim, mem_id in index.search(client_id, current_embedding, top_k)]
+
+            if top_memory_ids:
+                relevant_memories = list(db['memories'].find(id=top_memory_ids))
+                for mem in relevant_memories:
+                    similar_parts.append(f"[PAST MEMORY from {mem['period_start'].strftime('%Y-%m-%d')}]\n{mem['text']}\n[/PAST MEMORY]")
+                    similar_ranks.append(top_memory_ids.index(mem['id']))
         except Exception as e:
             LOGGER.error(f"Could not retrieve relevant context by similarity: {e}")
 
-    return "\n\n".join(context_parts)
+    # 3. Handle similar past emails from /similar command
+    if config.get("similar", {}).get("enable"):
+        LOGGER.info("Retrieving similar past emails.")
+        top_k = config["similar"].get("topk", 3)
 
+        try:
+            current_embedding = emb.embed("Current Email", current_email_text)
+            if email_index is None:
+                email_index = EmailANNIndex(db)
+            similar_ids = [email_id for sim, email_id in email_index.search(client_id, current_embedding, top_k, exclude=exclude_ids)]
 
-def reply():
-	# Connect to DB
-	db = connect_to_dataset()
+            if similar_ids:
+                similar_emails = list(db['emails'].find(id=similar_ids, order_by='time_received'))
+                for mail in similar_emails:
+                    similar_parts.append(f"[PAST EMAIL from {mail['from_name']} on {mail['time_received']}]\nSubject: {mail['subject']}\n{mail['body']}\n[/PAST EMAIL]")
+                    # Memories outrank single mails of the same similarity rank
+                    similar_ranks.append(similar_ids.index(mail['id']) + 0.5)
+        except Exception as e:
+            LOGGER.error(f"Could not retrieve similar past emails: {e}")
+
+    builder = ContextBuilder(count_tokens, budget if count_tokens is not None else None)
+    builder.add("time", time_parts)
+    builder.add("similar", similar_parts, ranks=similar_ranks)
+    sections = builder.build()
+
+    return "\n\n".join(sections["time"] + sections["similar"])
+
+
+def prepare_reply(db, emb, client, client_name, mem_index, email_index, count_tokens=None):
+	"""I/O stage: collects a client's unreplied mails and builds the prompt."""
+	email_table = db['emails']
+
+	client_id = get_or_create_client(client, client_name)
+	if client_id == -1:
+		return None
+	
+	try:
+		LOGGER.debug(f"Retrieving unreplied mails from DB for client {client_id}")
+		unresponded = tuple(email_table.find(
+			client_id=client_id,
+			responded=0,
+			order_by='id'
+		))
+	except Exception as e:
+		LOGGER.error(f"Could not collect unreplied mails from DB, {e}")
+		return None
+	
+	if not unresponded:
+		return None
+
+	# A new mail from the client lifts the backoff of the earlier ones
+	retry_after = unresponded[-1].get('retry_after')
+	if retry_after is not None and retry_after > datetime.now():
+		LOGGER.debug(f"Reply to client {client_id} was cut off before, next attempt after {retry_after}")
+		return None
+	
+	LOGGER.info(f"Found {len(unresponded)} unreplied mails from client {client_id}")
+
+	# --- Restore Command Parsing and /nothink logic ---
+	raw_email_body = "\n\n---\n\n".join(mail['body'] for mail in unresponded)
+	context_config = parse(unresponded[-1]['body'])
+	
+	# Clean the body for the LLM and add the think/nothink directive
+	cleaned_email_text = remove_commands(raw_email_body)
+	cleaned_email_text = remove_think_blocks(cleaned_email_text)
+	cleaned_email_text.replace("/think", "")
+	# The prompt template ends with its own switch, the budget follows the client
+	think = "/think" in remove_think_blocks(unresponded[-1]['body'])
+	if think:
+		cleaned_email_text += "\n/think"
+	else:
+		cleaned_email_text += "\n/nothink"
+
+	prompt_template = read_prompt_from_file("mail_prompt.txt")
+	if not prompt_template:
+		LOGGER.error("Failed to read mail prompt, skipping reply for this client.")
+		return None
+
+	# The current mails are never trimmed, the context gets what is left
+	budget = None
+	if count_tokens is not None:
+		budget = context_budget(LLM_MODEL, count_tokens(prompt_template.format(context="", current_email=cleaned_email_text)))
+
+	# Build context based on parsed commands
+	context = get_context_from_config(
+		db, emb, client_id, cleaned_email_text, context_config,
+		mem_index, email_index, [mail['id'] for mail in unresponded],
+		count_tokens, budget
+	)
+
+	final_prompt = prompt_template.format(
+		context=context,
+		current_email=cleaned_email_text
+	)
+
+	return dict(
+		client_id=client_id,
+		unresponded=unresponded,
+		history=[{"role": "system", "content": final_prompt}],
+		max_think_tokens=MAX_THINK_TOKENS if think else NOTHINK_TOKENS,
+	)
+
+def generate_reply(llm, job):
+	"""Model stage: must only ever run on one thread at a time."""
+	llm.init_history('mail', job['history'])
+
+	LOGGER.info(f"Calling LLM to generate a reply for client {job['client_id']}")
+	generation = llm.generate(max_think_tokens=job['max_think_tokens'])
+	if generation is None:
+		return None
+	if generation.truncated:
+		job['truncated'] = generation.reason
+		return None
+	return remove_think_blocks(generation.text)
+
+def defer_reply(db, job):
+	"""I/O stage: backs off the mails of a reply that was cut off by a budget."""
+	unresponded = job['unresponded']
+	attempts = max(mail.get('reply_attempts') or 0 for mail in unresponded) + 1
+	delay = timedelta(seconds=min(RETRY_START * 2 ** (attempts - 1), RETRY_MAX))
+	retry_after = datetime.now() + delay
+
+	write_transaction(db, db['emails'].update_many, [
+		dict(id=mail['id'], reply_attempts=attempts, retry_after=retry_after)
+		for mail in unresponded
+	], ['id'])
+	LOGGER.error(
+		f"Reply to client {job['client_id']} cut off by its {job['truncated']} budget "
+		f"(attempt {attempts}), retrying after {retry_after:%Y-%m-%d %H:%M}"
+	)
+
+def persist_reply(db, emb, job, llm_output, email_index):
+	"""I/O stage: stores the reply, queues it in the outbox and closes the thread."""
 	email_table = db['emails']
 	email_embed_table = db['email_embeddings']
+	client_id = job['client_id']
+	unresponded = job['unresponded']
+
+	response_msg_id = email.utils.make_msgid()
+	last_mail = unresponded[-1]
+
+	parent_message_id = last_mail['message_id']
+	parent_references = last_mail.get('references') or ''
+	
+	ref_list = parent_references.split()
+	if parent_message_id not in ref_list:
+		ref_list.append(parent_message_id)
+	new_references = " ".join(ref_list)
+
+	# Reply to client
+	response_mail = MIMEMultipart()
+	response_mail["From"] = EMAIL
+	response_mail["To"] = last_mail['from_addr']
+	response_mail["Subject"] = f"Re: {last_mail['subject']}"
+	response_mail["Message-ID"] = response_msg_id
+	response_mail["In-Reply-To"] = parent_message_id
+	response_mail["References"] = new_references
+	response_mail.attach(MIMEText(llm_output, "plain"))
+
+	try:
+		embedding = emb.embed(last_mail['subject'], llm_output)
+	except Exception as e:
+		LOGGER.error(f"Could not embed reply for client {client_id}: {e}")
+		return False
+
+	# Add LLM response to DB, queue it and mark the thread as responded
+	ids_to_update = [mail['id'] for mail in unresponded]
+
+	def write():
+		email_id = email_table.insert(dict(
+			client_id=client_id,
+			message_id=response_msg_id,
+			to_addr=last_mail['from_addr'],
+			to_name=last_mail['from_name'],
+			from_addr=last_mail['to_addr'],
+			from_name=last_mail['to_name'],
+			subject=last_mail['subject'],
+			body=llm_output,
+			child_of=parent_message_id,
+			references=new_references,
+			responded=1
+		))
+		email_embed_table.insert(dict(
+			email_id=email_id,
+			client_id=client_id,
+			model=EMB_MODEL,
+			**encode_embedding(embedding)
+		))
+		enqueue(db, response_mail, last_mail['from_addr'])
+		email_table.update_many([dict(id=id, responded=1) for id in ids_to_update], ['id'])
+		return email_id
+
+	try:
+		LOGGER.debug(f"Inserting response for thread '{last_mail['subject']}' into table 'emails'")
+		email_id = write_transaction(db, write)
+	except Exception as e:
+		# The mails stay unreplied and are picked up by the next run
+		LOGGER.error(f"Could not insert mail into 'emails': {e}")
+		return False
+	append_vectors('email_embeddings', client_id, [email_id], [embedding])
+	email_index.add(client_id, email_id, embedding)
+	LOGGER.debug(f"Inserted reply and marked {len(ids_to_update)} mails as responded")
+	return True
+
+def reply(llm=None, emb=None, workers=REPLY_WORKERS):
+	"""
+	Replies to every client with unreplied mail as a staged pipeline.
+
+	Context preparation and persistence run on a pool of `workers` threads,
+	generation runs on the calling thread one client at a time, and sending
+	runs on one more thread holding a single SMTP session. While the model
+	works on one client, the next ones are prepared and the previous ones
+	are stored and sent.
+	"""
+	# Connect to DB
+	db = connect_to_dataset()
+	mem_index = EmbeddingIndex(db)
+	email_index = EmailANNIndex(db)
 
 	# Init LLM
-	llm = BaseChatbot(LLM_MODEL)
+	if llm is None:
+		llm = BaseChatbot(LLM_MODEL)
 	# Init Embedder
-	emb = BaseEmbedder(EMB_MODEL)
-	
-	for client, client_name in zip(CLIENTS, CLIENTNAMES):
-		client_id = get_or_create_client(client, client_name)
-		if client_id == -1:
-			continue
-		
-		try:
-			LOGGER.debug(f"Retrieving unreplied mails from DB for client {client_id}")
-			unresponded = tuple(email_table.find(
-				client_id=client_id,
-				responded=0,
-				order_by='id'
-			))
-		except Exception as e:
-			LOGGER.error(f"Could not collect unreplied mails from DB, {e}")
-			continue
-		
-		if not unresponded:
-			continue
-		
-		LOGGER.info(f"Found {len(unresponded)} unreplied mails from client {client_id}")
-
-		# --- Restore Command Parsing and /nothink logic ---
-		raw_email_body = "\n\n---\n\n".join(mail['body'] for mail in unresponded)
-		context_config = parse(unresponded[-1]['body'])
-		
-		# Clean the body for the LLM and add the think/nothink directive
-		cleaned_email_text = remove_commands(raw_email_body)
-		cleaned_email_text = remove_think_blocks(cleaned_email_text)
-		cleaned_email_text.replace("/think", "")
-		if "/think" in remove_think_blocks(unresponded[-1]['body']):
-			cleaned_email_text += "\n/think"
-		else:
-			cleaned_email_text += "\n/nothink"
-
-		# Build context based on parsed commands
-		context = get_context_from_config(db, emb, client_id, cleaned_email_text, context_config)
-
-		prompt_template = read_prompt_from_file("mail_prompt.txt")
-		if not prompt_template:
-			LOGGER.error("Failed to read mail prompt, skipping reply for this client.")
-			continue
-
-		final_prompt = prompt_template.format(
-			context=context,
-			current_email=cleaned_email_text
-		)
-
-		history = [{"role": "system", "content": final_prompt}]
-		llm.init_history('mail', history)
-
-		LOGGER.info("Calling LLM to generate a reply")
-		llm_output = llm.generate_response()
-		if llm_output is None:
-			continue
-
-		llm_output = remove_think_blocks(llm_output)
-		response_msg_id = email.utils.make_msgid()
-		last_mail = unresponded[-1]
-
-		parent_message_id = last_mail['message_id']
-		parent_references = last_mail.get('references') or ''
-		
-		ref_list = parent_references.split()
-		if parent_message_id not in ref_list:
-			ref_list.append(parent_message_id)
-		new_references = " ".join(ref_list)
-
-		# Add LLM response to DB
-		db.begin()
-		try:
-			LOGGER.debug(f"Inserting response for thread '{last_mail['subject']}' into table 'emails'")
-			email_id = email_table.insert(dict(
-				client_id=client_id,
-				message_id=response_msg_id,
-				to_addr=last_mail['from_addr'],
-				to_name=last_mail['from_name'],
-				from_addr=last_mail['to_addr'],
-				from_name=last_mail['to_name'],
-				subject=last_mail['subject'],
-				body=llm_output,
-				child_of=parent_message_id,
-				references=new_references,
-				responded=1
-			))
-			embedding = emb.embed(last_mail['subject'], llm_output)
-			email_embed_table.insert(dict(
-				email_id=email_id,
-				client_id=client_id,
-				model=EMB_MODEL,
-				embedding=pickle.dumps(embedding)
-			))
-			db.commit()
-			LOGGER.debug("Inserted record in table 'emails'")
-		except Exception as e:
-			LOGGER.error(f"Could not insert mail into 'emails': {e}")
-			db.rollback()
-			continue
-
-		# Reply to client
-		response_mail = MIMEMultipart()
-		response_mail["From"] = EMAIL
-		response_mail["To"] = last_mail['from_addr']
-		response_mail["Subject"] = f"Re: {last_mail['subject']}"
-		response_mail["Message-ID"] = response_msg_id
-		response_mail["In-Reply-To"] = parent_message_id
-		response_mail["References"] = new_references
-		response_mail.attach(MIMEText(llm_output, "plain"))
-		
-		LOGGER.debug("Response mail formatted. Sending...")
-		try:
-			with smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT) as smtp_server:
-				smtp_server.login(EMAIL, PASSWORD)
-				smtp_server.sendmail(EMAIL, last_mail['from_addr'], response_mail.as_string())
-			LOGGER.info(f"Successfully sent reply to {last_mail['from_addr']}")
-		except Exception as e:
-			LOGGER.error(f"Error occurred while sending mail: {e}")
-			continue
-		
-		# Mark unresponded mails as responded
-		try:
-			ids_to_update = [mail['id'] for mail in unresponded]
-			email_table.update_many([dict(id=id, responded=1) for id in ids_to_update], ['id'])
-			LOGGER.debug(f"Marked {len(ids_to_update)} mails as responded")
-		except Exception as e:
-			LOGGER.error(f"Could not mark mails as responded: {e}")
+	if emb is None:
+		emb = BaseEmbedder(EMB_MODEL)
+
+	def persist_and_send(job, llm_output):
+		if persist_reply(db, emb, job, llm_output, email_index):
+			# One sender thread per process, flush claims rows across processes
+			sends.append(send_pool.submit(flush, db, sender))
+
+	sender = SMTPSender()
+	sends = []
+	with ThreadPoolExecutor(max_workers=workers) as pool, ThreadPoolExecutor(max_workers=1) as send_pool:
+		prepared = [
+			pool.submit(prepare_reply, db, emb, client, client_name, mem_index, email_index, llm.count_tokens)
+			for client, client_name in zip(CLIENTS, CLIENTNAMES)
+		]
+		persisted = []
+		for future in prepared:
+			try:
+				job = future.result()
+			except Exception as e:
+				LOGGER.error(f"Could not prepare reply: {e}")
+				continue
+			if job is None:
+				continue
+
+			llm_output = generate_reply(llm, job)
+			if llm_output is None:
+				if 'truncated' in job:
+					persisted.append(pool.submit(defer_reply, db, job))
+				continue
+			persisted.append(pool.submit(persist_and_send, job, llm_output))
+
+		for future in persisted:
+			try:
+				future.result()
+			except Exception as e:
+				LOGGER.error(f"Could not store reply: {e}")
+
+		# Send any replies left over from earlier runs
+		if not sends:
+			sends.append(send_pool.submit(flush, db, sender))
+		for future in sends:
+			try:
+				future.result()
+			except Exception as e:
+				LOGGER.error(f"Could not send replies: {e}")
+	sender.close()
 
 # =================================== MAIN =================================== #
 if __name__ == "__main__":
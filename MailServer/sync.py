@@ -0,0 +1,125 @@
+# ############################################################################ #
+#                              MAINTENANCE HISTORY                             #
+# ############################################################################ #
+# DATE         Description
+# ------------ -----------------------------------------------------------------
+# 18-OCT-2026  Initial Draft
+# 18-OCT-2026  Retry the cursor update when the DB is locked
+# 18-OCT-2026  Keep one cursor per purpose, reset it when the clients change
+# 18-OCT-2026  Read the mailbox status from SELECT instead of STATUS
+# ============================================================================ #
+
+# ================================== IMPORTS ================================= #
+import hashlib
+from datetime import datetime
+
+from Logging import logger_init
+from Database import connect_to_dataset, write_transaction
+from MailServer.imap import search_clients
+
+# ============================= GLOBAL VARIABLES ============================= #
+LOGGER = logger_init("MailServer")
+
+# ================================= CONSTANTS ================================ #
+STATUS_CODES = ("UIDVALIDITY", "UIDNEXT", "HIGHESTMODSEQ")
+
+# ================================== CLASSES ================================= #
+class MailboxSync:
+	"""
+	Incremental sync cursor of one IMAP mailbox, kept in table 'sync_state'.
+
+	pending() only searches UIDs above the last committed one, and commit()
+	moves the cursor forward. A changed UIDVALIDITY invalidates every stored
+	UID, so the mailbox is then searched again from the start, and so does a
+	changed client list, as mails of new clients may lie below the cursor.
+
+	Jobs searching with different criteria keep their own cursor through
+	purpose, e.g. the UNSEEN fetch would otherwise hide seen mails from the
+	backfill. The cursor is stored under the key '<purpose>:<mailbox>'.
+	"""
+	def __init__(self, mailbox, db=None, purpose='fetch'):
+		self.mailbox = mailbox
+		self.key = f"{purpose}:{mailbox}"
+		self.db = db if db is not None else connect_to_dataset()
+		self.table = self.db['sync_state']
+
+		self.status = None
+		self.clients_hash = None
+		self.last_uid = 0
+		self.highest_uid = 0
+
+	def _mailbox_status(self, imap_server):
+		"""
+		Selects the mailbox again and reads its response codes. RFC 3501
+		6.3.10 advises against STATUS on the selected mailbox, and some
+		servers answer it with a stale UIDNEXT. HIGHESTMODSEQ is only sent
+		by servers with CONDSTORE enabled.
+		"""
+		status, _ = imap_server.select(self.mailbox)
+		if status != 'OK':
+			raise RuntimeError(f"Could not select '{self.mailbox}': {status}")
+		codes = {}
+		for key in STATUS_CODES:
+			_, data = imap_server.response(key)
+			if data and data[-1] is not None:
+				codes[key] = int(data[-1])
+		# The counts reported by SELECT are not news to an IDLE session
+		imap_server.response('EXISTS')
+		imap_server.response('RECENT')
+		if 'UIDVALIDITY' not in codes:
+			raise RuntimeError(f"No UIDVALIDITY in the SELECT response of '{self.mailbox}'")
+		return codes
+
+	def pending(self, imap_server, clients, *criteria, field='FROM'):
+		"""Returns {uid: client} for matching mails newer than the cursor."""
+		self.status = self._mailbox_status(imap_server)
+		self.clients_hash = hashlib.sha1("\n".join(sorted(clients)).encode()).hexdigest()
+		state = self.table.find_one(mailbox=self.key)
+
+		if state is None or state['uidvalidity'] != self.status['UIDVALIDITY']:
+			if state is not None:
+				LOGGER.warning(f"UIDVALIDITY of '{self.mailbox}' changed, resyncing from scratch")
+			self.last_uid = 0
+		elif state.get('clients_hash') != self.clients_hash:
+			LOGGER.info(f"Client list changed since the last sync of '{self.key}', resyncing from scratch")
+			self.last_uid = 0
+		else:
+			self.last_uid = state['last_uid']
+			modseq = self.status.get('HIGHESTMODSEQ')
+			unchanged = modseq is not None and modseq == state['highestmodseq']
+			if unchanged or self.status.get('UIDNEXT', 0) == self.last_uid + 1:
+				LOGGER.debug(f"No new mails in '{self.key}' since UID {self.last_uid}")
+				self.highest_uid = self.last_uid
+				return {}
+
+		# 'n:*' always matches the newest mail, even when its UID is below n
+		tagged = search_clients(imap_server, clients, 'UID', f"{self.last_uid + 1}:*", *criteria, field=field)
+		tagged = {uid: client for uid, client in tagged.items() if uid > self.last_uid}
+		self.highest_uid = max(self.status.get('UIDNEXT', 1) - 1, self.last_uid, *tagged)
+		LOGGER.info(f"Found {len(tagged)} new mails in '{self.key}' above UID {self.last_uid}")
+		return tagged
+
+	def commit(self, failed=()):
+		"""Advances the cursor up to, but not past, the first failed UID."""
+		if self.status is None:
+			return
+		last_uid = self.highest_uid
+		if failed:
+			last_uid = max(self.last_uid, min(failed) - 1)
+
+		write_transaction(self.db, self.table.upsert, dict(
+			mailbox=self.key,
+			uidvalidity=self.status['UIDVALIDITY'],
+			last_uid=last_uid,
+			highestmodseq=self.status.get('HIGHESTMODSEQ') if not failed else None,
+			clients_hash=self.clients_hash,
+			updated_at=datetime.now(),
+		), ['mailbox'])
+		LOGGER.debug(f"Sync cursor of '{self.key}' at UID {last_uid}")
+		self.last_uid = last_uid
+
+# ================================= FUNCTIONS ================================ #
+
+# =================================== MAIN =================================== #
+if __name__ == "__main__":
+	pass
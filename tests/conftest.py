@@ -0,0 +1,31 @@
+# ############################################################################ #
+#                              MAINTENANCE HISTORY                             #
+# ############################################################################ #
+# DATE         Description
+# ------------ -----------------------------------------------------------------
+# 18-OCT-2026  Initial Draft
+# ============================================================================ #
+
+# ================================== IMPORTS ================================= #
+import os
+import sqlite3
+
+import dataset
+import pytest
+
+# ================================= CONSTANTS ================================ #
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Database", "schema.sql")
+
+# ================================= FUNCTIONS ================================ #
+@pytest.fixture
+def db(tmp_path):
+	"""A dataset connection to a fresh DB created from schema.sql."""
+	path = tmp_path / "db.sqlite3"
+	conn = sqlite3.connect(path)
+	with open(SCHEMA_PATH, "r") as fp:
+		conn.executescript(fp.read())
+	conn.close()
+
+	db = dataset.connect(f"sqlite:///{path}")
+	yield db
+	db.close()
@@ -0,0 +1,93 @@
+# ############################################################################ #
+#                              MAINTENANCE HISTORY                             #
+# ############################################################################ #
+# DATE         Description
+# ------------ -----------------------------------------------------------------
+# 18-OCT-2026  Initial Draft
+# ============================================================================ #
+
+# ================================== IMPORTS ================================= #
+import numpy as np
+import pytest
+
+from LLM import ann
+from LLM.ann import IVFIndex, EmailANNIndex, benchmark
+from Database.embeddings import encode_embedding
+
+# ================================= CONSTANTS ================================ #
+DIM = 16
+
+# ================================= FUNCTIONS ================================ #
+def clustered(n, clusters=10, seed=0):
+	rng = np.random.default_rng(seed)
+	centers = rng.normal(size=(clusters, DIM))
+	return (centers[rng.integers(clusters, size=n)] + rng.normal(scale=0.3, size=(n, DIM))).astype(np.float32)
+
+def insert_embeddings(db, client_id, ids, vectors):
+	db['email_embeddings'].insert_many([
+		dict(email_id=int(i), client_id=client_id, model=ann.EMB_MODEL, **encode_embedding(v, "f4"))
+		for i, v in zip(ids, vectors)
+	])
+
+def test_recall_against_brute_force():
+	vectors = clustered(2000)
+
+	assert benchmark(vectors, top_k=5, queries=50, nprobe=4)['recall'] >= 0.9
+	# Probing every list is an exact search
+	assert benchmark(vectors, top_k=5, queries=50, nprobe=1000)['recall'] == 1.0
+
+def test_added_vectors_are_found():
+	vectors = clustered(500)
+	index = IVFIndex.train(np.arange(500), vectors, nlist=8)
+	extra = clustered(1, seed=1)
+
+	index.add([1000], extra)
+
+	assert len(index) == 501
+	assert index.max_id == 1000
+	assert index.search(extra[0], top_k=1, nprobe=8)[0][1] == 1000
+
+def test_search_excludes_ids():
+	vectors = clustered(100)
+	index = IVFIndex.train(np.arange(100), vectors, nlist=1)
+
+	top = index.search(vectors[7], top_k=3, exclude=[7])
+	assert 7 not in [i for _, i in top]
+	assert len(top) == 3
+
+def test_save_and_load_round_trip(tmp_path):
+	vectors = clustered(300)
+	index = IVFIndex.train(np.arange(300), vectors, nlist=4)
+	path = str(tmp_path / "index.npz")
+
+	index.save(path)
+	loaded = IVFIndex.load(path)
+
+	assert len(loaded) == 300
+	assert loaded.search(vectors[3], top_k=5) == index.search(vectors[3], top_k=5)
+
+def test_client_without_mails_is_built_once_they_arrive(db, tmp_path):
+	index = EmailANNIndex(db, root=str(tmp_path))
+	vectors = clustered(3)
+
+	assert index.search(1, vectors[0]) == []
+
+	insert_embeddings(db, 1, [1, 2, 3], vectors)
+	assert index.search(1, vectors[0], top_k=1)[0][1] == 1
+
+def test_saved_index_catches_up_and_retrains(db, tmp_path, monkeypatch):
+	monkeypatch.setattr(ann, "MIN_TRAIN", 20)
+	vectors = clustered(60)
+	insert_embeddings(db, 1, range(1, 11), vectors[:10])
+	first = EmailANNIndex(db, root=str(tmp_path))
+	first.search(1, vectors[0])
+	assert len(first._indexes[1].centroids) == 1
+
+	# A new process loads the saved index and finds the rows added since
+	insert_embeddings(db, 1, range(11, 61), vectors[10:])
+	second = EmailANNIndex(db, root=str(tmp_path))
+	assert second.search(1, vectors[59], top_k=1, nprobe=100)[0][1] == 60
+
+	# Outgrowing MinTrain on a single list trains real lists
+	assert len(second._indexes[1]) == 60
+	assert len(second._indexes[1].centroids) > 1
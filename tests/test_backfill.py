@@ -0,0 +1,117 @@
+# ############################################################################ #
+#                              MAINTENANCE HISTORY                             #
+# ############################################################################ #
+# DATE         Description
+# ------------ -----------------------------------------------------------------
+# 18-OCT-2026  Initial Draft
+# ============================================================================ #
+
+# ================================== IMPORTS ================================= #
+import json
+from datetime import date
+
+from dateutil.relativedelta import relativedelta
+import pytest
+
+from LLM import backfill
+from LLM.backfill import Backfill, node_key
+
+# ================================= CONSTANTS ================================ #
+# Monday to Monday, two full weeks ending on the Sundays in between
+MIN_DATE = date(2026, 1, 5)
+MAX_DATE = date(2026, 1, 19)
+
+SUMMARIZER = {
+	"daily": dict(delta=dict(days=1), source_table="emails"),
+	"weekly": dict(delta=dict(days=7), source_table="memories", source_filter=dict(memory_type="daily")),
+}
+
+# ================================== CLASSES ================================= #
+class FakeGenerator:
+	"""Stands in for prepare_summary and run_summary, failing the given nodes."""
+	def __init__(self):
+		self.calls = []
+		self.failing = set()
+
+	def prepare(self, db, emb, plan, client, client_name, mem_index, count_tokens):
+		return dict(client_id=1, key=node_key(plan['summary_type'], plan['period_end']))
+
+	def run(self, job, submit):
+		self.calls.append(job['key'])
+		return None if job['key'] in self.failing else "summary"
+
+# ================================= FUNCTIONS ================================ #
+def plan_summary(summary_type, start_date):
+	cfg = SUMMARIZER[summary_type]
+	return dict(
+		summary_type=summary_type,
+		cfg=cfg,
+		period_start=start_date - relativedelta(**cfg["delta"]),
+		period_end=start_date,
+	)
+
+@pytest.fixture
+def generator(db, monkeypatch):
+	"""Runs backfills on the test DB, recording the nodes generated in order."""
+	generator = FakeGenerator()
+	monkeypatch.setattr(backfill, "plan_summary", plan_summary)
+	monkeypatch.setattr(backfill, "connect_to_dataset", lambda: db)
+	monkeypatch.setattr(backfill, "EmbeddingIndex", lambda db: None)
+	monkeypatch.setattr(backfill, "token_counter", lambda model, llm: None)
+	monkeypatch.setattr(backfill, "CLIENTS", ["a@example.com"])
+	monkeypatch.setattr(backfill, "CLIENTNAMES", ["A"])
+	monkeypatch.setattr(backfill, "get_or_create_client", lambda client, client_name: 1)
+	monkeypatch.setattr(backfill, "prepare_summary", generator.prepare)
+	monkeypatch.setattr(backfill, "run_summary", generator.run)
+	monkeypatch.setattr(backfill, "store_summary", lambda *args: None)
+	return generator
+
+def run_backfill(checkpoint):
+	Backfill(MIN_DATE, MAX_DATE, checkpoint=checkpoint).run(llm=object(), emb=object(), workers=1)
+
+def test_weeks_depend_on_their_days(tmp_path, monkeypatch):
+	monkeypatch.setattr(backfill, "plan_summary", plan_summary)
+	graph = Backfill(MIN_DATE, MAX_DATE, checkpoint=str(tmp_path / "checkpoint.json"))
+
+	week = node_key("weekly", date(2026, 1, 11))
+	assert len(graph.plans) == 14 + 2
+	assert all(dep.startswith("daily:") for dep in graph.deps[week])
+	assert len(graph.deps[week]) == 7
+	assert graph.deps[node_key("daily", date(2026, 1, 6))] == set()
+
+def test_weeks_run_after_all_their_days(tmp_path, generator):
+	checkpoint = str(tmp_path / "checkpoint.json")
+	run_backfill(checkpoint)
+
+	graph = Backfill(MIN_DATE, MAX_DATE, checkpoint=checkpoint)
+	assert sorted(generator.calls) == sorted(graph.plans)
+	for key, deps in graph.deps.items():
+		assert all(generator.calls.index(dep) < generator.calls.index(key) for dep in deps)
+
+def test_rerun_resumes_from_the_checkpoint(tmp_path, generator):
+	checkpoint = str(tmp_path / "checkpoint.json")
+	day = node_key("daily", date(2026, 1, 8))
+	week = node_key("weekly", date(2026, 1, 11))
+	generator.failing.add(day)
+	run_backfill(checkpoint)
+
+	# A failed day holds back its week, the other week still runs
+	with open(checkpoint, "r") as fp:
+		done = set(json.load(fp)["done"])
+	assert day not in done and week not in done
+	assert node_key("weekly", date(2026, 1, 18)) in done
+	assert week not in generator.calls
+
+	generator.calls.clear()
+	generator.failing.clear()
+	run_backfill(checkpoint)
+	assert generator.calls == [day, week]
+
+def test_stored_clients_are_not_redone(db, tmp_path, generator):
+	day = plan_summary("daily", date(2026, 1, 6))
+	db['memories'].insert(dict(client_id=1, memory_type="daily",
+		period_start=day['period_start'], period_end=day['period_end'], text="summary"))
+	run_backfill(str(tmp_path / "checkpoint.json"))
+
+	assert node_key("daily", date(2026, 1, 6)) not in generator.calls
+	assert len(generator.calls) == 14 + 2 - 1
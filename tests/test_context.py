@@ -0,0 +1,77 @@
+# ############################################################################ #
+#                              MAINTENANCE HISTORY                             #
+# ############################################################################ #
+# DATE         Description
+# ------------ -----------------------------------------------------------------
+# 18-OCT-2026  Initial Draft
+# ============================================================================ #
+
+# ================================== IMPORTS ================================= #
+import pytest
+
+from LLM import context
+from LLM.context import ContextBuilder, TRUNCATION_MARK
+
+# ================================= FUNCTIONS ================================ #
+def count_words(text):
+	return len(text.split())
+
+def words(n, word="w"):
+	return " ".join([word] * n)
+
+@pytest.fixture(autouse=True)
+def small_items(monkeypatch):
+	monkeypatch.setattr(context, "MIN_ITEM_TOKENS", 3)
+
+def test_no_budget_keeps_everything():
+	builder = ContextBuilder(count_words)
+	builder.add("current", [words(100), words(200)])
+
+	assert builder.build() == {"current": [words(100), words(200)]}
+
+def test_keeps_best_ranked_items_in_output_order():
+	builder = ContextBuilder(count_words, 11)
+	items = [words(4, "old"), words(4, "mid"), words(4, "new")]
+	builder.add("current", items, ranks=[2, 1, 0], share=1)
+
+	# Newest first by rank, the oldest is cut to what is left
+	kept = builder.build()["current"]
+	assert kept[1:] == items[1:]
+	assert kept[0].startswith("old") and kept[0].endswith(TRUNCATION_MARK)
+
+def test_drops_items_that_would_be_cut_too_short():
+	builder = ContextBuilder(count_words, 9)
+	builder.add("current", [words(4), words(4), words(4)], share=1)
+
+	assert builder.build()["current"] == [words(4), words(4)]
+
+def test_unused_share_goes_to_overflowing_section():
+	builder = ContextBuilder(count_words, 20)
+	builder.add("current", [words(15)], share=0.5)
+	builder.add("similar", [words(2)], share=0.5)
+
+	result = builder.build()
+	assert result == {"current": [words(15)], "similar": [words(2)]}
+
+def test_sections_keep_their_share_when_all_overflow():
+	builder = ContextBuilder(count_words, 20)
+	builder.add("current", [words(5)] * 4, share=0.5)
+	builder.add("similar", [words(5)] * 4, share=0.5)
+
+	result = builder.build()
+	assert len(result["current"]) == 2
+	assert len(result["similar"]) == 2
+
+def test_empty_items_drop_their_ranks():
+	builder = ContextBuilder(count_words, 4)
+	builder.add("similar", [words(3, "a"), "", words(3, "b")], ranks=[1, 0, 0], share=1)
+
+	# "b" has the best rank once the empty item is gone
+	assert builder.build()["similar"] == [words(3, "b")]
+
+def test_truncate_fits_the_limit():
+	builder = ContextBuilder(count_words, 100)
+	text = builder.truncate(words(50), 10)
+
+	assert count_words(text) <= 10
+	assert text.endswith(TRUNCATION_MARK)
@@ -0,0 +1,175 @@
+# ############################################################################ #
+#                              MAINTENANCE HISTORY                             #
+# ############################################################################ #
+# DATE         Description
+# ------------ -----------------------------------------------------------------
+# 18-OCT-2026  Initial Draft
+# ============================================================================ #
+
+# ================================== IMPORTS ================================= #
+import time
+import imaplib
+import threading
+import socketserver
+
+import pytest
+
+from MailServer import idle
+
+# ================================= CONSTANTS ================================ #
+# How long a stub connection waits before pushing new mail during IDLE
+PUSH_DELAY = 0.1
+
+# ================================== CLASSES ================================= #
+class Stop(BaseException):
+	"""Ends IdleSession.run, which retries on any Exception."""
+
+class StubIMAPServer(socketserver.ThreadingTCPServer):
+	"""
+	Local IMAP stand-in speaking just enough of the protocol for imaplib and
+	IdleSession. modes gives the IDLE behaviour of each new connection:
+	'push' reports a new mail, 'coalesce' reports it in the same packet as
+	the continuation, 'silent' never does and 'drop' hangs up.
+	"""
+	daemon_threads = True
+	allow_reuse_address = True
+
+	def __init__(self, modes, capabilities=("IMAP4rev1", "IDLE")):
+		super().__init__(("127.0.0.1", 0), StubIMAPHandler)
+		self.modes = list(modes)
+		self.capabilities = " ".join(capabilities)
+		self.commands = []
+		self.connections = 0
+
+	def __enter__(self):
+		threading.Thread(target=self.serve_forever, daemon=True).start()
+		return self
+
+	def __exit__(self, *exc):
+		self.shutdown()
+		self.server_close()
+
+class StubIMAPHandler(socketserver.StreamRequestHandler):
+	def write(self, line):
+		self.wfile.write(line.encode() + b"\r\n")
+
+	def handle(self):
+		server = self.server
+		mode = server.modes.pop(0) if server.modes else "silent"
+		server.connections += 1
+		noops = 0
+
+		self.write("* OK stub ready")
+		while True:
+			line = self.rfile.readline()
+			if not line:
+				return
+			tag, command, *_ = line.decode().strip().split(" ", 2) + [""]
+			command = command.upper()
+			server.commands.append(command)
+
+			if command == "CAPABILITY":
+				self.write(f"* CAPABILITY {server.capabilities}")
+				self.write(f"{tag} OK done")
+			elif command == "LOGIN":
+				self.write(f"{tag} OK logged in")
+			elif command == "SELECT":
+				self.write("* 3 EXISTS")
+				self.write(f"{tag} OK [READ-WRITE] selected")
+			elif command == "NOOP":
+				noops += 1
+				if noops >= 2:
+					self.write("* 4 EXISTS")
+				self.write(f"{tag} OK done")
+			elif command == "IDLE":
+				if mode == "coalesce":
+					self.wfile.write(b"+ idling\r\n* 1 EXISTS\r\n")
+				else:
+					self.write("+ idling")
+				if mode == "drop":
+					return
+				if mode == "push":
+					# Not time.sleep, which the reconnect test records
+					threading.Event().wait(PUSH_DELAY)
+					self.write("* 4 EXISTS")
+				# Wait for DONE, whether or not anything was pushed
+				done = self.rfile.readline()
+				server.commands.append(done.decode().strip())
+				self.write(f"{tag} OK idle done")
+			elif command == "LOGOUT":
+				self.write("* BYE")
+				self.write(f"{tag} OK bye")
+				return
+			else:
+				self.write(f"{tag} BAD unknown")
+
+# ================================= FUNCTIONS ================================ #
+def run_session(server, wakes, **kwargs):
+	"""Runs an IdleSession against server until on_wake was called wakes times."""
+	calls = []
+
+	def connect():
+		imap = imaplib.IMAP4(*server.server_address)
+		imap.login("bot", "secret")
+		return imap
+
+	def on_wake(imap):
+		calls.append(time.monotonic())
+		if len(calls) >= wakes:
+			raise Stop()
+
+	session = idle.IdleSession("inbox", connect=connect, **kwargs)
+	with pytest.raises(Stop):
+		session.run(on_wake)
+	session.close()
+	return calls
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+	monkeypatch.setattr(idle, "BACKOFF_START", 0.01)
+	monkeypatch.setattr(idle, "BACKOFF_MAX", 0.05)
+
+def test_idle_wakes_on_new_mail():
+	with StubIMAPServer(["push"]) as server:
+		calls = run_session(server, 2, idle_timeout=30)
+
+	# Woken by the pushed EXISTS, long before the IDLE timeout
+	assert calls[1] - calls[0] < 5
+	assert server.commands.count("IDLE") == 1
+	assert "DONE" in server.commands
+
+def test_idle_wakes_on_mail_sent_with_continuation():
+	with StubIMAPServer(["coalesce"]) as server:
+		calls = run_session(server, 2, idle_timeout=30)
+
+	# The EXISTS already sits in imaplib's buffer, select alone would miss it
+	assert calls[1] - calls[0] < 5
+	assert server.commands.count("IDLE") == 1
+
+def test_idle_timeout_reissues_idle():
+	with StubIMAPServer(["silent"]) as server:
+		run_session(server, 3, idle_timeout=0.2)
+
+	assert server.commands.count("IDLE") == 2
+	assert server.commands.count("DONE") == 2
+	assert server.connections == 1
+
+def test_noop_fallback_without_idle():
+	with StubIMAPServer(["silent"], capabilities=("IMAP4rev1",)) as server:
+		run_session(server, 2, idle_timeout=30, noop_interval=0.05)
+
+	assert "IDLE" not in server.commands
+	assert server.commands.count("NOOP") == 2
+
+def test_reconnects_after_dropped_connection(monkeypatch):
+	sleeps = []
+	sleep = time.sleep
+	monkeypatch.setattr(idle.time, "sleep", lambda seconds: sleeps.append(seconds) or sleep(seconds))
+
+	with StubIMAPServer(["drop", "push"]) as server:
+		calls = run_session(server, 3, idle_timeout=30)
+
+	# on_wake runs after each connect and once more after the pushed mail
+	assert server.connections == 2
+	assert len(calls) == 3
+	assert sleeps == [idle.BACKOFF_START]
@@ -0,0 +1,101 @@
+# ############################################################################ #
+#                              MAINTENANCE HISTORY                             #
+# ############################################################################ #
+# DATE         Description
+# ------------ -----------------------------------------------------------------
+# 18-OCT-2026  Initial Draft
+# ============================================================================ #
+
+# ================================== IMPORTS ================================= #
+from datetime import datetime, timedelta
+from email.mime.text import MIMEText
+
+from MailServer import outbox
+
+# ================================== CLASSES ================================= #
+class FakeSender:
+	"""Records messages instead of talking to an SMTP server."""
+	def __init__(self):
+		self.server = None
+		self.sent = []
+
+	def connect(self):
+		self.server = object()
+
+	def close(self):
+		self.server = None
+
+	def send(self, from_addr, to_addr, message):
+		self.sent.append(to_addr)
+
+# ================================= FUNCTIONS ================================ #
+def queue(db, to_addr="client@example.com"):
+	mail = MIMEText("body")
+	mail["Message-ID"] = f"<{to_addr}-{datetime.now().timestamp()}@test>"
+	mail["Subject"] = "subject"
+	return outbox.enqueue(db, mail, to_addr, from_addr="bot@example.com")
+
+def test_claim_is_granted_once(db):
+	row_id = queue(db)
+
+	assert outbox.claim(db, db['outbox'], row_id)
+	assert not outbox.claim(db, db['outbox'], row_id)
+	row = db['outbox'].find_one(id=row_id)
+	assert row['status'] == 'sending'
+	assert row['attempts'] == 1
+
+def test_flush_sends_each_mail_once(db):
+	queue(db, "a@example.com")
+	queue(db, "b@example.com")
+	sender = FakeSender()
+
+	assert outbox.flush(db, sender) == 2
+	assert outbox.flush(db, sender) == 0
+	assert sorted(sender.sent) == ["a@example.com", "b@example.com"]
+	assert {row['status'] for row in db['outbox'].all()} == {'sent'}
+
+def test_flush_skips_rows_claimed_elsewhere(db):
+	row_id = queue(db)
+	outbox.claim(db, db['outbox'], row_id)
+	sender = FakeSender()
+
+	assert outbox.flush(db, sender) == 0
+	assert sender.sent == []
+
+def test_recover_stale_requeues_until_attempts_run_out(db):
+	table = db['outbox']
+	expired = datetime.now() - timedelta(seconds=1)
+	retry = queue(db)
+	exhausted = queue(db)
+	table.update(dict(id=retry, status='sending', attempts=1, next_attempt_at=expired), ['id'])
+	table.update(dict(id=exhausted, status='sending', attempts=outbox.MAX_ATTEMPTS, next_attempt_at=expired), ['id'])
+
+	outbox.recover_stale(db, table)
+
+	assert table.find_one(id=retry)['status'] == 'pending'
+	assert table.find_one(id=retry)['last_error'] == outbox.STALE_ERROR
+	assert table.find_one(id=exhausted)['status'] == 'failed'
+
+def test_recover_stale_leaves_live_claims(db):
+	row_id = queue(db)
+	outbox.claim(db, db['outbox'], row_id)
+
+	outbox.recover_stale(db, db['outbox'])
+
+	assert db['outbox'].find_one(id=row_id)['status'] == 'sending'
+
+def test_sent_mail_is_recorded_after_a_failed_update(db, monkeypatch):
+	row_id = queue(db)
+	record_sent = outbox.record_sent
+	calls = []
+
+	def flaky(db, table, row):
+		calls.append(row['id'])
+		if len(calls) == 1:
+			raise RuntimeError("database is locked")
+		record_sent(db, table, row)
+
+	monkeypatch.setattr(outbox, "record_sent", flaky)
+	assert outbox.flush(db, FakeSender()) == 1
+	assert calls == [row_id, row_id]
+	assert db['outbox'].find_one(id=row_id)['status'] == 'sent'
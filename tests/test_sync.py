@@ -0,0 +1,94 @@
+# ############################################################################ #
+#                              MAINTENANCE HISTORY                             #
+# ############################################################################ #
+# DATE         Description
+# ------------ -----------------------------------------------------------------
+# 18-OCT-2026  Initial Draft
+# ============================================================================ #
+
+# ================================== IMPORTS ================================= #
+import pytest
+
+from MailServer import sync
+from MailServer.sync import MailboxSync
+
+# ================================== CLASSES ================================= #
+class FakeIMAP:
+	"""A selected mailbox holding uids, answering SELECT with its codes."""
+	capabilities = ()
+
+	def __init__(self, uids, uidvalidity=7):
+		self.uids = list(uids)
+		self.uidvalidity = uidvalidity
+		self.selects = 0
+		self._responses = {}
+
+	def select(self, mailbox):
+		self.selects += 1
+		self._responses = {
+			"EXISTS": [str(len(self.uids)).encode()],
+			"UIDVALIDITY": [str(self.uidvalidity).encode()],
+			"UIDNEXT": [str(max(self.uids, default=0) + 1).encode()],
+		}
+		return 'OK', [str(len(self.uids)).encode()]
+
+	def response(self, code):
+		return code, self._responses.pop(code, [None])
+
+# ================================= FUNCTIONS ================================ #
+@pytest.fixture(autouse=True)
+def fake_search(monkeypatch):
+	"""Matches every mail in the UID range to the first client."""
+	def search_clients(imap_server, clients, *criteria, field='FROM'):
+		low = int(criteria[1].split(":")[0])
+		return {uid: clients[0] for uid in imap_server.uids if uid >= low}
+	monkeypatch.setattr(sync, "search_clients", search_clients)
+
+def sync_once(db, imap, clients=("a@example.com",), purpose='fetch', failed=()):
+	cursor = MailboxSync('inbox', db, purpose=purpose)
+	pending = cursor.pending(imap, list(clients))
+	cursor.commit(failed)
+	return sorted(pending)
+
+def test_only_new_mails_above_the_cursor(db):
+	imap = FakeIMAP([1, 2, 3])
+	assert sync_once(db, imap) == [1, 2, 3]
+	assert sync_once(db, imap) == []
+
+	imap.uids += [4, 5]
+	assert sync_once(db, imap) == [4, 5]
+
+def test_status_comes_from_a_fresh_select(db):
+	imap = FakeIMAP([1, 2])
+	sync_once(db, imap)
+	sync_once(db, imap)
+
+	assert imap.selects == 2
+
+def test_changed_uidvalidity_resyncs(db):
+	imap = FakeIMAP([1, 2, 3])
+	sync_once(db, imap)
+
+	imap.uidvalidity = 8
+	assert sync_once(db, imap) == [1, 2, 3]
+
+def test_changed_clients_resync(db):
+	imap = FakeIMAP([1, 2, 3])
+	sync_once(db, imap)
+
+	assert sync_once(db, imap, clients=("a@example.com", "b@example.com")) == [1, 2, 3]
+	assert sync_once(db, imap, clients=("b@example.com", "a@example.com")) == []
+
+def test_purposes_keep_their_own_cursor(db):
+	imap = FakeIMAP([1, 2, 3])
+	sync_once(db, imap, purpose='fetch')
+
+	assert sync_once(db, imap, purpose='backfill') == [1, 2, 3]
+	assert {row['mailbox'] for row in db['sync_state'].all()} == {'fetch:inbox', 'backfill:inbox'}
+
+def test_cursor_stops_before_the_first_failure(db):
+	imap = FakeIMAP([1, 2, 3, 4])
+	sync_once(db, imap, failed={3})
+
+	assert db['sync_state'].find_one(mailbox='fetch:inbox')['last_uid'] == 2
+	assert sync_once(db, imap) == [3, 4]